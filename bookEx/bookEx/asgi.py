@@ -12,5 +12,10 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookEx.settings')
+# The ASGI profile serves the catalog pages from async views. Persistent
+# connections are tied to the thread that opened them and async requests
+# hop between threads, so connections are closed after each request here.
+os.environ.setdefault('BOOKEX_ASYNC_VIEWS', '1')
+os.environ.setdefault('BOOKEX_DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bookMng.middleware.ViewStatsMiddleware',
+    'bookMng.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +52,21 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-view latency/query statistics (bookMng.middleware.ViewStatsMiddleware).
+# Off by default; the middleware removes itself from the chain when disabled.
+VIEW_STATS_ENABLED = os.environ.get('BOOKEX_VIEW_STATS', '') == '1'
+VIEW_STATS_WINDOW = 1000
+
+# Serve displaybooks, searchbooks, book_detail and favorite_list from their
+# async variants. bookEx/asgi.py turns this on; under WSGI every async view
+# would pay for an event loop per request, so it stays off there.
+ASYNC_CATALOG_VIEWS = os.environ.get('BOOKEX_ASYNC_VIEWS', '') == '1'
+
+# Background tasks (bookMng.tasks): 'database' rows run by `manage.py run_tasks`,
+# 'redis' (needs the redis package) or 'immediate' to run them inline.
+TASK_BACKEND = os.environ.get('BOOKEX_TASK_BACKEND', 'database')
+TASK_REDIS_URL = os.environ.get('BOOKEX_TASK_REDIS_URL', 'redis://localhost:6379/0')
+
 ROOT_URLCONF = 'bookEx.urls'
 
 TEMPLATES = [
@@ -62,6 +79,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'bookMng.context_processors.main_menu',
+                'bookMng.context_processors.cart_summary',
             ],
         },
     },
@@ -73,12 +92,81 @@ WSGI_APPLICATION = 'bookEx.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment:
+#   BOOKEX_DB_ENGINE         sqlite (default) or postgresql
+#   BOOKEX_DB_NAME           database name, or the SQLite file path
+#   BOOKEX_DB_USER / _PASSWORD / _HOST / _PORT   PostgreSQL credentials
+#   BOOKEX_DB_CONN_MAX_AGE   seconds to keep a connection open (default 60)
+#   BOOKEX_DB_POOL=1         use psycopg's connection pool instead of CONN_MAX_AGE
+#   BOOKEX_DB_REPLICA_HOSTS  comma-separated read replicas of the PostgreSQL primary
+DB_ENGINE = os.environ.get('BOOKEX_DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    _db_pool = os.environ.get('BOOKEX_DB_POOL', '') == '1'
+    _primary = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('BOOKEX_DB_NAME', 'bookex'),
+        'USER': os.environ.get('BOOKEX_DB_USER', ''),
+        'PASSWORD': os.environ.get('BOOKEX_DB_PASSWORD', ''),
+        'HOST': os.environ.get('BOOKEX_DB_HOST', ''),
+        'PORT': os.environ.get('BOOKEX_DB_PORT', ''),
+        # A pool hands out connections itself, so Django must not keep them
+        'CONN_MAX_AGE': 0 if _db_pool else int(os.environ.get('BOOKEX_DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': True} if _db_pool else {},
     }
-}
+    DATABASES = {'default': _primary}
+    for _i, _host in enumerate(filter(None, os.environ.get('BOOKEX_DB_REPLICA_HOSTS', '').split(',')), 1):
+        DATABASES[f'replica{_i}'] = {**_primary, 'HOST': _host.strip(), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('BOOKEX_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.environ.get('BOOKEX_DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds a writer waits for the lock before "database is locked"
+                'timeout': 20,
+                # Take the write lock at BEGIN so a read-then-write transaction
+                # never fails mid-way on a lock upgrade the busy timeout can't retry
+                'transaction_mode': 'IMMEDIATE',
+                # Per-connection tuning only. WAL, which lets readers run alongside
+                # the single writer, is stored in the file, so migration 0025
+                # switches it once instead of every connection rewriting it
+                'init_command': (
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=268435456;'
+                    'PRAGMA cache_size=-65536;'
+                ),
+            },
+        }
+    }
+
+# Read-only listing views served from a replica when any are configured; see
+# bookMng.routers. Requests within DATABASE_REPLICA_PIN_SECONDS of a write by
+# the same browser stay on the primary so they see their own changes.
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_REPLICA_VIEWS = ('displaybooks', 'searchbooks', 'book_detail',
+                          'api_book_list', 'api_book_search', 'api_book_detail')
+DATABASE_REPLICA_PIN_SECONDS = 10
+DATABASE_ROUTERS = ['bookMng.routers.ReadReplicaRouter']
+
+# The cache holds state every worker must agree on: fragment and page versions
+# (bookMng.fragments), the main menu, the cart summaries and the per-worker
+# stats `manage.py viewstats` reads (bookMng.viewstats). With more than
+# one process it has to be shared:
+#   BOOKEX_CACHE_URL=redis://host:6379/1   Redis (needs the redis package)
+#   BOOKEX_CACHE_URL=db                     the bookmng_cache table (manage.py createcachetable)
+# Unset, each process keeps its own LocMem cache, which is only right for a
+# single process (runserver, tests); `manage.py check` warns otherwise.
+CACHE_URL = os.environ.get('BOOKEX_CACHE_URL', '')
+if CACHE_URL.startswith(('redis://', 'rediss://')):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}}
+elif CACHE_URL == 'db':
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'bookmng_cache'}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
 
 
 # Password validation
@@ -117,6 +205,21 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# collectstatic writes content-hashed copies (and .gz/.br variants of text
+# assets) here; bookMng.serving serves them with far-future caching.
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'bookMng.storage.HashedStaticStorage'},
+}
+
+# Let the front-end server send file bodies instead of a worker:
+# 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel-redirect' (nginx,
+# with internal locations SENDFILE_ACCEL_PREFIX + 'static/' and + 'media/').
+SENDFILE_BACKEND = os.environ.get('BOOKEX_SENDFILE', '')
+SENDFILE_ACCEL_PREFIX = '/protected/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -125,6 +228,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'bookEx/static')
 ]
+# The last finder resolves uploaded covers (Book.pic_path) in MEDIA_ROOT
+STATICFILES_FINDERS = [
+    'django.contrib.staticfiles.finders.FileSystemFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'bookMng.finders.PictureFinder',
+]
 # LOGIN / LOGOUT REDIRECTS -- CRITICAL FIX FOR YOUR APP!
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
@@ -20,7 +20,7 @@ from django.views.generic.base import TemplateView
 from bookMng.views import Register
 from django.urls import include
 from django.conf import settings
-from django.conf.urls.static import static
+from bookMng import serving
 
 urlpatterns = [
     path("admin/", admin.site.urls),
@@ -31,5 +31,9 @@ urlpatterns = [
     path('', include('django.contrib.auth.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Served with ETags, ranges and long caching in production too; runserver's
+# own static handler still answers static/ first when DEBUG is on
+urlpatterns += [
+    path(settings.STATIC_URL.lstrip('/') + '<path:path>', serving.static_file, name='static_file'),
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serving.media_file, name='media_file'),
+]
\ No newline at end of file
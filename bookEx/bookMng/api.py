@@ -0,0 +1,162 @@
+"""
+Read-only JSON API over the catalog, for clients that only need a few fields.
+
+    GET api/books           every book, keyset-paginated (after, before, per_page, sort=id|price)
+    GET api/books/search    the search page filters: q, min_rating, price_min, price_max
+    GET api/books/<id>      one book
+
+``?fields=id,name,price`` picks the columns; the default is all of FIELDS.
+Rows come from ``.values()``, so no Book instances are built and a join is
+only made when a requested field needs it. Bodies are compact JSON,
+compressed with brotli (when installed) or gzip, and carry a strong ETag per
+encoding: a client polling with If-None-Match gets a bodiless 304 until the
+data it asked for changes.
+"""
+import gzip
+import hashlib
+import json
+import re
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.http import HttpResponse, JsonResponse
+from django.templatetags.static import static
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used without it
+    brotli = None
+
+from . import search
+from .models import Book
+from .pagination import paginate
+
+# Public name -> values() argument: a column name, or an expression
+FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'web': 'web',
+    'price': 'price',
+    'quantity': 'quantity',
+    'publishdate': 'publishdate',
+    'posted_by': F('username__username'),
+    'rating_count': 'rating_count',
+    'rating_avg': 'rating_avg',
+    'thumbnail': Coalesce(NullIf('thumb_path', Value('')), 'pic_path'),
+    'cover': Coalesce(NullIf('cover_path', Value('')), 'pic_path'),
+}
+STATIC_FIELDS = ('thumbnail', 'cover')
+MIN_COMPRESS_SIZE = 200  # as GZipMiddleware: smaller bodies don't shrink
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _requested_fields(request):
+    requested = request.GET.get('fields')
+    if not requested:
+        return list(FIELDS)
+    names = list(dict.fromkeys(name.strip() for name in requested.split(',') if name.strip()))
+    unknown = [name for name in names if name not in FIELDS]
+    if unknown or not names:
+        raise BadRequest(f'Unknown field(s): {", ".join(unknown) or "(none given)"}. '
+                         f'Choose from {", ".join(FIELDS)}.')
+    return names
+
+
+def _values(queryset, names):
+    columns = [FIELDS[name] for name in names if isinstance(FIELDS[name], str)]
+    expressions = {name: FIELDS[name] for name in names if not isinstance(FIELDS[name], str)}
+    # The keyset cursor needs the ordering keys even when they weren't asked for
+    columns += [key for key in ('id', 'price', 'search_rank')
+                if key not in columns and (key != 'search_rank' or key in queryset.query.annotations)]
+    return queryset.values(*columns, **expressions)
+
+
+def _serialize(row, names):
+    data = {name: row[name] for name in names}
+    for name in STATIC_FIELDS:
+        if data.get(name):
+            data[name] = static(data[name])
+    return data
+
+
+def _encoding(request, size):
+    accepted = request.headers.get('Accept-Encoding', '')
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    if brotli is not None and re.search(r'\bbr\b', accepted):
+        return 'br'
+    if re.search(r'\bgzip\b', accepted):
+        return 'gzip'
+    return None
+
+
+def json_response(request, payload):
+    """
+    Compact JSON for ``payload``, or a 304 if the client's ETag matches.
+    The ETag hashes the uncompressed body and names the encoding, so each
+    byte-for-byte representation has its own strong validator.
+    """
+    body = json.dumps(payload, cls=DjangoJSONEncoder, separators=(',', ':')).encode()
+    encoding = _encoding(request, len(body))
+    digest = hashlib.md5(body).hexdigest()
+    etag = f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        if encoding == 'br':
+            body = brotli.compress(body)
+        elif encoding == 'gzip':
+            body = gzip.compress(body, compresslevel=6, mtime=0)  # mtime=0 keeps the bytes stable
+        response = HttpResponse(body, content_type='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    patch_vary_headers(response, ['Accept-Encoding'])
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def _list(request, queryset, ordering):
+    try:
+        names = _requested_fields(request)
+    except BadRequest as exc:
+        return _error(str(exc), 400)
+    page = paginate(request, _values(queryset, names), ordering=ordering)
+    return json_response(request, {
+        'results': [_serialize(row, names) for row in page],
+        'next': page.next_cursor,
+        'previous': page.previous_cursor,
+    })
+
+
+@require_safe
+def book_list(request):
+    return _list(request, Book.objects.all(), 'id')
+
+
+@require_safe
+def book_search(request):
+    books = search.filter_catalog(Book.objects.all(), request.GET)
+    return _list(request, books, 'relevance' if request.GET.get('q') else 'id')
+
+
+@require_safe
+def book_detail(request, book_id):
+    try:
+        names = _requested_fields(request)
+    except BadRequest as exc:
+        return _error(str(exc), 400)
+    row = _values(Book.objects.filter(pk=book_id), names).first()
+    if row is None:
+        return _error('No such book.', 404)
+    return json_response(request, _serialize(row, names))
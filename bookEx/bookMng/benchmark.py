@@ -0,0 +1,179 @@
+"""
+Synthetic data and timing harness behind ``manage.py benchmark``.
+
+``seed()`` bulk-creates a catalog of a given size with users, ratings,
+comments, favorites and cart rows in fixed proportions from a seeded RNG, so
+two runs at the same scale see the same data. ``run_scenarios()`` drives the
+bookMng views through the Django test client and reports latency
+percentiles, query counts and peak Python memory per view.
+"""
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import search
+from .models import Book, Comment, Order, OrderLine, OwnedBook, Rate, ShoppingCart
+from .pagination import encode_cursor
+from .ratings import rebuild_rating_aggregates
+from .viewstats import percentile
+
+BATCH_SIZE = 2000
+BENCH_USERNAME = 'bench-user'
+WORDS = ('river', 'night', 'garden', 'empire', 'shadow', 'python', 'django', 'winter',
+         'glass', 'ocean', 'silent', 'history', 'machine', 'letters', 'mountain', 'engine')
+
+
+def _batched(objects, model):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def seed(books, seed=1, stdout=None):
+    """
+    Populate the current database with ``books`` books and proportional
+    activity: one user per 10 books, 3 ratings, 2 comments and 1 favorite per
+    book, and an order history plus an open cart for the benchmark user.
+    """
+    rng = random.Random(seed)
+    n_users = max(books // 10, 10)
+    password = make_password('bench')
+
+    _batched((User(username=f'bench{i}', password=password) for i in range(n_users)), User)
+    bench_user = User.objects.create(username=BENCH_USERNAME, password=password)
+    user_ids = list(User.objects.exclude(pk=bench_user.pk).values_list('pk', flat=True))
+
+    _batched((Book(name=' '.join(rng.choice(WORDS) for _ in range(3)).title() + f' {i}',
+                   web='https://example.com', price=Decimal(rng.randint(100, 9000)) / 100,
+                   picture='bookEx/static/uploads/images.jpg', pic_path='uploads/images.jpg',
+                   username_id=rng.choice(user_ids), quantity=rng.randint(0, 50))
+              for i in range(books)), Book)
+    book_ids = list(Book.objects.values_list('pk', flat=True))
+
+    pairs = set()
+    while len(pairs) < min(books * 3, len(user_ids) * len(book_ids)):
+        pairs.add((rng.choice(user_ids), rng.choice(book_ids)))
+    _batched((Rate(user_id=u, book_id=b, rating=rng.randint(1, 5)) for u, b in pairs), Rate)
+    rebuild_rating_aggregates()
+
+    _batched((Comment(book_id=rng.choice(book_ids), user_id=rng.choice(user_ids),
+                      content=' '.join(rng.choice(WORDS) for _ in range(12)))
+              for _ in range(books * 2)), Comment)
+
+    Favorite = Book.favorites.through
+    favorites = {(rng.choice(user_ids), rng.choice(book_ids)) for _ in range(books)}
+    favorites.update((bench_user.pk, b) for b in rng.sample(book_ids, min(50, books)))
+    _batched((Favorite(user_id=u, book_id=b) for u, b in favorites), Favorite)
+
+    Book.objects.filter(pk__in=rng.sample(book_ids, min(30, books))).update(username=bench_user)
+    purchased = [(b, rng.randint(1, 3)) for b in rng.sample(book_ids, min(200, books))]
+    order = Order.objects.create(user=bench_user)
+    _batched((OrderLine(order=order, book_id=b, quantity=q, unit_price=Decimal('10.00'))
+              for b, q in purchased), OrderLine)
+    _batched((OwnedBook(user=bench_user, book_id=b, quantity=q) for b, q in purchased), OwnedBook)
+    _batched((ShoppingCart(user=bench_user, book_id=b, quantity=1)
+              for b in rng.sample(book_ids, min(5, books))), ShoppingCart)
+
+    search.reset_availability()
+    search.rebuild_index()
+    if stdout:
+        stdout.write(f'  seeded {books} books, {len(user_ids) + 1} users, {len(pairs)} ratings, '
+                     f'{books * 2} comments, {len(favorites)} favorites')
+    return bench_user
+
+
+def scenarios(bench_user):
+    """(name, method, url, params) for every view the benchmark drives."""
+    book_id = Book.objects.order_by('-rating_count', 'pk').values_list('pk', flat=True).first()
+    # Cursor 30 rows from the end of the catalog, to show deep pages cost the same as page 1
+    deep_after = list(Book.objects.order_by('-pk').values_list('pk', flat=True)[:30])[-1]
+
+    return [
+        ('displaybooks', 'get', reverse('displaybooks'), {}),
+        ('displaybooks_deep', 'get', reverse('displaybooks'), {'after': encode_cursor([deep_after])}),
+        ('searchbooks', 'get', reverse('searchbooks'), {'q': 'river'}),
+        ('searchbooks_filtered', 'get', reverse('searchbooks'),
+         {'q': 'garden', 'min_rating': '3', 'price_max': '50'}),
+        ('book_detail', 'get', reverse('book_detail', args=[book_id]), {}),
+        ('book_comments', 'get', reverse('book_comments', args=[book_id]), {}),
+        ('mybooks', 'get', reverse('mybooks'), {}),
+        ('checkout', 'get', reverse('checkout'), {}),
+        ('add_to_cart', 'get', reverse('add_to_cart', args=[book_id]), {}),
+    ]
+
+
+def _measure(client, method, url, params, iterations, warmup):
+    call = getattr(client, method)
+    for _ in range(warmup):
+        call(url, params)
+
+    timings, query_counts = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = call(url, params)
+            timings.append((time.perf_counter() - started) * 1000)
+        query_counts.append(len(captured))
+        if response.status_code >= 400:
+            raise RuntimeError(f'{url} returned {response.status_code}')
+
+    # Separate pass: tracemalloc slows allocation-heavy code, so keep it out of the timings
+    tracemalloc.start()
+    call(url, params)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'mean_ms': round(statistics.fmean(timings), 2),
+        'queries': max(query_counts),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_scenarios(bench_user, iterations=20, warmup=3, only=None):
+    client = Client()
+    client.force_login(bench_user)
+    results = {}
+    for name, method, url, params in scenarios(bench_user):
+        if only and name not in only:
+            continue
+        results[name] = _measure(client, method, url, params, iterations, warmup)
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    List regressions of ``results`` against ``baseline``: a p50/p95 latency
+    more than ``tolerance`` slower, any extra query, or more than
+    ``tolerance`` extra peak memory. Both arguments map scale -> view -> metrics.
+    """
+    regressions = []
+    for scale, views in results.items():
+        for view, metrics in views.items():
+            base = baseline.get(scale, {}).get(view)
+            if not base:
+                continue
+            for key in ('p50_ms', 'p95_ms', 'peak_kb'):
+                if base.get(key) and metrics[key] > base[key] * (1 + tolerance):
+                    regressions.append(f'{scale}/{view}: {key} {base[key]} -> {metrics[key]}')
+            if metrics['queries'] > base.get('queries', metrics['queries']):
+                regressions.append(f'{scale}/{view}: queries {base["queries"]} -> {metrics["queries"]}')
+    return regressions
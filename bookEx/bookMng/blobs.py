@@ -0,0 +1,222 @@
+"""
+Reference counts and garbage collection for Book pictures.
+
+Pictures are stored once per content (storage.ContentAddressedStorage), so
+books with the same cover share one file. Editing or deleting a book
+therefore can't delete its file outright. Blob counts the books using each
+stored name:
+- Book saves and deletes adjust it (signals.py);
+- import_books adds the books it bulk-creates (catalog_io.py);
+- ``recount()`` rebuilds every count from the Book table.
+
+A count that drops to zero only marks the blob orphaned. ``collect()``
+deletes files orphaned for longer than GRACE, together with their resized
+variants. It also sweeps blobs that never got a count, i.e. uploads whose
+book was never saved. Before deleting a file it asks Book once more, so a
+count that drifted can't remove a picture still in use. Orphaning queues a
+collection at most once per COLLECT_SECONDS; ``manage.py collect_blobs``
+runs one by hand.
+"""
+import os
+import posixpath
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import fragments, images
+from .models import Blob, Book
+from .storage import blob_name, file_digest, is_blob
+
+GRACE = timedelta(hours=1)
+COLLECT_SECONDS = 60 * 60
+COLLECT_LOCK_KEY = 'bookMng:blobs:collect_queued'
+
+
+def _field():
+    return Book._meta.get_field('picture')
+
+
+def _add(name, delta):
+    blobs = Blob.objects.filter(name=name)
+    changes = {'refcount': F('refcount') + delta}
+    if delta > 0:
+        changes['orphaned_at'] = None
+    if blobs.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(name=name, refcount=delta)
+    except IntegrityError:
+        # Another request created the row first
+        blobs.update(**changes)
+
+
+def add_references(names):
+    for name, count in Counter(name for name in names if name).items():
+        _add(name, count)
+
+
+def drop_references(names):
+    counts = Counter(name for name in names if name)
+    for name, count in counts.items():
+        _add(name, -count)
+    if counts:
+        Blob.objects.filter(name__in=list(counts), refcount__lte=0, orphaned_at=None).update(
+            orphaned_at=timezone.now())
+        _schedule_collect()
+
+
+def _schedule_collect():
+    from . import tasks
+    # cache.add only succeeds for the first caller in each COLLECT_SECONDS
+    if cache.add(COLLECT_LOCK_KEY, True, COLLECT_SECONDS):
+        tasks.collect_blobs.delay()
+
+
+def recount():
+    """Rebuild every count from the Book table; returns the number of names in use."""
+    counts = dict(Book.objects.exclude(picture='').values_list('picture').annotate(n=Count('id')).order_by())
+    in_use = len(counts)
+    now = timezone.now()
+    with transaction.atomic():
+        changed = []
+        for blob in Blob.objects.all().iterator():
+            count = counts.pop(blob.name, 0)
+            if blob.refcount != count:
+                blob.refcount = count
+                blob.orphaned_at = None if count else blob.orphaned_at or now
+                changed.append(blob)
+        Blob.objects.bulk_update(changed, ['refcount', 'orphaned_at'], batch_size=500)
+        Blob.objects.bulk_create((Blob(name=name, refcount=count) for name, count in counts.items()),
+                                 batch_size=500)
+    return in_use
+
+
+def _delete_unused(storage, name, cutoff=None):
+    """Delete ``name`` and its variants unless a book uses it or it was stored after ``cutoff``."""
+    with transaction.atomic():
+        in_use = Book.objects.filter(picture=name).count()
+        if in_use:
+            # The count drifted (a queryset update, a restored backup); trust the books
+            Blob.objects.filter(name=name).update(refcount=in_use, orphaned_at=None)
+            return None
+        if cutoff and storage.exists(name) and storage.get_modified_time(name) > cutoff:
+            # Uploaded (or uploaded again) too recently; its book may not be saved yet
+            return None
+        freed = 0
+        for file_name in [name, *images.variant_names(storage, name).values()]:
+            if storage.exists(file_name):
+                freed += storage.size(file_name)
+                storage.delete(file_name)
+        Blob.objects.filter(name=name).delete()
+    return freed
+
+
+def collect(grace=GRACE):
+    """Delete pictures no book has used for ``grace``; returns ``(files, bytes)`` freed."""
+    storage = _field().storage
+    cutoff = timezone.now() - grace
+    names = set(Blob.objects.filter(refcount__lte=0, orphaned_at__lte=cutoff).values_list('name', flat=True))
+    counted = set(Blob.objects.values_list('name', flat=True))
+    names.update(name for name in storage.blobs(_field().upload_to) if name not in counted)
+
+    files = freed = 0
+    for name in sorted(names):
+        size = _delete_unused(storage, name, cutoff)
+        if size is not None:
+            files += 1
+            freed += size
+    return files, freed
+
+
+def discard(names):
+    """
+    Delete blobs stored for books that were never saved, e.g. by a failed
+    import batch. Blobs with a count (stored for another book before) stay.
+    """
+    storage = _field().storage
+    names = {name for name in names if name and is_blob(name)}
+    counted = set(Blob.objects.filter(name__in=names).values_list('name', flat=True))
+    for name in sorted(names - counted):
+        _delete_unused(storage, name)
+
+
+def _static_name(name):
+    # pic_path style: the name below the storage's static/ directory
+    return posixpath.relpath(name, posixpath.dirname(_field().upload_to))
+
+
+def _legacy_path(storage, name):
+    """The file a legacy picture name was shown from, or None if it is gone."""
+    # Pictures were once stored relative to BASE_DIR, i.e. in the static
+    # directory the pages link them from; that copy wins over storage's
+    path = finders.find(_static_name(name))
+    if path is None and storage.exists(name):
+        path = storage.path(name)
+    return path
+
+
+def _legacy_directories(storage):
+    upload_to = _field().upload_to
+    directories = finders.find(_static_name(upload_to), find_all=True) + [storage.path(upload_to)]
+    return list(dict.fromkeys(path for path in directories if os.path.isdir(path)))
+
+
+def _remove_duplicates(storage, in_use):
+    """Delete legacy uploads whose content is already a blob; returns the number deleted."""
+    upload_to = _field().upload_to
+    removed = 0
+    for directory in _legacy_directories(storage):
+        for entry in os.scandir(directory):
+            if not entry.is_file() or entry.name.startswith('.'):
+                continue
+            name = posixpath.join(upload_to, entry.name)
+            if name in in_use:
+                continue
+            if storage.exists(blob_name(name, file_digest(entry.path))):
+                os.remove(entry.path)
+                Blob.objects.filter(name=name, refcount__lte=0).delete()
+                removed += 1
+    return removed
+
+
+def adopt():
+    """
+    Move pictures stored before content addressing into blobs, merging the
+    duplicates; returns ``(books moved, files deleted)``.
+
+    Legacy files are looked up where the pages found them (the static
+    upload directory, else storage). Once no book uses a legacy file, it is
+    deleted if its content is now stored as a blob; files with no blob
+    copy, such as other static assets, are left alone.
+    """
+    from . import tasks
+    storage = _field().storage
+    moved = 0
+    names = Book.objects.exclude(picture='').values_list('picture', flat=True).distinct().order_by()
+    for name in list(names):
+        if is_blob(name):
+            continue
+        path = _legacy_path(storage, name)
+        if path is None:
+            continue
+        with open(path, 'rb') as f:
+            blob = storage.save(posixpath.join(_field().upload_to, posixpath.basename(name)), File(f))
+        with transaction.atomic():
+            ids = list(Book.objects.filter(picture=name).values_list('pk', flat=True))
+            Book.objects.filter(pk__in=ids).update(
+                picture=blob, pic_path=images.static_path(storage.url(blob)), thumb_path='', cover_path='')
+            add_references([blob] * len(ids))
+            drop_references([name] * len(ids))
+        fragments.bump_books(ids)
+        tasks.generate_covers_for_books.delay(ids)
+        moved += len(ids)
+
+    in_use = set(Book.objects.exclude(picture='').values_list('picture', flat=True))
+    return moved, _remove_duplicates(storage, in_use)
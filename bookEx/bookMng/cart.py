@@ -0,0 +1,82 @@
+"""
+The open shopping cart: its lines, its totals and the summary in the nav bar.
+
+Line totals and the grand total are computed by the database. The summary
+(copies in the cart, total price) is cached per user, so rendering it on
+every page normally costs no query. Every path that changes a cart or the
+price of a book in one calls ``invalidate()``:
+- orders.add_to_cart and orders.checkout;
+- set_quantity and clear below;
+- Book saves (see signals.py).
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ShoppingCart
+
+CACHE_KEY = 'bookMng:cart_summary'
+CACHE_TIMEOUT = 60 * 60
+EMPTY = {'count': 0, 'total': Decimal('0.00')}
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+LINE_TOTAL = ExpressionWrapper(F('quantity') * F('book__price'), output_field=MONEY)
+
+
+def open_lines(user):
+    return ShoppingCart.objects.filter(user=user, checked_out=False)
+
+
+def lines(user):
+    """The cart's rows with their books, each annotated with ``line_total``."""
+    return open_lines(user).select_related('book').annotate(line_total=LINE_TOTAL).order_by('id')
+
+
+def aggregate(cart_lines):
+    """``{'count': copies, 'total': price}`` of ``cart_lines`` from one aggregate query."""
+    return cart_lines.order_by().aggregate(
+        count=Coalesce(Sum('quantity'), 0),
+        total=Coalesce(Sum(LINE_TOTAL), Value(Decimal('0.00')), output_field=MONEY),
+    )
+
+
+def totals(user):
+    return aggregate(open_lines(user))
+
+
+def _key(user_id):
+    return f'{CACHE_KEY}:{user_id}'
+
+
+def summary(user):
+    """Cached ``totals()`` for the nav bar; EMPTY for anonymous users."""
+    if not user.is_authenticated:
+        return EMPTY
+    data = cache.get(_key(user.pk))
+    if data is None:
+        data = totals(user)
+        cache.set(_key(user.pk), data, CACHE_TIMEOUT)
+    return data
+
+
+def invalidate(user_ids):
+    """Forget the cached summaries of ``user_ids`` now and again once the transaction commits."""
+    keys = [_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def set_quantity(user, book, quantity):
+    """Change the copies of ``book`` in the cart; returns False if it isn't there."""
+    updated = open_lines(user).filter(book=book).update(quantity=quantity)
+    invalidate([user.pk])
+    return bool(updated)
+
+
+def clear(user):
+    open_lines(user).delete()
+    invalidate([user.pk])
@@ -0,0 +1,183 @@
+"""
+Streaming book import and export behind ``manage.py import_books`` and
+``manage.py export_books``.
+
+Both sides work row by row: the reader yields one dict per CSV/JSONL line,
+imports are validated through BookForm and written with bulk_create one batch
+at a time, and exports read the table with ``.iterator()``. Memory therefore
+depends on the batch size, not on the size of the file.
+"""
+import csv
+import json
+import os
+import time
+from decimal import Decimal
+
+from django.core.files import File
+from django.db import DatabaseError, transaction
+
+from . import blobs, tasks
+from .forms import BookForm
+from .models import Book
+
+FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ('id', 'name', 'web', 'price', 'quantity', 'publishdate', 'posted_by', 'picture',
+                 'rating_count', 'rating_avg')
+
+
+def detect_format(path, default='csv'):
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(ext, default)
+
+
+def read_rows(fp, fmt):
+    """Yield ``(line_number, row_dict)`` pairs; unparseable JSON lines yield ``(n, None)``."""
+    if fmt == 'csv':
+        reader = csv.DictReader(fp)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(fp, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None
+            continue
+        yield number, row if isinstance(row, dict) else None
+
+
+class ImportReport:
+    def __init__(self):
+        self.imported = 0
+        self.errors = []  # (line, message)
+        self.started = time.perf_counter()
+
+    @property
+    def failed(self):
+        return len(self.errors)
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.imported + self.failed) / elapsed if elapsed else 0.0
+
+
+def _build_book(row, covers_dir, user, dry_run=False):
+    """
+    A validated, unsaved Book for ``row`` or a list of error messages. With
+    ``dry_run`` the cover is only checked for existence, never stored.
+    """
+    data = {field: row.get(field, '') for field in BookForm.Meta.fields if field != 'picture'}
+    picture = (row.get('picture') or row.get('cover') or '').strip()
+    instance = Book(username=user)
+    files, handle = {}, None
+    if covers_dir and picture:
+        path = os.path.join(covers_dir, picture)
+        if not os.path.isfile(path):
+            return None, [f'picture: cover file {picture!r} not found in {covers_dir}']
+        if dry_run:
+            # Validated as a name only; there is nothing to store
+            instance.picture = os.path.basename(picture)
+        else:
+            handle = open(path, 'rb')
+            files['picture'] = File(handle, name=os.path.basename(picture))
+    elif picture:
+        # Already in storage, e.g. a path written by export_books
+        if not Book._meta.get_field('picture').storage.exists(picture):
+            return None, [f'picture: {picture!r} does not exist in storage']
+        instance.picture = picture
+        instance.pic_path = ''
+
+    try:
+        form = BookForm(data, files, instance=instance)
+        if not form.is_valid():
+            return None, [f'{field}: {" ".join(messages)}' for field, messages in form.errors.items()]
+        book = form.save(commit=False)
+        if not dry_run:
+            book.prepare_picture()
+        return book, None
+    finally:
+        if handle:
+            handle.close()
+
+
+def _flush(batch, report):
+    """Insert one batch; on failure report every row in it and carry on."""
+    books = [book for _, book in batch]
+    try:
+        with transaction.atomic():
+            Book.objects.bulk_create(books)
+            blobs.add_references(book.picture.name for book in books)
+    except DatabaseError as exc:
+        report.errors.extend((line, f'batch insert failed: {exc}') for line, _ in batch)
+        # prepare_picture already stored the covers; don't leave them to the next collection
+        blobs.discard(book.picture.name for book in books)
+        return
+    report.imported += len(books)
+    ids = [book.pk for book in books if book.pk is not None]
+    if ids:
+        # bulk_create sends no signals, so queue what post_save would have done
+        tasks.index_books.delay(ids)
+        tasks.generate_covers_for_books.delay(ids)
+
+
+def import_books(fp, fmt='csv', covers_dir=None, user=None, batch_size=500, dry_run=False, on_batch=None):
+    """
+    Import books from the open text file ``fp``. Rows that fail BookForm
+    validation are recorded in the returned ImportReport and skipped.
+    """
+    report = ImportReport()
+    batch = []
+    for line, row in read_rows(fp, fmt):
+        if row is None:
+            report.errors.append((line, 'not a JSON object'))
+            continue
+        book, errors = _build_book(row, covers_dir, user, dry_run)
+        if errors:
+            report.errors.extend((line, message) for message in errors)
+            continue
+        if dry_run:
+            report.imported += 1
+            continue
+        batch.append((line, book))
+        if len(batch) >= batch_size:
+            _flush(batch, report)
+            batch = []
+            if on_batch:
+                on_batch(report)
+    if batch:
+        _flush(batch, report)
+    return report
+
+
+def _export_row(values):
+    row = dict(zip(EXPORT_FIELDS, values))
+    for key, value in row.items():
+        if isinstance(value, Decimal):
+            row[key] = str(value)
+        elif hasattr(value, 'isoformat'):
+            row[key] = value.isoformat()
+    return row
+
+
+def export_books(fp, fmt='csv', queryset=None, chunk_size=2000):
+    """Write every book in ``queryset`` to ``fp`` and return the row count."""
+    queryset = Book.objects.all() if queryset is None else queryset
+    rows = (queryset.order_by('pk')
+            .values_list('id', 'name', 'web', 'price', 'quantity', 'publishdate', 'username__username',
+                         'picture', 'rating_count', 'rating_avg')
+            .iterator(chunk_size=chunk_size))
+    writer = csv.DictWriter(fp, fieldnames=EXPORT_FIELDS) if fmt == 'csv' else None
+    if writer:
+        writer.writeheader()
+    count = 0
+    for values in rows:
+        row = _export_row(values)
+        if writer:
+            writer.writerow(row)
+        else:
+            fp.write(json.dumps(row) + '\n')
+        count += 1
+    return count
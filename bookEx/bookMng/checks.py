@@ -0,0 +1,34 @@
+"""
+System checks for deployment settings that break the app silently.
+"""
+import os
+
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+def worker_count():
+    """Server processes sharing this configuration, as exported by deploy/gunicorn_*.py."""
+    try:
+        return int(os.environ.get('BOOKEX_WORKERS') or os.environ.get('WEB_CONCURRENCY') or 1)
+    except ValueError:
+        return 1
+
+
+def cache_is_process_local():
+    return settings.CACHES.get('default', {}).get('BACKEND', '') in PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    workers = worker_count()
+    if workers > 1 and cache_is_process_local():
+        return [Warning(
+            f'The default cache is process-local but {workers} workers are configured.',
+            hint='Fragment, page and cart versions bumped in one worker would never reach the others, '
+                 'which keep serving stale rows and 304s. Set BOOKEX_CACHE_URL to a Redis URL or "db".',
+            id='bookMng.W001',
+        )]
+    return []
@@ -0,0 +1,14 @@
+from django.utils.functional import SimpleLazyObject
+
+from . import cart
+from .menu import get_main_menu
+
+
+def main_menu(request):
+    # Lazy so pages that never render the menu do not touch the cache
+    return {'item_list': SimpleLazyObject(get_main_menu)}
+
+
+def cart_summary(request):
+    # Lazy for the same reason; a cache hit costs no query
+    return {'cart_summary': SimpleLazyObject(lambda: cart.summary(request.user))}
@@ -1,10 +1,17 @@
-from django.contrib.auth.decorators import user_passes_test
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+from . import roles
+
 
 def group_required(*group_names):
     """Check if user belongs to any of the groups passed."""
-    def in_groups(user):
-        if user.is_authenticated:
-            if bool(user.groups.filter(name__in=group_names)) or user.is_superuser:
-                return True
-        return False
-    return user_passes_test(in_groups)
\ No newline at end of file
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if roles.has_role(request.user, *group_names, session=request.session):
+                return view_func(request, *args, **kwargs)
+            return redirect_to_login(request.get_full_path())
+        return wrapper
+    return decorator
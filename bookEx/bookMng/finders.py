@@ -0,0 +1,35 @@
+"""
+Staticfiles finder for uploaded pictures.
+
+Templates link covers with ``{% static book.pic_path %}``, where pic_path is
+the picture's name below the ``static/`` directory of its storage. This
+finder resolves those paths in the picture storage, so runserver, the
+static view and ``findstatic`` see uploads without copying them into
+STATICFILES_DIRS. It lists nothing: collectstatic never copies uploads.
+"""
+import os
+import posixpath
+
+from django.contrib.staticfiles.finders import BaseFinder
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+
+def pictures_root():
+    from .models import Book
+    field = Book._meta.get_field('picture')
+    return field.storage.path(posixpath.dirname(field.upload_to))
+
+
+class PictureFinder(BaseFinder):
+    def find(self, path, find_all=False, **kwargs):
+        try:
+            full_path = safe_join(pictures_root(), path)
+        except SuspiciousFileOperation:
+            full_path = None
+        if full_path is None or not os.path.exists(full_path):
+            return [] if find_all else None
+        return [full_path] if find_all else full_path
+
+    def list(self, ignore_patterns):
+        return []
@@ -12,8 +12,12 @@ class BookForm(ModelForm):
            'name',
            'web',
            'price',
+           'quantity',
            'picture',
        ]
+       labels = {
+           'quantity': 'Copies in stock',
+       }
 
 class CustomUserCreationForm(UserCreationForm):
     is_publisher = forms.BooleanField(required=False, label='Register as Publisher')
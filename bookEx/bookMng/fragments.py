@@ -0,0 +1,106 @@
+"""
+Per-book version keys for row fragment caching and conditional GET.
+
+Every book has a version, Book.version, stamped whenever the book is saved
+and bumped (see signals.py) when its ratings, comments or favorites change.
+Catalog rows are cached with ``{% cache %}`` under ``(book id, version, site
+version)``, so an edit only re-renders that book's rows. The same versions
+make up the ETag and Last-Modified of a listing page, so an unchanged page is
+answered with a 304 without rendering anything.
+
+Book versions live in the database: the listing already loads them with the
+books, and a bump made by the task worker (new cover variants, a ratings
+rebuild) reaches every web process. It is written in the same transaction as
+the change, so nobody reads the new version with the old rows.
+
+The site version, bumped when the menu or the page boundaries change, is a
+``time.time_ns()`` stamp in Django's cache. A version lost to eviction is
+recreated with the current time, which can only cause an extra re-render.
+Every web worker must read the same one, so the cache has to be shared
+between processes (settings.CACHES; check bookMng.W001 warns otherwise).
+"""
+import hashlib
+import time
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.shortcuts import render
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import cart
+from .models import Book
+
+SITE_KEY = 'bookMng:site_version'
+VERSION_TIMEOUT = None  # versions must outlive every fragment cached under them
+
+
+def book_versions(book_ids):
+    """``{book_id: version}`` for ``book_ids``."""
+    return dict(Book.objects.filter(pk__in=book_ids).values_list('pk', 'version'))
+
+
+def site_version():
+    version = cache.get(SITE_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.set(SITE_KEY, version, VERSION_TIMEOUT)
+    return version
+
+
+def _bump_now_and_on_commit(stamp):
+    # Bumping before the commit stops this process reusing stale rows at once;
+    # bumping again after it stops another request that read the old rows
+    # during the transaction from caching them under the new version.
+    stamp()
+    transaction.on_commit(stamp)
+
+
+def bump_books(book_ids):
+    """Invalidate the cached rows of ``book_ids``."""
+    book_ids = set(book_ids)
+    if book_ids:
+        Book.objects.filter(pk__in=book_ids).update(version=time.time_ns())
+
+
+def bump_site():
+    """Invalidate every cached row and page, e.g. after the menu or a bulk repair changes."""
+    _bump_now_and_on_commit(lambda: cache.set(SITE_KEY, time.time_ns(), VERSION_TIMEOUT))
+
+
+def attach_versions(books):
+    """Set ``cache_version`` on each book of a page for the row ``{% cache %}`` keys."""
+    site = site_version()
+    for book in books:
+        book.cache_version = f'{book.version}.{site}'
+    return [book.version for book in books] + [site]
+
+
+def render_page(request, template_name, context, page):
+    """
+    Render a listing ``page`` of books, or answer 304 if the browser already
+    has it. The validators cover the viewer and the cart in their nav bar,
+    the URL, the page's books and their versions, and the neighbouring
+    cursors, so any change that would alter the HTML changes the ETag.
+    """
+    stamps = attach_versions(page.object_list)
+    summary = cart.summary(request.user)
+    parts = [str(request.user.pk), f'{summary["count"]}:{summary["total"]}', request.get_full_path(),
+             page.next_cursor or '', page.previous_cursor or '']
+    parts += [f'{book.pk}:{book.cache_version}' for book in page.object_list]
+    etag = '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+    last_modified = max(stamps) // 1_000_000_000
+
+    # A queued flash message is shown once, so that page must be rendered
+    if not len(messages.get_messages(request)):
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+    response = render(request, template_name, context)
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
@@ -0,0 +1,118 @@
+"""
+Cover image variants.
+
+Listing pages show covers at 60-90px and the detail page at 250px, so each
+upload gets a fixed 90x135 thumbnail and a 300px wide cover rendered once at
+save time. Variants are written next to the original in the picture's storage
+and referenced by static path on the Book, like ``pic_path``. A
+content-addressed picture names its variants after its hash, so books sharing
+a cover share its variants and they are rendered once.
+"""
+import logging
+import posixpath
+import re
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+
+from . import fragments
+from .storage import ContentAddressedStorage, is_blob
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it listings use the original upload
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+THUMB_SIZE = (90, 135)
+COVER_WIDTH = 300
+THUMB_SUFFIX = '90x135'
+COVER_SUFFIX = f'{COVER_WIDTH}w'
+
+
+def static_path(url):
+    """Map a storage URL to the path the templates pass to {% static %}."""
+    return url.split('/static/')[-1]
+
+
+def _variant_name(picture_name, suffix, ext):
+    directory, filename = posixpath.split(picture_name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'thumbs', f'{stem}_{suffix}.{ext}')
+
+
+def variant_names(storage, picture_name):
+    """``{suffix: name}`` of the variants stored for ``picture_name``."""
+    directory, filename = posixpath.split(picture_name)
+    thumbs = posixpath.join(directory, 'thumbs')
+    stem = posixpath.splitext(filename)[0]
+    pattern = re.compile(rf'{re.escape(stem)}_({THUMB_SUFFIX}|{COVER_SUFFIX})\.\w+')
+    try:
+        _, files = storage.listdir(thumbs)
+    except FileNotFoundError:
+        return {}
+    return {match[1]: posixpath.join(thumbs, f) for f in files if (match := pattern.fullmatch(f))}
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'WEBP':
+        image.save(buffer, 'WEBP', quality=80, method=4)
+    else:
+        image.save(buffer, 'JPEG', quality=80, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _store(storage, name, data):
+    if isinstance(storage, ContentAddressedStorage):
+        # save() would name the variant after its own content instead
+        return storage.save_as(name, ContentFile(data))
+    if storage.exists(name):
+        storage.delete(name)
+    return storage.save(name, ContentFile(data))
+
+
+def _render_variants(picture):
+    with picture.open('rb') as f:
+        source = Image.open(f)
+        source = ImageOps.exif_transpose(source).convert('RGB')
+
+    thumb = ImageOps.fit(source, THUMB_SIZE, Image.LANCZOS)
+    cover = source
+    if source.width > COVER_WIDTH:
+        height = round(source.height * COVER_WIDTH / source.width)
+        cover = source.resize((COVER_WIDTH, height), Image.LANCZOS)
+    cover_format = 'WEBP' if 'WEBP' in Image.SAVE else 'JPEG'
+    return (
+        (THUMB_SUFFIX, 'jpg', _encode(thumb, 'JPEG')),
+        (COVER_SUFFIX, cover_format.lower(), _encode(cover, cover_format)),
+    )
+
+
+def generate_variants(book):
+    """
+    Render the thumbnail and cover variants for ``book.picture`` and store
+    their static paths on the book. Returns True when the variants were
+    written; failures are logged and leave the listing on the original image.
+    """
+    if Image is None or not book.picture:
+        return False
+    picture = book.picture
+    # Another book with the same blob may have rendered them already
+    stored = variant_names(picture.storage, picture.name) if is_blob(picture.name) else {}
+    if set(stored) != {THUMB_SUFFIX, COVER_SUFFIX}:
+        try:
+            variants = _render_variants(picture)
+        except (OSError, ValueError) as exc:
+            logger.warning('Could not render cover variants for book %s: %s', book.pk, exc)
+            return False
+        stored = {suffix: _store(picture.storage, _variant_name(picture.name, suffix, ext), data)
+                  for suffix, ext, data in variants}
+    paths = {suffix: static_path(picture.storage.url(name)) for suffix, name in stored.items()}
+
+    book.thumb_path = paths[THUMB_SUFFIX]
+    book.cover_path = paths[COVER_SUFFIX]
+    type(book).objects.filter(pk=book.pk).update(thumb_path=book.thumb_path, cover_path=book.cover_path)
+    fragments.bump_books([book.pk])
+    return True
@@ -0,0 +1,145 @@
+"""
+Bestseller and trending lists for the index page.
+
+Purchases, favorites and ratings add to a per-book counter for the current
+hour (BookCounter). No listing ever groups the raw orders, favorites or
+ratings.
+
+``refresh()`` does the upkeep and is queued at most once per REFRESH_SECONDS
+by the increments themselves:
+- rolls hourly buckets older than HOURLY_DAYS up into daily ones;
+- prunes daily buckets older than the longest window;
+- sums each board's sliding window into LeaderboardEntry;
+- caches the result.
+The index page reads that cached copy, or falls back to one small indexed
+query.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from .models import BookCounter, LeaderboardEntry
+
+SALES, FAVORITES, RATINGS = 'sales', 'favorites', 'ratings'
+# board -> (metric, window, title), in display order
+BOARDS = {
+    'bestsellers': (SALES, timedelta(days=30), 'Bestsellers'),
+    'most_favorited': (FAVORITES, timedelta(days=7), 'Most favorited this week'),
+    'most_rated': (RATINGS, timedelta(days=7), 'Most rated this week'),
+}
+TOP_N = 5
+HOURLY_DAYS = 2
+REFRESH_SECONDS = 5 * 60
+CACHE_KEY = 'bookMng:leaderboards'
+REFRESH_LOCK_KEY = 'bookMng:leaderboards:refresh_queued'
+
+
+def _hour(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _add(book_id, metric, period, bucket_start, delta):
+    counters = BookCounter.objects.filter(book_id=book_id, metric=metric, period=period, bucket_start=bucket_start)
+    if counters.update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            BookCounter.objects.create(book_id=book_id, metric=metric, period=period,
+                                       bucket_start=bucket_start, count=delta)
+    except IntegrityError:
+        # Another request created the bucket first
+        counters.update(count=F('count') + delta)
+
+
+def record(metric, counts):
+    """Add ``{book_id: delta}`` to this hour's ``metric`` buckets."""
+    bucket = _hour(timezone.now())
+    for book_id, delta in counts.items():
+        if delta:
+            _add(book_id, metric, BookCounter.HOUR, bucket, delta)
+    _schedule_refresh()
+
+
+def record_order(order):
+    counts = {}
+    for book_id, quantity in order.lines.values_list('book_id', 'quantity'):
+        counts[book_id] = counts.get(book_id, 0) + quantity
+    record(SALES, counts)
+
+
+def _schedule_refresh():
+    from . import tasks
+    # cache.add only succeeds for the first caller in each REFRESH_SECONDS
+    if cache.add(REFRESH_LOCK_KEY, True, REFRESH_SECONDS):
+        tasks.refresh_leaderboards.delay()
+
+
+def roll_up(now=None):
+    """Fold hourly buckets older than HOURLY_DAYS into daily ones; returns the hourly rows folded."""
+    now = now or timezone.now()
+    cutoff = _hour(now) - timedelta(days=HOURLY_DAYS)
+    old = BookCounter.objects.filter(period=BookCounter.HOUR, bucket_start__lt=cutoff)
+    with transaction.atomic():
+        days = (old.annotate(day=TruncDay('bucket_start')).values('book_id', 'metric', 'day')
+                .annotate(total=Sum('count')).order_by())
+        for row in days:
+            _add(row['book_id'], row['metric'], BookCounter.DAY, row['day'], row['total'])
+        folded, _ = old.delete()
+    return folded
+
+
+def prune(now=None):
+    """Delete daily buckets no board's window reaches any more."""
+    now = now or timezone.now()
+    longest = max(window for _, window, _ in BOARDS.values())
+    deleted, _ = BookCounter.objects.filter(bucket_start__lt=now - longest - timedelta(days=1)).delete()
+    return deleted
+
+
+def _top(metric, window, now):
+    # Daily buckets are counted whole once their day overlaps the window
+    start = timezone.localtime(now - window).replace(hour=0, minute=0, second=0, microsecond=0)
+    return list(BookCounter.objects.filter(metric=metric, bucket_start__gte=start)
+                .values('book_id').annotate(score=Sum('count')).filter(score__gt=0)
+                .order_by('-score', 'book_id')[:TOP_N])
+
+
+def materialize(now=None):
+    """Recompute every board's sliding-window top-N into LeaderboardEntry."""
+    now = now or timezone.now()
+    entries = []
+    for board, (metric, window, _) in BOARDS.items():
+        entries += [LeaderboardEntry(board=board, rank=rank, book_id=row['book_id'], score=row['score'])
+                    for rank, row in enumerate(_top(metric, window, now))]
+    with transaction.atomic():
+        LeaderboardEntry.objects.all().delete()
+        LeaderboardEntry.objects.bulk_create(entries)
+    transaction.on_commit(lambda: cache.delete(CACHE_KEY))
+    cache.delete(CACHE_KEY)
+
+
+def refresh(now=None):
+    roll_up(now)
+    prune(now)
+    materialize(now)
+
+
+def get_boards():
+    """``[(title, [{'id', 'name', 'thumbnail', 'score'}, ...]), ...]`` for boards with entries."""
+    boards = cache.get(CACHE_KEY)
+    if boards is None:
+        rows = {}
+        for entry in LeaderboardEntry.objects.select_related('book').order_by('board', 'rank'):
+            rows.setdefault(entry.board, []).append({
+                'id': entry.book_id, 'name': entry.book.name,
+                'thumbnail': entry.book.thumbnail, 'score': entry.score,
+            })
+        boards = [(title, rows[board]) for board, (_, _, title) in BOARDS.items() if board in rows]
+        cache.set(CACHE_KEY, boards, REFRESH_SECONDS * 2)
+        # Keep the windows sliding even when nothing is being bought or rated
+        _schedule_refresh()
+    return boards
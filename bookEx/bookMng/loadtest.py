@@ -0,0 +1,108 @@
+"""
+Minimal HTTP/1.1 load generator behind ``manage.py benchmark_servers``.
+
+Each of ``connections`` coroutines keeps one keep-alive socket open and
+requests the given paths round-robin until ``duration`` seconds have passed.
+Only the standard library is used so the numbers don't depend on a client
+package's own overhead.
+"""
+import asyncio
+import time
+
+from .viewstats import percentile
+
+
+class _Connection:
+    def __init__(self, host, port, cookie):
+        self.host, self.port, self.cookie = host, port, cookie
+        self.reader = self.writer = None
+
+    async def _open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.reader = self.writer = None
+
+    async def get(self, path):
+        """Fetch ``path`` and return its status code, reconnecting if the server closed the socket."""
+        if self.writer is None:
+            await self._open()
+        headers = f'GET {path} HTTP/1.1\r\nHost: {self.host}\r\nConnection: keep-alive\r\n'
+        if self.cookie:
+            headers += f'Cookie: {self.cookie}\r\n'
+        self.writer.write((headers + '\r\n').encode())
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('server closed the connection')
+        status = int(status_line.split()[1])
+        length, chunked, keep_alive = 0, False, True
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            name, value = name.strip().lower(), value.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'transfer-encoding' and 'chunked' in value:
+                chunked = True
+            elif name == 'connection' and value == 'close':
+                keep_alive = False
+
+        if chunked:
+            while (size := int((await self.reader.readline()).split(b';')[0], 16)):
+                await self.reader.readexactly(size + 2)
+            await self.reader.readline()
+        elif length:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return status
+
+
+async def _worker(host, port, paths, offset, cookie, deadline, latencies, errors):
+    conn = _Connection(host, port, cookie)
+    i = offset
+    try:
+        while time.monotonic() < deadline:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                status = await conn.get(path)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                conn.close()
+                errors['connection'] = errors.get('connection', 0) + 1
+                await asyncio.sleep(0.05)
+                continue
+            if status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+            else:
+                latencies.append((time.perf_counter() - started) * 1000)
+    finally:
+        conn.close()
+
+
+async def _run(host, port, paths, connections, duration, cookie):
+    latencies, errors = [], {}
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    await asyncio.gather(*(_worker(host, port, paths, i, cookie, deadline, latencies, errors)
+                           for i in range(connections)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        'connections': connections,
+        'requests': len(latencies),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'errors': errors,
+    }
+
+
+def run(host, port, paths, connections=200, duration=15, cookie=''):
+    """Hammer ``host:port`` and return throughput, latency percentiles and error counts."""
+    return asyncio.run(_run(host, port, paths, connections, duration, cookie))
@@ -0,0 +1,69 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from bookMng import benchmark
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmark_baseline.json')
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database at one or more catalog sizes, time the bookMng '
+            'views through the test client and compare the results with a stored baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', nargs='+', type=int, default=[1000, 10000, 100000],
+                            help='Catalog sizes (number of books) to benchmark.')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--views', nargs='+', help='Only run these scenarios.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                            help='Baseline JSON to compare against (default: %(default)s).')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='Store this run as the new baseline instead of comparing.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed slowdown before a metric counts as a regression.')
+
+    def handle(self, *args, **options):
+        results = {}
+        setup_test_environment()
+        try:
+            for scale in options['scales']:
+                self.stdout.write(f'Benchmarking {scale} books...')
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                try:
+                    bench_user = benchmark.seed(scale, seed=options['seed'], stdout=self.stdout)
+                    results[str(scale)] = benchmark.run_scenarios(
+                        bench_user, iterations=options['iterations'],
+                        warmup=options['warmup'], only=options['views'])
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+
+        report = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+        self.stdout.write(report)
+
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as f:
+                f.write(report)
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {options["baseline"]}'))
+            return
+        if not os.path.exists(options['baseline']):
+            self.stdout.write('No baseline found; run with --save-baseline to record one.')
+            return
+        with open(options['baseline']) as f:
+            baseline = json.load(f)
+        regressions = benchmark.compare(results, baseline, tolerance=options['tolerance'])
+        if regressions:
+            raise CommandError('Performance regressions:\n  ' + '\n  '.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
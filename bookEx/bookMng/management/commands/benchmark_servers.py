@@ -0,0 +1,111 @@
+import importlib.util
+import json
+import os
+import shlex
+import socket
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from bookMng import benchmark, loadtest
+from bookMng.models import Book
+
+DEPLOY_DIR = os.path.join(settings.BASE_DIR, 'deploy')
+PROFILES = {
+    'wsgi': ('gunicorn -c {deploy}/gunicorn_wsgi.py --bind 127.0.0.1:{port} bookEx.wsgi:application',
+             ('gunicorn',)),
+    'asgi': ('gunicorn -c {deploy}/gunicorn_asgi.py --bind 127.0.0.1:{port} bookEx.asgi:application',
+             ('gunicorn', 'uvicorn')),
+}
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway SQLite database, serve it with the WSGI and ASGI deployment '
+            'profiles in turn and compare their throughput under many concurrent connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000)
+        parser.add_argument('--connections', type=int, default=200)
+        parser.add_argument('--duration', type=float, default=15, help='Seconds of load per profile.')
+        parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--wsgi-command', help='Override the WSGI server command; {port} is substituted.')
+        parser.add_argument('--asgi-command', help='Override the ASGI server command; {port} is substituted.')
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+
+    def handle(self, *args, **options):
+        commands = {}
+        for profile in options['profiles']:
+            command, modules = PROFILES[profile]
+            override = options[f'{profile}_command']
+            if not override:
+                missing = [m for m in modules if importlib.util.find_spec(m) is None]
+                if missing:
+                    raise CommandError(f'The {profile} profile needs {", ".join(missing)}; '
+                                       f'install it or pass --{profile}-command.')
+            commands[profile] = (override or command).format(deploy=DEPLOY_DIR, port=options['port'])
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, 'bench.sqlite3')
+            paths, cookie = self._seed(db_path, options['books'])
+            env = {**os.environ, 'BOOKEX_DB_NAME': db_path}
+            results = {}
+            for profile, command in commands.items():
+                self.stdout.write(f'Load testing {profile}: {command}')
+                results[profile] = self._serve_and_load(command, env, options, paths, cookie)
+
+        report = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(report)
+        self.stdout.write(report)
+
+    def _seed(self, db_path, books):
+        """Migrate and seed ``db_path``; return the request mix and a logged-in cookie."""
+        connection.close()
+        connection.settings_dict['NAME'] = db_path
+        call_command('migrate', verbosity=0)
+        bench_user = benchmark.seed(books, stdout=self.stdout)
+        client = Client()
+        client.force_login(bench_user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}'
+        book_ids = list(Book.objects.order_by('?').values_list('pk', flat=True)[:20])
+        paths = [reverse('displaybooks'), reverse('searchbooks') + '?q=river', reverse('favorite_list')]
+        paths += [reverse('book_detail', args=[pk]) for pk in book_ids]
+        connection.close()
+        return paths, cookie
+
+    def _serve_and_load(self, command, env, options, paths, cookie):
+        server = subprocess.Popen(shlex.split(command), cwd=settings.BASE_DIR, env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self._wait_for_port(options['port'], server)
+            loadtest.run('127.0.0.1', options['port'], paths[:1], connections=1, duration=1, cookie=cookie)
+            return loadtest.run('127.0.0.1', options['port'], paths, connections=options['connections'],
+                                duration=options['duration'], cookie=cookie)
+        finally:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+
+    @staticmethod
+    def _wait_for_port(port, server, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'Server exited with status {server.returncode}.')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError(f'Server did not start listening on port {port}.')
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bookMng import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the "readers also liked" and "recommended for you" lists from favorites, '
+            'ratings and purchases. By default only what changed since the last build is redone.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every book and user.')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K,
+                            help='Similar books stored per book.')
+        parser.add_argument('--per-user', type=int, default=recommendations.RECOMMEND_N,
+                            help='Recommendations stored per user.')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        books, users = recommendations.build(full=options['full'], k=options['top_k'], n=options['per_user'])
+        engine = 'scipy' if recommendations.sparse is not None else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {books} book list(s) and {users} user list(s) in '
+            f'{time.perf_counter() - started:.1f}s ({engine}).'))
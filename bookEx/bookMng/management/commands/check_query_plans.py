@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from bookMng import benchmark, queryplans
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway test database, drive the bookMng views and EXPLAIN every '
+            'statement they run; fail if any of them scans a whole table.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000,
+                            help='Catalog size to seed; large enough for the planner to prefer indexes.')
+        parser.add_argument('--views', nargs='+', help='Only check these scenarios.')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            bench_user = benchmark.seed(options['books'], seed=options['seed'], stdout=self.stdout)
+            scenarios = [s for s in benchmark.scenarios(bench_user)
+                         if not options['views'] or s[0] in options['views']]
+            problems = queryplans.check_scenarios(scenarios, bench_user)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, statements in problems.items():
+            self.stdout.write(self.style.WARNING(f'{name}:'))
+            for sql, plan, tables in statements:
+                self.stdout.write(f'  full scan of {", ".join(tables)}')
+                self.stdout.write(f'    {sql}')
+                for line in plan:
+                    self.stdout.write(f'      {line}')
+        if problems:
+            raise CommandError(f'Full table scans in {len(problems)} view(s): {", ".join(problems)}')
+        self.stdout.write(self.style.SUCCESS(f'No full table scans in {len(scenarios)} view(s).'))
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from bookMng import blobs
+
+
+class Command(BaseCommand):
+    help = ('Delete stored pictures (and their resized variants) that no book has used for a while. '
+            'Editing and deleting books queues this too.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-minutes', type=int, default=int(blobs.GRACE.total_seconds() // 60),
+                            help='Keep pictures orphaned or uploaded more recently than this.')
+        parser.add_argument('--recount', action='store_true',
+                            help='Rebuild every reference count from the books first, e.g. after '
+                                 'changing pictures with queryset updates or restoring a backup.')
+        parser.add_argument('--adopt', action='store_true',
+                            help='First move pictures stored before content addressing into it, '
+                                 'merging the duplicate uploads (also those in the static directory).')
+
+    def handle(self, *args, **options):
+        if options['adopt']:
+            moved, removed = blobs.adopt()
+            self.stdout.write(f'Moved {moved} book(s) to content-addressed pictures, '
+                              f'deleting {removed} duplicate file(s).')
+        if options['recount']:
+            self.stdout.write(f'Recounted references: {blobs.recount()} picture(s) in use.')
+        files, freed = blobs.collect(timedelta(minutes=options['grace_minutes']))
+        self.stdout.write(self.style.SUCCESS(f'Deleted {files} unused picture(s), freeing {freed} byte(s).'))
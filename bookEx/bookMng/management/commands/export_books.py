@@ -0,0 +1,25 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from bookMng import catalog_io
+
+
+class Command(BaseCommand):
+    help = 'Stream every book to a CSV or JSONL file without loading the table into memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help="File to write, or '-' for stdout (default).")
+        parser.add_argument('--format', choices=catalog_io.FORMATS,
+                            help='Defaults to the file extension, then csv.')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows fetched per database round trip.')
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or catalog_io.detect_format(options['path'])
+        if options['path'] == '-':
+            count = catalog_io.export_books(self.stdout, fmt, chunk_size=options['chunk_size'])
+            self.stderr.write(f'Exported {count} book(s).')
+            return
+        with open(options['path'], 'w', newline='', encoding='utf-8') as fp:
+            count = catalog_io.export_books(fp, fmt, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} book(s) to {options["path"]}.'))
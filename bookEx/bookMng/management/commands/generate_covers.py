@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookMng import images
+from bookMng.models import Book
+
+
+class Command(BaseCommand):
+    help = 'Render thumbnail and cover variants for books that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Re-render variants for every book, not only missing ones.')
+
+    def handle(self, *args, **options):
+        if images.Image is None:
+            raise CommandError('Pillow is required to render cover variants.')
+        books = Book.objects.exclude(picture='').order_by('pk')
+        if not options['all']:
+            books = books.filter(thumb_path='')
+        done = failed = 0
+        for book in books.iterator(chunk_size=200):
+            if images.generate_variants(book):
+                done += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS(f'Rendered covers for {done} book(s), {failed} failed.'))
@@ -0,0 +1,49 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bookMng import catalog_io
+
+
+class Command(BaseCommand):
+    help = ('Import books from a CSV or JSONL file (columns: name, web, price, quantity, picture). '
+            'Rows are validated like the post-a-book form and inserted in batches; bad rows are '
+            'reported and skipped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to read, or '-' for stdin.")
+        parser.add_argument('--format', choices=catalog_io.FORMATS,
+                            help='Defaults to the file extension, then csv.')
+        parser.add_argument('--covers', help='Directory holding the cover files named in the picture column.')
+        parser.add_argument('--user', help='Username to record as the poster of every book.')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Validate only; write nothing.')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f'No user named {options["user"]!r}.')
+        fmt = options['format'] or catalog_io.detect_format(options['path'])
+
+        def progress(report):
+            self.stdout.write(f'  {report.imported} imported, {report.failed} failed '
+                              f'({report.rows_per_second:.0f} rows/s)')
+
+        fp = sys.stdin if options['path'] == '-' else open(options['path'], newline='', encoding='utf-8')
+        try:
+            report = catalog_io.import_books(fp, fmt, covers_dir=options['covers'], user=user,
+                                             batch_size=options['batch_size'], dry_run=options['dry_run'],
+                                             on_batch=progress)
+        finally:
+            if fp is not sys.stdin:
+                fp.close()
+
+        for line, message in report.errors:
+            self.stderr.write(f'line {line}: {message}')
+        verb = 'Validated' if options['dry_run'] else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {report.imported} book(s), {report.failed} error(s), '
+            f'{report.rows_per_second:.0f} rows/s.'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from bookMng import tasks
+from bookMng.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored rating_count/rating_sum/rating_avg columns on Book from Rate.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('book_ids', nargs='*', type=int,
+                            help='Only rebuild these books (default: all books).')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--queue', action='store_true',
+                            help='Queue the rebuild for the task worker instead of running it now.')
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            tasks.rebuild_ratings.delay(options['book_ids'] or None)
+            self.stdout.write(self.style.SUCCESS('Queued the rating rebuild.'))
+            return
+        updated = rebuild_rating_aggregates(book_ids=options['book_ids'] or None,
+                                            batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating aggregates for {updated} book(s).'))
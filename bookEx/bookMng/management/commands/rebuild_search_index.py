@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookMng import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over book titles and comments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        search.reset_availability()
+        if not search.is_available():
+            raise CommandError('The FTS5 search index is not available on this database; '
+                               'run "migrate" on a SQLite database built with FTS5.')
+        started = time.perf_counter()
+        indexed = search.rebuild_index(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} book(s) in {elapsed:.2f}s.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from bookMng import leaderboards
+
+
+class Command(BaseCommand):
+    help = ('Roll up and prune the per-book activity counters and recompute the index page '
+            'leaderboards. Activity already queues this every few minutes; use it from cron '
+            'or after importing history.')
+
+    def handle(self, *args, **options):
+        folded = leaderboards.roll_up()
+        pruned = leaderboards.prune()
+        leaderboards.materialize()
+        self.stdout.write(self.style.SUCCESS(
+            f'Rolled up {folded} hourly bucket(s), pruned {pruned}, refreshed {len(leaderboards.BOARDS)} board(s).'))
@@ -0,0 +1,68 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+
+from bookMng import tasks
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (covers, search indexing, rating rebuilds) with a bounded thread pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Tasks run at the same time; 1 runs them in the main thread.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to sleep when the queue is empty.')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty.')
+        parser.add_argument('--purge-days', type=int, default=7,
+                            help='Delete finished tasks older than this many days on start-up.')
+
+    def handle(self, *args, **options):
+        queue = tasks.get_queue()
+        purged = queue.purge(options['purge_days'])
+        if purged:
+            self.stdout.write(f'Purged {purged} finished task(s).')
+
+        self._stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        done = failed = 0
+        concurrency = max(options['concurrency'], 1)
+        pool = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        try:
+            while not self._stopping:
+                batch = queue.claim(concurrency)
+                if not batch:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                if pool:
+                    # Never claim more than the pool can run, so the rest stays available to other workers
+                    futures = wait([pool.submit(self._run_in_thread, queue, job) for job in batch]).done
+                    ok = sum(1 for f in futures if f.result())
+                else:
+                    ok = sum(1 for job in batch if queue.run(job))
+                done += ok
+                failed += len(batch) - ok
+        finally:
+            if pool:
+                pool.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'Ran {done} task(s), {failed} failed or will retry.'))
+
+    @staticmethod
+    def _run_in_thread(queue, job):
+        close_old_connections()
+        try:
+            return queue.run(job)
+        finally:
+            # Each pool thread has its own connection; don't leave it open
+            connection.close()
+
+    def _stop(self, signum, frame):
+        self.stdout.write('Stopping after the current batch...')
+        self._stopping = True
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from bookMng.checks import cache_is_process_local
+from bookMng.viewstats import collect_published
+
+
+class Command(BaseCommand):
+    help = ('Dump the per-view latency and query statistics published by '
+            'ViewStatsMiddleware as JSON. Requires a cache shared by the web workers '
+            '(BOOKEX_CACHE_URL).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--indent', type=int, default=2)
+
+    def handle(self, *args, **options):
+        if cache_is_process_local():
+            self.stderr.write(self.style.WARNING(
+                'The default cache is process-local, so no web worker\'s stats are visible from here. '
+                'Run the workers and this command with BOOKEX_CACHE_URL set to a shared cache.'))
+        self.stdout.write(json.dumps(collect_published(), indent=options['indent'] or None))
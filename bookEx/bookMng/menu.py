@@ -0,0 +1,44 @@
+"""
+MainMenu lookups for every page.
+
+The menu is read through two layers: a per-process copy that is trusted for
+LOCAL_TTL seconds, then Django's cache framework shared by all workers. Saving
+or deleting a MainMenu clears both (see signals.py); other processes pick the
+change up once their local copy expires.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+from .models import MainMenu
+
+CACHE_KEY = 'bookMng:main_menu'
+CACHE_TIMEOUT = 60 * 60
+LOCAL_TTL = 30
+
+_lock = threading.Lock()
+_local = {'items': None, 'expires': 0.0}
+
+
+def get_main_menu():
+    now = time.monotonic()
+    items = _local['items']
+    if items is not None and now < _local['expires']:
+        return items
+
+    items = cache.get(CACHE_KEY)
+    if items is None:
+        items = list(MainMenu.objects.order_by('id'))
+        cache.set(CACHE_KEY, items, CACHE_TIMEOUT)
+    with _lock:
+        _local['items'] = items
+        _local['expires'] = now + LOCAL_TTL
+    return items
+
+
+def invalidate_main_menu():
+    with _lock:
+        _local['items'] = None
+        _local['expires'] = 0.0
+    cache.delete(CACHE_KEY)
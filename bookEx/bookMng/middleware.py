@@ -0,0 +1,110 @@
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import Resolver404, resolve
+
+from .routers import use_replicas
+from .viewstats import registry
+
+PRIMARY_PIN_COOKIE = 'bookex_primary'
+
+
+class _QueryTimer:
+    """connection.execute_wrapper that times every statement of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_sql = ''
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.total_ms += elapsed
+            if elapsed > self.slowest_ms:
+                self.slowest_ms, self.slowest_sql = elapsed, sql
+
+
+class ViewStatsMiddleware:
+    """
+    Records wall time, query count, DB time and the slowest statement for each
+    request, keyed by URL name. Off unless settings.VIEW_STATS_ENABLED is set;
+    when off Django drops it from the chain entirely.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'VIEW_STATS_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        view_name = (match.view_name if match else None) or '<unresolved>'
+        registry.record(view_name, wall_ms, timer.count, timer.total_ms,
+                        timer.slowest_ms, timer.slowest_sql)
+        return response
+
+
+class _WriteDetector:
+    """connection.execute_wrapper that notes whether a request changed any rows."""
+
+    def __init__(self):
+        self.wrote = False
+
+    def __call__(self, execute, sql, params, many, context):
+        if not self.wrote and sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.wrote = True
+        return execute(sql, params, many, context)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Serves GET/HEAD requests for settings.DATABASE_REPLICA_VIEWS from a read
+    replica. A request that writes to the primary sets a short-lived cookie
+    that keeps the browser on the primary, so replication lag never hides a
+    user's own rating, comment or login. Removed from the chain when no
+    replicas exist.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DATABASE_REPLICAS', ()):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.views = set(getattr(settings, 'DATABASE_REPLICA_VIEWS', ()))
+        self.pin_seconds = getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 10)
+
+    def __call__(self, request):
+        if (request.method in ('GET', 'HEAD') and PRIMARY_PIN_COOKIE not in request.COOKIES
+                and self._url_name(request) in self.views):
+            with use_replicas():
+                return self.get_response(request)
+
+        detector = _WriteDetector()
+        with connections['default'].execute_wrapper(detector):
+            response = self.get_response(request)
+        if detector.wrote:
+            response.set_cookie(PRIMARY_PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+        return response
+
+    @staticmethod
+    def _url_name(request):
+        try:
+            return resolve(request.path_info).url_name
+        except Resolver404:
+            return None
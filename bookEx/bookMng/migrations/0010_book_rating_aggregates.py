@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Book = apps.get_model('bookMng', 'Book')
+    Rate = apps.get_model('bookMng', 'Rate')
+    totals = Rate.objects.values('book').annotate(count=Count('id'), total=Sum('rating'))
+    for row in totals:
+        Book.objects.filter(pk=row['book']).update(
+            rating_count=row['count'],
+            rating_sum=row['total'],
+            rating_avg=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0009_userprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
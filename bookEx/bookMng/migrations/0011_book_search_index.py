@@ -0,0 +1,44 @@
+from django.db import OperationalError, migrations
+
+FTS_TABLE = 'bookMng_book_fts'
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5(name, comments, tokenize='unicode61 remove_diacritics 2')"
+        )
+    except OperationalError:
+        # SQLite built without FTS5; search falls back to name__icontains
+        return
+
+    Book = apps.get_model('bookMng', 'Book')
+    Comment = apps.get_model('bookMng', 'Comment')
+    comments = {}
+    for book_id, content in Comment.objects.order_by('id').values_list('book_id', 'content'):
+        comments.setdefault(book_id, []).append(content)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, comments) VALUES (%s, %s, %s)',
+            [(pk, name, '\n'.join(comments.get(pk, [])))
+             for pk, name in Book.objects.values_list('pk', 'name')],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0010_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+def fill_pic_path(apps, schema_editor):
+    Book = apps.get_model('bookMng', 'Book')
+    books = list(Book.objects.exclude(picture=''))
+    for book in books:
+        book.pic_path = book.picture.url.split('/static/')[-1]
+    Book.objects.bulk_update(books, ['pic_path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0011_book_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='cover_path',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='thumb_path',
+            field=models.CharField(blank=True, editable=False, max_length=300),
+        ),
+        migrations.RunPython(fill_pic_path, migrations.RunPython.noop),
+    ]
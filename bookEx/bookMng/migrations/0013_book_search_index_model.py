@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:08
+
+import bookMng.models
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'bookMng_book_fts'
+
+
+def configure_rank(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or FTS_TABLE not in connection.introspection.table_names():
+        return
+    # Default rank column: bm25() with titles weighted 10x over comment text
+    schema_editor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25(10.0, 1.0)')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0012_book_cover_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchIndex',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='bookMng.book')),
+                ('name', models.TextField()),
+                ('comments', models.TextField()),
+                ('document', bookMng.models.SearchDocumentField(db_column='bookMng_book_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'bookMng_book_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(configure_rank, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:09
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_lines(apps, schema_editor):
+    ShoppingCart = apps.get_model('bookMng', 'ShoppingCart')
+    duplicates = (ShoppingCart.objects.filter(checked_out=False).values('user', 'book')
+                  .annotate(lines=Count('id'), keep=Min('id'), total=Sum('quantity'))
+                  .filter(lines__gt=1))
+    for row in duplicates:
+        lines = ShoppingCart.objects.filter(user=row['user'], book=row['book'], checked_out=False)
+        lines.filter(pk=row['keep']).update(quantity=row['total'])
+        lines.exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0013_book_search_index_model'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='shoppingcart',
+            constraint=models.UniqueConstraint(condition=models.Q(('checked_out', False)), fields=('user', 'book'), name='unique_open_cart_line'),
+        ),
+    ]
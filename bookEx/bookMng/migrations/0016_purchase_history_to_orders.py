@@ -0,0 +1,70 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+
+def cart_rows_to_orders(apps, schema_editor):
+    ShoppingCart = apps.get_model('bookMng', 'ShoppingCart')
+    BookReturn = apps.get_model('bookMng', 'BookReturn')
+    Order = apps.get_model('bookMng', 'Order')
+    OrderLine = apps.get_model('bookMng', 'OrderLine')
+    OwnedBook = apps.get_model('bookMng', 'OwnedBook')
+
+    purchased = (ShoppingCart.objects.filter(checked_out=True)
+                 .values('user', 'book', 'book__price').annotate(total=Sum('quantity'))
+                 .order_by('user', 'book'))
+    returned = {
+        (row['user'], row['book']): row['total']
+        for row in BookReturn.objects.values('user', 'book').annotate(total=Sum('quantity'))
+    }
+
+    # The old rows carry no purchase date or price, so each user's history
+    # becomes a single order priced at the book's current price.
+    orders = {}
+    lines, owned = [], []
+    for row in purchased:
+        order = orders.get(row['user'])
+        if order is None:
+            order = orders[row['user']] = Order.objects.create(user_id=row['user'])
+        lines.append(OrderLine(order=order, book_id=row['book'], quantity=row['total'],
+                               unit_price=row['book__price']))
+        net = row['total'] - returned.get((row['user'], row['book']), 0)
+        if net > 0:
+            owned.append(OwnedBook(user_id=row['user'], book_id=row['book'], quantity=net))
+    OrderLine.objects.bulk_create(lines, batch_size=500)
+    OwnedBook.objects.bulk_create(owned, batch_size=500)
+
+    totals = {}
+    for line in lines:
+        totals[line.order_id] = totals.get(line.order_id, Decimal(0)) + line.quantity * line.unit_price
+    for order_id, total in totals.items():
+        Order.objects.filter(pk=order_id).update(total=total)
+
+    ShoppingCart.objects.filter(checked_out=True).delete()
+
+
+def orders_to_cart_rows(apps, schema_editor):
+    ShoppingCart = apps.get_model('bookMng', 'ShoppingCart')
+    Order = apps.get_model('bookMng', 'Order')
+    OrderLine = apps.get_model('bookMng', 'OrderLine')
+    OwnedBook = apps.get_model('bookMng', 'OwnedBook')
+
+    ShoppingCart.objects.bulk_create(
+        [ShoppingCart(user_id=line.order.user_id, book_id=line.book_id, quantity=line.quantity, checked_out=True)
+         for line in OrderLine.objects.select_related('order')],
+        batch_size=500,
+    )
+    OwnedBook.objects.all().delete()
+    Order.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0015_order_ownedbook'),
+    ]
+
+    operations = [
+        migrations.RunPython(cart_rows_to_orders, orders_to_cart_rows),
+    ]
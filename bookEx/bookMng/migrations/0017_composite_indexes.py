@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:12
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+
+
+def drop_duplicate_ratings(apps, schema_editor):
+    Rate = apps.get_model('bookMng', 'Rate')
+    Book = apps.get_model('bookMng', 'Book')
+    duplicates = (Rate.objects.values('user', 'book').annotate(n=Count('id'), keep=Max('id'))
+                  .filter(n__gt=1))
+    touched = set()
+    for row in duplicates:
+        Rate.objects.filter(user=row['user'], book=row['book']).exclude(pk=row['keep']).delete()
+        touched.add(row['book'])
+    for book_id in touched:
+        totals = Rate.objects.filter(book=book_id).aggregate(count=Count('id'), total=Sum('rating'))
+        Book.objects.filter(pk=book_id).update(rating_count=totals['count'], rating_sum=totals['total'],
+                                               rating_avg=totals['total'] / totals['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0016_purchase_history_to_orders'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['price', 'id'], name='book_price_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bookreturn',
+            index=models.Index(fields=['user', 'book'], name='bookreturn_user_book_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['book', 'created_at', 'id'], name='comment_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rate',
+            index=models.Index(fields=['book', 'rating'], name='rate_book_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcart',
+            index=models.Index(fields=['user', 'checked_out', 'book'], name='cart_user_open_book_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='rate',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='unique_user_book_rating'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+ROLE_GROUPS = {
+    'Regular': (),
+    'Publisher': ('Publisher',),
+    'Writer': ('Writer',),
+    'Publisher/Writer': ('Publisher', 'Writer'),
+}
+
+
+def sync_groups_with_profiles(apps, schema_editor):
+    """
+    user_settings used to change UserProfile.role without touching groups,
+    so make each user's Publisher/Writer membership match their profile.
+    """
+    Group = apps.get_model('auth', 'Group')
+    UserProfile = apps.get_model('bookMng', 'UserProfile')
+    User = apps.get_model('auth', 'User')
+    Membership = User.groups.through
+
+    groups = {name: Group.objects.get_or_create(name=name)[0] for name in ('Publisher', 'Writer')}
+    group_ids = [g.pk for g in groups.values()]
+    for profile in UserProfile.objects.iterator():
+        wanted = {groups[name].pk for name in ROLE_GROUPS.get(profile.role, ())}
+        Membership.objects.filter(user_id=profile.user_id, group_id__in=group_ids).exclude(
+            group_id__in=wanted).delete()
+        have = set(Membership.objects.filter(user_id=profile.user_id, group_id__in=wanted)
+                   .values_list('group_id', flat=True))
+        Membership.objects.bulk_create(Membership(user_id=profile.user_id, group_id=g) for g in wanted - have)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0018_task_queue'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='role',
+            field=models.CharField(choices=[('Regular', 'Regular User'), ('Publisher', 'Publisher'), ('Writer', 'Writer'), ('Publisher/Writer', 'Publisher and Writer')], default='Regular', max_length=20),
+        ),
+        migrations.RunPython(sync_groups_with_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0020_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=20)),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('bucket_start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bookMng.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('metric', 'period', 'bucket_start', 'book'), name='unique_book_counter_bucket')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LeaderboardEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('board', models.CharField(max_length=20)),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.IntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bookMng.book')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('board', 'rank'), name='unique_leaderboard_rank')],
+            },
+        ),
+    ]
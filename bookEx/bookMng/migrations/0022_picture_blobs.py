@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:50
+
+import bookMng.storage
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_pictures(apps, schema_editor):
+    Book = apps.get_model('bookMng', 'Book')
+    Blob = apps.get_model('bookMng', 'Blob')
+    counts = Book.objects.exclude(picture='').values_list('picture').annotate(n=Count('id')).order_by()
+    Blob.objects.bulk_create((Blob(name=name, refcount=n) for name, n in counts), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0021_leaderboards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('refcount', models.IntegerField(default=0)),
+                ('orphaned_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='picture',
+            field=models.FileField(max_length=255, storage=bookMng.storage.ContentAddressedStorage(), upload_to='bookEx/static/uploads'),
+        ),
+        migrations.RunPython(count_pictures, migrations.RunPython.noop),
+    ]
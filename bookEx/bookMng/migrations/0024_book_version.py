@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookMng', '0023_role_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    # Persistent: the file stays in WAL mode for every later connection.
+    # An in-memory database (the test database) just answers "memory".
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+
+def disable_wal(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=DELETE')
+
+
+class Migration(migrations.Migration):
+    # The journal mode can't be changed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('bookMng', '0024_book_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
@@ -1,8 +1,13 @@
+import time
+
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Lookup
 from django.utils.timezone import now
 from django.db.models import Avg
 
+from .storage import ContentAddressedStorage
+
 class MainMenu(models.Model):
    item = models.CharField(max_length=300, unique=True)
    link = models.CharField(max_length=300, unique=True)
@@ -15,26 +20,117 @@ class Book(models.Model):
     web = models.URLField(max_length=300)
     price = models.DecimalField(decimal_places=2, max_digits=8)
     publishdate = models.DateField(auto_now=True)
-    picture = models.FileField(upload_to='bookEx/static/uploads')
+    # Stored once per content; bookMng.blobs tracks which books use each file
+    picture = models.FileField(upload_to='bookEx/static/uploads', storage=ContentAddressedStorage(), max_length=255)
     pic_path = models.CharField(max_length=300, editable=False, blank=True)
+    # Resized variants written by bookMng.images, stored as static paths
+    thumb_path = models.CharField(max_length=300, editable=False, blank=True)
+    cover_path = models.CharField(max_length=300, editable=False, blank=True)
     username = models.ForeignKey(User, blank=True, null=True, on_delete=models.CASCADE)
     favorites = models.ManyToManyField(User, related_name='favorite_books', blank=True)
     quantity = models.PositiveIntegerField(default=0)
+    # Denormalized from Rate, kept current by bookMng.ratings
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.FloatField(default=0, editable=False, db_index=True)
+    # Stamp of the last change that alters the book's catalog rows (bookMng.fragments)
+    version = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination with ?sort=price seeks on (price, id)
+            models.Index(fields=['price', 'id'], name='book_price_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def prepare_picture(self):
+        """
+        Store an uncommitted upload and refresh pic_path from its final name.
+        Returns True if the picture changed. save() calls this; bulk inserts
+        must call it themselves.
+        """
+        if self.picture and not self.picture._committed:
+            self.picture.save(self.picture.name, self.picture.file, save=False)
+        pic_path = self.picture.url.split('/static/')[-1] if self.picture else ''
+        if pic_path == self.pic_path:
+            return False
+        # New upload: the old variants no longer match it
+        self.pic_path = pic_path
+        self.thumb_path = self.cover_path = ''
+        return True
+
+    def save(self, *args, **kwargs):
+        if self.prepare_picture() and kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'pic_path', 'thumb_path', 'cover_path'}
+        self.version = time.time_ns()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
+
+    @property
+    def thumbnail(self):
+        return self.thumb_path or self.pic_path
+
+    @property
+    def cover(self):
+        return self.cover_path or self.pic_path
+
     @property
     def average_rating(self):
-        avg = self.rate_set.aggregate(models.Avg('rating'))['rating__avg']
-        return avg or 0
+        return self.rating_avg
+
+
+class SearchDocumentField(models.TextField):
+    """The FTS5 hidden column named after its table; only supports __match."""
+
+
+@SearchDocumentField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class BookSearchIndex(models.Model):
+    """
+    Read-only mapping of the FTS5 table maintained by bookMng.search, so the
+    ORM can join it to Book. ``rank`` is bm25() with the weights configured
+    on the table.
+    """
+    book = models.OneToOneField(Book, on_delete=models.DO_NOTHING, primary_key=True,
+                                db_column='rowid', db_constraint=False, related_name='search_index')
+    name = models.TextField()
+    comments = models.TextField()
+    document = SearchDocumentField(db_column='bookMng_book_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'bookMng_book_fts'
 
 
 class ShoppingCart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
-    checked_out = models.BooleanField(default=False)  # marks if purchased
+    # Legacy purchase flag: since migration 0015 checkout records an Order and
+    # deletes the cart rows, so open cart rows are always checked_out=False.
+    checked_out = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # One open cart line per book, so add_to_cart's get_or_create cannot race into duplicates
+            models.UniqueConstraint(fields=['user', 'book'], condition=models.Q(checked_out=False),
+                                    name='unique_open_cart_line'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'checked_out', 'book'], name='cart_user_open_book_idx'),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.book.name} for {self.user.username}"
@@ -45,12 +141,26 @@ class Rate(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     rating = models.PositiveIntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_user_book_rating'),
+        ]
+        indexes = [
+            models.Index(fields=['book', 'rating'], name='rate_book_rating_idx'),
+        ]
+
 class Comment(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(default=now)
 
+    class Meta:
+        indexes = [
+            # Matches the (created_at, id) keyset the comment pages seek on
+            models.Index(fields=['book', 'created_at', 'id'], name='comment_book_created_idx'),
+        ]
+
     def __str__(self):
         return f'Comment by {self.user.username} on {self.book.name}'
 
@@ -60,14 +170,159 @@ class BookReturn(models.Model):
     quantity = models.PositiveIntegerField()
     returned_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'book'], name='bookreturn_user_book_idx'),
+        ]
+
+class Order(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    created_at = models.DateTimeField(default=now)
+    total = models.DecimalField(decimal_places=2, max_digits=10, default=0)
+
+    def __str__(self):
+        return f'Order {self.pk} by {self.user.username}'
+
+
+class OrderLine(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(decimal_places=2, max_digits=8)  # price paid, not the current price
+
+    def __str__(self):
+        return f'{self.quantity} x {self.book.name} @ {self.unit_price}'
+
+
+class OwnedBook(models.Model):
+    """Net copies of a book a user holds: purchased minus returned."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_books')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='owners')
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='unique_owned_book'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} owns {self.quantity} x {self.book.name}'
+
+
 class UserProfile(models.Model):
     ROLE_CHOICES = [
         ('Regular', 'Regular User'),
         ('Publisher', 'Publisher'),
         ('Writer', 'Writer'),
+        ('Publisher/Writer', 'Publisher and Writer'),
     ]
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='Regular')
+    role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='Regular')
 
     def __str__(self):
         return f"{self.user.username} - {self.role}"
+
+
+class RoleVersion(models.Model):
+    """Bumped whenever a user's roles change; session copies of the roles must match it (bookMng.roles)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    version = models.BigIntegerField(default=0)
+
+
+class Task(models.Model):
+    """A queued background job for the database task backend (see tasks.py)."""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    name = models.CharField(max_length=100)
+    args = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name}{tuple(self.args)} [{self.status}]'
+
+
+class SimilarBook(models.Model):
+    """One entry of a book's "readers also liked" list, built by bookMng.recommendations."""
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the index the detail page reads a book's list through, in rank order
+            models.UniqueConstraint(fields=['book', 'rank'], name='unique_similar_book_rank'),
+        ]
+
+
+class UserRecommendation(models.Model):
+    """One entry of a user's "recommended for you" list, built by bookMng.recommendations."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'rank'], name='unique_user_recommendation_rank'),
+        ]
+
+
+class InteractionChange(models.Model):
+    """A favorite, rating or purchase the next incremental recommendation build must account for."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+
+
+class BookCounter(models.Model):
+    """Activity on a book in one hour or day, kept by bookMng.leaderboards."""
+    HOUR, DAY = 'hour', 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    metric = models.CharField(max_length=20)
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    bucket_start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['metric', 'period', 'bucket_start', 'book'],
+                                    name='unique_book_counter_bucket'),
+        ]
+
+
+class LeaderboardEntry(models.Model):
+    """One row of a materialized top-N list shown on the index page."""
+    board = models.CharField(max_length=20)
+    rank = models.PositiveSmallIntegerField()
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['board', 'rank'], name='unique_leaderboard_rank'),
+        ]
+
+
+class Blob(models.Model):
+    """A stored picture and the number of books using it, kept by bookMng.blobs."""
+    name = models.CharField(max_length=255, unique=True)
+    refcount = models.IntegerField(default=0)
+    # When refcount last dropped to zero
+    orphaned_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return self.name
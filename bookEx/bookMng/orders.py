@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models import F
+
+from . import cart
+from .models import Book, BookReturn, Order, OrderLine, OwnedBook, ShoppingCart
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStock(CheckoutError):
+    def __init__(self, book, requested):
+        self.book = book
+        self.requested = requested
+        super().__init__(f'Only {book.quantity} copy/copies of {book.name} left; you asked for {requested}.')
+
+
+class EmptyCart(CheckoutError):
+    pass
+
+
+def add_to_cart(user, book):
+    """Add one copy of ``book`` to ``user``'s open cart without losing concurrent clicks."""
+    cart_item, created = ShoppingCart.objects.get_or_create(user=user, book=book, checked_out=False)
+    if not created:
+        ShoppingCart.objects.filter(pk=cart_item.pk).update(quantity=F('quantity') + 1)
+    cart.invalidate([user.pk])
+    return cart_item
+
+
+def checkout(user):
+    """
+    Buy everything in ``user``'s open cart, or nothing, and return the Order.
+
+    Stock is taken with one conditional UPDATE per book
+    (``quantity = quantity - n WHERE quantity >= n``), so two buyers can never
+    both take the last copy and no row is locked for longer than its UPDATE.
+    Books are updated in id order so concurrent checkouts lock rows in the
+    same order. The cart rows are replaced by an Order with the prices paid,
+    and the user's OwnedBook ledger is credited.
+    """
+    with transaction.atomic():
+        items = list(ShoppingCart.objects.filter(user=user, checked_out=False)
+                     .select_related('book').order_by('book_id'))
+        if not items:
+            raise EmptyCart('Your cart is empty.')
+
+        for item in items:
+            taken = Book.objects.filter(pk=item.book_id, quantity__gte=item.quantity).update(
+                quantity=F('quantity') - item.quantity)
+            if not taken:
+                item.book.refresh_from_db(fields=['quantity'])
+                raise OutOfStock(item.book, item.quantity)
+
+        # A concurrent checkout of the same cart deletes fewer rows than we read
+        deleted, _ = ShoppingCart.objects.filter(pk__in=[i.pk for i in items], checked_out=False).delete()
+        if deleted != len(items):
+            raise CheckoutError('Your cart changed during checkout; please review it and try again.')
+
+        order = Order.objects.create(
+            user=user, total=sum(item.quantity * item.book.price for item in items))
+        OrderLine.objects.bulk_create(
+            OrderLine(order=order, book_id=item.book_id, quantity=item.quantity, unit_price=item.book.price)
+            for item in items)
+        for item in items:
+            credit_owned(user, item.book_id, item.quantity)
+        cart.invalidate([user.pk])
+    return order
+
+
+def credit_owned(user, book_id, quantity):
+    owned, created = OwnedBook.objects.get_or_create(user=user, book_id=book_id,
+                                                     defaults={'quantity': quantity})
+    if not created:
+        OwnedBook.objects.filter(pk=owned.pk).update(quantity=F('quantity') + quantity)
+
+
+def owned_quantity(user, book):
+    return OwnedBook.objects.filter(user=user, book=book).values_list('quantity', flat=True).first() or 0
+
+
+def return_copies(user, book, quantity):
+    """
+    Give ``quantity`` owned copies of ``book`` back to the shop. Returns False
+    without changing anything if the user owns fewer copies than that.
+    """
+    if quantity <= 0:
+        return False
+    with transaction.atomic():
+        taken = OwnedBook.objects.filter(user=user, book=book, quantity__gte=quantity).update(
+            quantity=F('quantity') - quantity)
+        if not taken:
+            return False
+        Book.objects.filter(pk=book.pk).update(quantity=F('quantity') + quantity)
+        BookReturn.objects.create(user=user, book=book, quantity=quantity)
+    return True
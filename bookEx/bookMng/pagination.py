@@ -0,0 +1,175 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+# Orderings a listing may be keyset-paginated on. Every ordering ends in 'id'
+# so the key is unique and the cursor position is never ambiguous.
+ORDERINGS = {
+    'id': ('id',),
+    'price': ('price', 'id'),
+    'created': ('created_at', 'id'),
+    # Only usable on querysets annotated by search.filter_books()
+    'relevance': ('search_rank', 'id'),
+}
+DEFAULT_PER_PAGE = 25
+MAX_PER_PAGE = 100
+
+
+def encode_cursor(values):
+    raw = json.dumps([str(v) for v in values]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """Return the key values stored in ``cursor`` or None if it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _seek_filter(fields, values, forward):
+    # (a, b) > (x, y)  ==  a > x OR (a = x AND b > y), expanded for any length
+    lookup = 'gt' if forward else 'lt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        clause = Q(**{f'{field}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            clause &= Q(**{prev_field: prev_value})
+        condition |= clause
+    return condition
+
+
+class KeysetPage:
+    prefix = ''
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    def _cursor(self, obj):
+        # Rows are model instances, or dicts when the queryset used .values()
+        if isinstance(obj, dict):
+            return encode_cursor([obj[f] for f in self.paginator.fields])
+        return encode_cursor([getattr(obj, f) for f in self.paginator.fields])
+
+    @property
+    def next_cursor(self):
+        if not self.has_next or not self.object_list:
+            return None
+        return self._cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous or not self.object_list:
+            return None
+        return self._cursor(self.object_list[0])
+
+
+class KeysetPaginator:
+    """
+    Cursor based paginator. Pages are fetched with a seek predicate on the
+    ordering key instead of OFFSET, so every page costs the same and no
+    COUNT(*) is issued.
+    """
+
+    def __init__(self, queryset, per_page=DEFAULT_PER_PAGE, ordering='id'):
+        self.queryset = queryset
+        self.per_page = per_page
+        if ordering not in ORDERINGS or not self._can_order_by(ORDERINGS[ordering]):
+            ordering = 'id'
+        self.ordering = ordering
+        self.fields = ORDERINGS[ordering]
+
+    def _can_order_by(self, fields):
+        opts = self.queryset.model._meta
+        names = {f.attname for f in opts.concrete_fields} | {'id'}
+        names.update(self.queryset.query.annotations)
+        return all(f in names for f in fields)
+
+    def _query(self, after, before):
+        """The page's LIMITed queryset, its direction and the decoded cursor."""
+        forward = not before
+        cursor = after if forward else before
+        values = decode_cursor(cursor, len(self.fields)) if cursor else None
+        qs = self.queryset
+        if values is not None:
+            try:
+                qs = qs.filter(_seek_filter(self.fields, values, forward))
+            except (ValueError, ValidationError):
+                values, qs = None, self.queryset
+        if values is None:
+            # A missing or malformed cursor always means the first page
+            forward = True
+
+        order_by = self.fields if forward else tuple(f'-{f}' for f in self.fields)
+        return qs.order_by(*order_by)[:self.per_page + 1], forward, values
+
+    def _page(self, rows, forward, values):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if forward:
+            return KeysetPage(rows, self, has_next=has_more, has_previous=values is not None)
+        rows.reverse()
+        return KeysetPage(rows, self, has_next=True, has_previous=has_more)
+
+    def page(self, after=None, before=None):
+        qs, forward, values = self._query(after, before)
+        return self._page(list(qs), forward, values)
+
+    async def apage(self, after=None, before=None):
+        qs, forward, values = self._query(after, before)
+        rows = [row async for row in qs.aiterator(chunk_size=self.per_page + 1)]
+        return self._page(rows, forward, values)
+
+
+def _paginator(request, queryset, prefix, per_page, ordering):
+    params = request.GET
+    try:
+        per_page = min(max(int(params.get(f'{prefix}per_page', per_page)), 1), MAX_PER_PAGE)
+    except ValueError:
+        pass
+    return KeysetPaginator(queryset, per_page=per_page,
+                           ordering=params.get(f'{prefix}sort', ordering))
+
+
+def paginate(request, queryset, prefix='', per_page=DEFAULT_PER_PAGE, ordering='id'):
+    """
+    Paginate ``queryset`` from the ``<prefix>after`` / ``<prefix>before`` /
+    ``<prefix>sort`` / ``<prefix>per_page`` query parameters.
+    """
+    paginator = _paginator(request, queryset, prefix, per_page, ordering)
+    page = paginator.page(after=request.GET.get(f'{prefix}after'),
+                          before=request.GET.get(f'{prefix}before'))
+    page.prefix = prefix
+    return page
+
+
+async def apaginate(request, queryset, prefix='', per_page=DEFAULT_PER_PAGE, ordering='id'):
+    """Async ``paginate`` for async views."""
+    paginator = _paginator(request, queryset, prefix, per_page, ordering)
+    page = await paginator.apage(after=request.GET.get(f'{prefix}after'),
+                                 before=request.GET.get(f'{prefix}before'))
+    page.prefix = prefix
+    return page
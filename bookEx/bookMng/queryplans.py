@@ -0,0 +1,92 @@
+"""
+EXPLAIN-based index advisor used by ``manage.py check_query_plans``.
+
+Every statement a view issues is re-run under EXPLAIN and the plan is
+searched for table scans. A scan is accepted when the table is expected to be
+read whole (ALLOWED_SCANS), or when it is the main query's outermost loop,
+the statement has a LIMIT and the plan needs no temporary sort: the scan
+walks an index or the rowid in the requested order and stops early. The
+inner loops of a join and the scans in subqueries still run in full for
+every row (or once up front), so a LIMIT doesn't excuse them.
+"""
+import re
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+# Small tables that are meant to be read in full
+ALLOWED_SCANS = {'bookMng_mainmenu', 'django_content_type', 'auth_permission'}
+
+_SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?"?(\w+)"?(?!\w| USING (?:COVERING )?INDEX| VIRTUAL TABLE)')
+_POSTGRES_SCAN = re.compile(r'Seq Scan on "?(\w+)"?')
+
+
+def explain(sql, params):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            # (id, parent, notused, detail); indent children as the sqlite3 shell does
+            depth, lines = {}, []
+            for node, parent, _, detail in cursor.fetchall():
+                depth[node] = depth[parent] + 1 if parent in depth else 0
+                lines.append('  ' * depth[node] + detail)
+            return lines
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _outer_loop(plan):
+    """Index of the line for the main query's outermost loop, or None."""
+    for index, line in enumerate(plan):
+        if connection.vendor == 'sqlite':
+            # Loops of the main query are the unindented SCAN/SEARCH lines, outermost first
+            if line.startswith(('SCAN ', 'SEARCH ')):
+                return index
+        elif ' Scan ' in line:
+            # PostgreSQL lists the outer side of a join first
+            return index
+    return None
+
+
+def full_scans(sql, plan):
+    """Tables ``plan`` reads in full without an early exit."""
+    pattern = _SQLITE_SCAN if connection.vendor == 'sqlite' else _POSTGRES_SCAN
+    bounded = ' LIMIT ' in sql.upper() and not any('TEMP B-TREE' in line or 'Sort' in line for line in plan)
+    # Only the outermost loop stops when the LIMIT is reached
+    exempt = _outer_loop(plan) if bounded else None
+    scans = []
+    for index, line in enumerate(plan):
+        match = pattern.search(line)
+        if match and match.group(1) not in ALLOWED_SCANS and index != exempt:
+            scans.append(match.group(1))
+    return scans
+
+
+def _is_explainable(sql):
+    return sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE'))
+
+
+def check_scenarios(scenarios, user):
+    """
+    Run each ``(name, method, url, params)`` scenario as ``user`` and return
+    ``{name: [(sql, plan, scanned_tables)]}`` for every statement that scans.
+    The scenarios' own writes are rolled back afterwards by the caller's
+    test database teardown.
+    """
+    client = Client()
+    client.force_login(user)
+    problems = {}
+    for name, method, url, params in scenarios:
+        with CaptureQueriesContext(connection) as captured:
+            getattr(client, method)(url, params)
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not _is_explainable(sql):
+                continue
+            # captured SQL has parameters inlined; re-run it verbatim
+            plan = explain(sql, None)
+            scans = full_scans(sql, plan)
+            if scans:
+                problems.setdefault(name, []).append((sql, plan, scans))
+    return problems
@@ -0,0 +1,87 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+
+from . import fragments
+from .models import Book, Rate
+
+
+def _apply_delta(book_id, count_delta, sum_delta):
+    books = Book.objects.filter(pk=book_id)
+    books.update(rating_count=F('rating_count') + count_delta,
+                 rating_sum=F('rating_sum') + sum_delta)
+    books.update(rating_avg=Case(
+        When(rating_count=0, then=Value(0.0)),
+        default=Cast('rating_sum', FloatField()) / F('rating_count'),
+    ))
+
+
+def set_rating(user, book, rating):
+    """
+    Create or change ``user``'s rating of ``book`` and update its aggregates.
+    Returns ``(rate, created)`` like get_or_create.
+    """
+    with transaction.atomic():
+        rate = Rate.objects.select_for_update().filter(user=user, book=book).first()
+        if rate is None:
+            try:
+                # select_for_update locks nothing while there is no row yet
+                with transaction.atomic():
+                    rate = Rate.objects.create(user=user, book=book, rating=rating)
+            except IntegrityError:
+                # A concurrent first rating won; change that one instead
+                rate = Rate.objects.select_for_update().get(user=user, book=book)
+            else:
+                _apply_delta(book.pk, 1, rating)
+                return rate, True
+        if rate.rating != rating:
+            _apply_delta(book.pk, 0, rating - rate.rating)
+            rate.rating = rating
+            rate.save(update_fields=['rating'])
+    return rate, False
+
+
+def remove_rating(rate):
+    # The post_delete signal takes it out of the aggregates (see rating_deleted)
+    Rate.objects.filter(pk=rate.pk).delete()
+
+
+def rating_deleted(rate):
+    """
+    Take a deleted ``rate`` out of its book's aggregates. Connected to
+    post_delete, so cascades (a deleted user), the admin and queryset
+    deletes keep the aggregates current too.
+    """
+    _apply_delta(rate.book_id, -1, -rate.rating)
+
+
+def rebuild_rating_aggregates(book_ids=None, batch_size=1000):
+    """
+    Recompute the stored rating columns from the Rate table. Returns the
+    number of books written.
+    """
+    books = Book.objects.order_by('pk')
+    if book_ids is not None:
+        books = books.filter(pk__in=book_ids)
+
+    updated = 0
+    last_pk = 0
+    while True:
+        batch = list(books.filter(pk__gt=last_pk).only('pk')[:batch_size])
+        if not batch:
+            return updated
+        last_pk = batch[-1].pk
+        totals = {
+            row['book']: row
+            for row in Rate.objects.filter(book__in=batch).values('book')
+                                   .annotate(count=Count('id'), total=Sum('rating'))
+        }
+        for book in batch:
+            row = totals.get(book.pk)
+            book.rating_count = row['count'] if row else 0
+            book.rating_sum = row['total'] if row else 0
+            book.rating_avg = book.rating_sum / book.rating_count if book.rating_count else 0
+        with transaction.atomic():
+            Book.objects.bulk_update(batch, ['rating_count', 'rating_sum', 'rating_avg'])
+        fragments.bump_books(book.pk for book in batch)
+        updated += len(batch)
@@ -0,0 +1,221 @@
+"""
+Item-item recommendations built offline by ``manage.py build_recommendations``.
+
+Every (user, book) interaction gets a weight: a favorite counts 3, a
+purchase 2 and a rating ``rating - 2``, so ratings below 3 are ignored.
+When a user has several, the largest wins. The weights form a sparse
+user x book matrix. A book's neighbours are the books with the highest
+cosine similarity between their columns. These are stored as TOP_K rows in
+SimilarBook, and each user's RECOMMEND_N best unseen books go in
+UserRecommendation. The pages then read a list with one indexed query
+instead of computing anything.
+
+With SciPy installed the similarities come from sparse matrix products,
+one block of books at a time. Without it, a pure-Python loop over users'
+baskets gives the same scores, only more slowly.
+
+Favorites, ratings and purchases each record an InteractionChange (see
+signals.py). An incremental build reads the whole matrix, but it only
+recomputes and rewrites:
+- the changed books,
+- the books their users interacted with,
+- those users' own lists.
+Other books' scores against a changed book drift slightly until the next
+``--full`` build.
+"""
+import heapq
+import math
+from collections import defaultdict
+
+from django.db import transaction
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional; the pure-Python path is used without them
+    np = sparse = None
+
+from .models import Book, InteractionChange, OwnedBook, Rate, SimilarBook, UserRecommendation
+
+TOP_K = 20
+RECOMMEND_N = 20
+MAX_BASKET = 500  # strongest interactions kept per user; caps the pairs a heavy user adds
+FAVORITE_WEIGHT = 3.0
+PURCHASE_WEIGHT = 2.0
+CHUNK_SIZE = 5000
+BLOCK_SIZE = 1000  # books per sparse product
+
+
+def note_interactions(pairs):
+    """Record changed ``(user_id, book_id)`` pairs for the next incremental build."""
+    changes = [InteractionChange(user_id=user_id, book_id=book_id) for user_id, book_id in pairs]
+    if changes:
+        InteractionChange.objects.bulk_create(changes)
+
+
+def load_baskets():
+    """``{user_id: {book_id: weight}}`` over all favorites, purchases and ratings."""
+    baskets = defaultdict(dict)
+
+    def add(rows, weight=None):
+        for row in rows.iterator(chunk_size=CHUNK_SIZE):
+            user_id, book_id = row[0], row[1]
+            w = weight if weight is not None else row[2] - 2.0
+            basket = baskets[user_id]
+            if w > basket.get(book_id, 0):
+                basket[book_id] = w
+
+    add(Book.favorites.through.objects.values_list('user_id', 'book_id'), FAVORITE_WEIGHT)
+    # Migration 0016 moved the purchases made before Orders existed into OwnedBook
+    add(OwnedBook.objects.values_list('user_id', 'book_id'), PURCHASE_WEIGHT)
+    add(Rate.objects.filter(rating__gte=3).values_list('user_id', 'book_id', 'rating'))
+
+    for user_id, basket in baskets.items():
+        if len(basket) > MAX_BASKET:
+            baskets[user_id] = dict(heapq.nlargest(MAX_BASKET, basket.items(), key=lambda kv: kv[1]))
+    return baskets
+
+
+def _top(scores, k):
+    """The ``k`` best ``(book_id, score)`` pairs, ties broken by book id."""
+    return heapq.nlargest(k, scores, key=lambda pair: (pair[1], -pair[0]))
+
+
+def _similar_python(baskets, book_ids, k):
+    book_users = defaultdict(dict)
+    for user_id, basket in baskets.items():
+        for book_id, weight in basket.items():
+            book_users[book_id][user_id] = weight
+    norms = {book_id: math.sqrt(sum(w * w for w in users.values())) for book_id, users in book_users.items()}
+
+    similar = {}
+    for book_id in book_ids:
+        dots = defaultdict(float)
+        for user_id, weight in book_users.get(book_id, {}).items():
+            for other, other_weight in baskets[user_id].items():
+                if other != book_id:
+                    dots[other] += weight * other_weight
+        similar[book_id] = _top(((other, dot / (norms[book_id] * norms[other])) for other, dot in dots.items()), k)
+    return similar
+
+
+def _similar_scipy(baskets, book_ids, k):
+    books = sorted({book_id for basket in baskets.values() for book_id in basket})
+    column = {book_id: i for i, book_id in enumerate(books)}
+    indptr, indices, data = [0], [], []
+    for basket in baskets.values():
+        indices.extend(column[book_id] for book_id in basket)
+        data.extend(basket.values())
+        indptr.append(len(indices))
+    matrix = sparse.csr_matrix((np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int64),
+                                np.asarray(indptr, dtype=np.int64)), shape=(len(baskets), len(books)))
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    norms[norms == 0] = 1.0
+    matrix = (matrix @ sparse.diags(1.0 / norms)).tocsc()
+
+    similar = {book_id: [] for book_id in book_ids}
+    targets = [column[book_id] for book_id in book_ids if book_id in column]
+    for start in range(0, len(targets), BLOCK_SIZE):
+        block = targets[start:start + BLOCK_SIZE]
+        products = (matrix[:, block].T @ matrix).tocsr()
+        for row, i in enumerate(block):
+            cols = products.indices[products.indptr[row]:products.indptr[row + 1]]
+            vals = products.data[products.indptr[row]:products.indptr[row + 1]]
+            keep = cols != i
+            cols, vals = cols[keep], vals[keep]
+            if len(vals) > k:
+                best = np.argpartition(-vals, k)[:k]
+                cols, vals = cols[best], vals[best]
+            similar[books[i]] = _top(((books[c], float(v)) for c, v in zip(cols, vals)), k)
+    return similar
+
+
+def similar_books(baskets, book_ids, k=TOP_K):
+    """``{book_id: [(similar_id, score), ...]}`` for ``book_ids``, best first."""
+    if sparse is not None:
+        return _similar_scipy(baskets, book_ids, k)
+    return _similar_python(baskets, book_ids, k)
+
+
+def recommend(basket, neighbours, n=RECOMMEND_N):
+    """Best books not in ``basket``, scored by similarity to what is in it."""
+    scores = defaultdict(float)
+    for book_id, weight in basket.items():
+        for other, score in neighbours.get(book_id, ()):
+            if other not in basket:
+                scores[other] += weight * score
+    return _top(scores.items(), n)
+
+
+def _stored_neighbours(book_ids):
+    neighbours = defaultdict(list)
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), CHUNK_SIZE):
+        rows = (SimilarBook.objects.filter(book_id__in=book_ids[start:start + CHUNK_SIZE])
+                .order_by('book_id', 'rank').values_list('book_id', 'similar_id', 'score'))
+        for book_id, similar_id, score in rows:
+            neighbours[book_id].append((similar_id, score))
+    return neighbours
+
+
+def _replace(model, owner_field, lists, item_field):
+    """Swap the stored lists of ``lists``' owners for the new ones, a chunk at a time."""
+    owners = list(lists)
+    for start in range(0, len(owners), CHUNK_SIZE):
+        chunk = owners[start:start + CHUNK_SIZE]
+        with transaction.atomic():
+            model.objects.filter(**{f'{owner_field}__in': chunk}).delete()
+            model.objects.bulk_create(
+                (model(**{owner_field: owner, item_field: item, 'rank': rank, 'score': score})
+                 for owner in chunk for rank, (item, score) in enumerate(lists[owner])),
+                batch_size=CHUNK_SIZE)
+
+
+def build(full=False, k=TOP_K, n=RECOMMEND_N):
+    """
+    Rebuild the stored lists; returns ``(books_written, users_written)``.
+    Without ``full`` only what pending InteractionChanges affect is rebuilt.
+    """
+    last_change = InteractionChange.objects.order_by('-pk').values_list('pk', flat=True).first()
+    if not full and last_change is None:
+        return 0, 0
+    baskets = load_baskets()
+
+    if full:
+        users = set(baskets)
+        books = {book_id for basket in baskets.values() for book_id in basket}
+        # Books and users left without any interactions get empty lists, i.e. lose theirs
+        books.update(SimilarBook.objects.values_list('book_id', flat=True).distinct())
+        users.update(UserRecommendation.objects.values_list('user_id', flat=True).distinct())
+    else:
+        changes = InteractionChange.objects.filter(pk__lte=last_change).values_list('user_id', 'book_id')
+        users, books = set(), set()
+        for user_id, book_id in changes.iterator(chunk_size=CHUNK_SIZE):
+            users.add(user_id)
+            books.add(book_id)
+        for user_id in users:
+            books.update(baskets.get(user_id, ()))
+
+    similar = similar_books(baskets, sorted(books), k)
+    _replace(SimilarBook, 'book_id', similar, 'similar_id')
+
+    if full:
+        neighbours = similar
+    else:
+        neighbours = _stored_neighbours({b for u in users for b in baskets.get(u, ())})
+    recommendations = {user_id: recommend(baskets.get(user_id, {}), neighbours, n) for user_id in users}
+    _replace(UserRecommendation, 'user_id', recommendations, 'book_id')
+
+    if last_change is not None:
+        InteractionChange.objects.filter(pk__lte=last_change).delete()
+    return len(similar), len(recommendations)
+
+
+def also_liked(book, limit=6):
+    return [row.similar for row in SimilarBook.objects.filter(book=book)
+            .select_related('similar').order_by('rank')[:limit]]
+
+
+def recommended_for(user, limit=6):
+    return [row.book for row in UserRecommendation.objects.filter(user=user)
+            .select_related('book').order_by('rank')[:limit]]
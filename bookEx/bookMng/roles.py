@@ -0,0 +1,120 @@
+"""
+Role lookups for authorization checks.
+
+A user's roles are the names of their auth Groups. UserProfile.role is the
+role picked at registration or on the settings page; saving a profile makes
+the user's Publisher/Writer groups match it.
+
+Changing a user's groups, profile or superuser flag bumps their RoleVersion
+row in the same transaction (see signals.py). Every request reads that row
+once, a single primary-key query, and only trusts a cached copy of the
+roles made at the same version:
+
+* on the user object, for the rest of the request (no query at all);
+* per process, keyed by the version;
+* in the session, stored with the version.
+
+So a revoked role stops working on the very next request in every process,
+whatever cache backend it runs with; the groups themselves are only read
+again after a change.
+"""
+import threading
+import time
+
+from django.contrib.auth.models import Group
+from django.db import transaction
+
+from .models import RoleVersion, UserProfile
+
+SESSION_KEY = 'bookMng_roles'
+LOCAL_MAX_USERS = 10000
+
+ROLE_GROUPS = {
+    'Regular': (),
+    'Publisher': ('Publisher',),
+    'Writer': ('Writer',),
+    'Publisher/Writer': ('Publisher', 'Writer'),
+}
+MANAGED_GROUPS = ('Publisher', 'Writer')
+
+_lock = threading.Lock()
+_local = {}
+
+
+def _version(user_id):
+    # Users whose roles never changed have no row
+    return RoleVersion.objects.filter(user_id=user_id).values_list('version', flat=True).first() or 0
+
+
+def invalidate(user_ids):
+    """Bump the role version of ``user_ids``; local copies go now and again once the transaction commits."""
+    user_ids = set(user_ids)
+
+    def forget():
+        with _lock:
+            for user_id in user_ids:
+                _local.pop(user_id, None)
+
+    if user_ids:
+        version = time.time_ns()
+        RoleVersion.objects.bulk_create([RoleVersion(user_id=user_id, version=version) for user_id in user_ids],
+                                        update_conflicts=True, unique_fields=['user'], update_fields=['version'])
+        forget()
+        transaction.on_commit(forget)
+
+
+def get_roles(user, session=None):
+    """The set of role names ``user`` holds; empty for anonymous users."""
+    if not user.is_authenticated:
+        return frozenset()
+    cached = getattr(user, '_bookmng_roles', None)
+    if cached is not None:
+        return cached
+
+    version = _version(user.pk)
+    entry = _local.get(user.pk)
+    stored = session.get(SESSION_KEY) if session is not None else None
+    if entry and entry[1] == version:
+        roles = entry[0]
+    elif stored and stored[0] == version:
+        roles = frozenset(stored[1])
+    else:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        if user.is_superuser:
+            roles |= {'superuser'}
+    if session is not None and stored != [version, sorted(roles)]:
+        session[SESSION_KEY] = [version, sorted(roles)]
+    with _lock:
+        if len(_local) >= LOCAL_MAX_USERS:
+            _local.clear()
+        _local[user.pk] = (roles, version)
+
+    user._bookmng_roles = roles
+    return roles
+
+
+def has_role(user, *names, session=None):
+    """True if ``user`` holds any of ``names``. Superusers hold every role."""
+    roles = get_roles(user, session)
+    return 'superuser' in roles or any(name in roles for name in names)
+
+
+def sync_groups(user, role):
+    """Make ``user``'s Publisher/Writer membership match profile ``role``."""
+    wanted = set(ROLE_GROUPS.get(role, ()))
+    groups = {g.name: g for g in Group.objects.filter(name__in=MANAGED_GROUPS)}
+    for name in wanted - set(groups):
+        groups[name] = Group.objects.create(name=name)
+    have = set(user.groups.filter(name__in=MANAGED_GROUPS).values_list('name', flat=True))
+    if have - wanted:
+        user.groups.remove(*[groups[name] for name in have - wanted])
+    if wanted - have:
+        user.groups.add(*[groups[name] for name in wanted - have])
+
+
+def set_role(user, role):
+    """Store ``role`` on the profile; saving it syncs the groups (see signals.py)."""
+    with transaction.atomic():
+        UserProfile.objects.update_or_create(user=user, defaults={'role': role})
+    if hasattr(user, '_bookmng_roles'):
+        del user._bookmng_roles
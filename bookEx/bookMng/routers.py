@@ -0,0 +1,47 @@
+"""
+Read-replica routing.
+
+Reads go to the primary unless the current request has been marked as
+replica-safe by ReplicaRoutingMiddleware (see ``use_replicas``), in which case
+they are spread over settings.DATABASE_REPLICAS. Writes and migrations always
+target the primary.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_replica_reads = ContextVar('bookMng_replica_reads', default=False)
+
+
+@contextmanager
+def use_replicas():
+    """Send the reads made inside this block to a replica, if any are configured."""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # A lagging replica would serve stale cache versions
+        if model._meta.app_label == 'django_cache':
+            return 'default'
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return db == 'default'
@@ -0,0 +1,150 @@
+"""
+Full-text search over book titles and comment text.
+
+On SQLite the index is an FTS5 virtual table with one row per book (rowid =
+book id) holding the title and the concatenated comment text. Other backends,
+or SQLite builds without FTS5, fall back to a case-insensitive title match.
+
+Reindexing a book reads all of its comments, so comment changes are not
+indexed one by one: the first change queues a reindex COMMENT_DELAY seconds
+later, and the queue drops the same reindex while it is still waiting (see
+tasks.enqueue), so the changes made until it runs ride along with it. A busy
+thread costs one reindex per COMMENT_DELAY instead of one per comment.
+"""
+import re
+
+from django.db import connection, transaction
+from django.db.models import F
+
+FTS_TABLE = 'bookMng_book_fts'
+# bm25() column weights, stored as the table's default rank function by
+# migration 0013: a title hit counts ten times more than a comment hit
+NAME_WEIGHT = 10.0
+COMMENT_WEIGHT = 1.0
+COMMENT_DELAY = 30
+
+_available = None
+
+
+def is_available():
+    global _available
+    if _available is None:
+        _available = (connection.vendor == 'sqlite'
+                      and FTS_TABLE in connection.introspection.table_names())
+    return _available
+
+
+def reset_availability():
+    global _available
+    _available = None
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match, and
+    every word matches as a prefix. Returns '' when there is nothing to search.
+    """
+    tokens = re.findall(r'\w+', text or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def filter_books(queryset, text):
+    """
+    Restrict ``queryset`` to books matching ``text`` and annotate each with
+    ``search_rank`` (lower is better, as bm25() returns negative scores).
+    """
+    match = build_match_query(text)
+    if not match:
+        return queryset
+    if not is_available():
+        return queryset.filter(name__icontains=text)
+
+    return (queryset.filter(search_index__document__match=match)
+            .annotate(search_rank=F('search_index__rank')))
+
+
+def filter_catalog(queryset, params):
+    """
+    Apply the search page filters in ``params`` (``q``, ``min_rating``,
+    ``price_min``, ``price_max``); values that don't parse are ignored.
+    """
+    queryset = filter_books(queryset, params.get('q'))
+
+    # Filter by rating only if min_rating is set and not 'none'
+    min_rating = params.get('min_rating')
+    if min_rating and min_rating != 'none':
+        try:
+            queryset = queryset.filter(rating_count__gt=0, rating_avg__gte=float(min_rating))
+        except ValueError:
+            pass
+
+    for param, lookup in (('price_min', 'price__gte'), ('price_max', 'price__lte')):
+        if params.get(param):
+            try:
+                queryset = queryset.filter(**{lookup: float(params[param])})
+            except ValueError:
+                pass
+    return queryset
+
+
+def _comment_text(book_ids):
+    from .models import Comment
+
+    text = {}
+    rows = Comment.objects.filter(book_id__in=book_ids).order_by('id').values_list('book_id', 'content')
+    for book_id, content in rows.iterator(chunk_size=2000):
+        text.setdefault(book_id, []).append(content)
+    return {book_id: '\n'.join(parts) for book_id, parts in text.items()}
+
+
+def _write_rows(cursor, rows):
+    cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+    cursor.executemany(f'INSERT INTO {FTS_TABLE} (rowid, name, comments) VALUES (%s, %s, %s)', rows)
+
+
+def index_book(book_id):
+    """(Re)index a single book from the current database state."""
+    if not is_available():
+        return
+    from .models import Book
+
+    name = Book.objects.filter(pk=book_id).values_list('name', flat=True).first()
+    with connection.cursor() as cursor:
+        if name is None:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [book_id])
+        else:
+            _write_rows(cursor, [(book_id, name, _comment_text([book_id]).get(book_id, ''))])
+
+
+def remove_book(book_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [book_id])
+
+
+def rebuild_index(batch_size=1000):
+    """Rebuild the whole index in batches. Returns the number of books indexed."""
+    if not is_available():
+        return 0
+    from .models import Book
+
+    indexed = 0
+    last_pk = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            while True:
+                batch = list(Book.objects.filter(pk__gt=last_pk).order_by('pk')
+                             .values_list('pk', 'name')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                comments = _comment_text([pk for pk, _ in batch])
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, name, comments) VALUES (%s, %s, %s)',
+                    [(pk, name, comments.get(pk, '')) for pk, name in batch],
+                )
+                indexed += len(batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return indexed
@@ -0,0 +1,223 @@
+"""
+Static files and uploads served straight from disk.
+
+    GET static/<path>   STATIC_ROOT (what collectstatic wrote), else the finders
+                        (which include the uploaded pictures, see finders.py)
+    GET media/<path>    MEDIA_ROOT
+
+Bodies are never read into memory: a FileResponse streams the file in
+blocks, or with SENDFILE_BACKEND set the view only answers the headers and
+hands the file to the front-end server (X-Sendfile or X-Accel-Redirect).
+Under ASGI the blocks come from an async iterator, since Django drains a
+sync one into a list before sending the first byte.
+
+Every response carries a strong ETag (mtime and size) and Last-Modified,
+so revalidation is a bodiless 304. A single ``Range: bytes=...`` gets a 206
+with just that slice, which is what video players seeking in
+BookExchange.mp4 send. Names from the staticfiles manifest and
+content-addressed pictures carry a content hash and are cached for a year as
+immutable; anything else may change in place and is cached for
+REVALIDATE_AFTER. When the client accepts it, the precompressed
+``.br``/``.gz`` variant collectstatic wrote is sent instead.
+"""
+import mimetypes
+import os
+import re
+from functools import lru_cache
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .storage import COMPRESSIBLE, is_blob
+
+IMMUTABLE_SECONDS = 365 * 24 * 60 * 60
+REVALIDATE_AFTER = 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+ASYNC_BLOCK_SIZE = 64 * 1024  # each block costs a thread hop
+
+
+class Unsatisfiable(ValueError):
+    pass
+
+
+class _Slice:
+    """Read at most ``length`` bytes of an open file, from where it is."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+async def _read_blocks(file):
+    """Yield ``file`` in blocks without blocking the event loop, then close it."""
+    read = sync_to_async(file.read, thread_sensitive=False)
+    try:
+        while block := await read(ASYNC_BLOCK_SIZE):
+            yield block
+    finally:
+        await sync_to_async(file.close, thread_sensitive=False)()
+
+
+def _stream(request, file, length, **kwargs):
+    if isinstance(request, ASGIRequest):
+        response = FileResponse(_read_blocks(file), **kwargs)
+        response.headers['Content-Length'] = length
+        return response
+    return FileResponse(file, **kwargs)
+
+
+def _find(root, path):
+    if not root:
+        return None
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        return None
+    return full_path if os.path.isfile(full_path) else None
+
+
+@lru_cache(maxsize=1)
+def _hashed_names(manifest_hash):
+    return frozenset(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+
+def is_hashed(path):
+    """True if ``path`` is a content-hashed name from the staticfiles manifest."""
+    return path in _hashed_names(getattr(staticfiles_storage, 'manifest_hash', ''))
+
+
+def _accepts(request, coding):
+    return re.search(rf'\b{coding}\b', request.headers.get('Accept-Encoding', '')) is not None
+
+
+def byte_range(header, size):
+    """
+    ``(start, end)``, inclusive, for a single satisfiable byte range, or None
+    to send the whole file (no header, several ranges or one we can't parse).
+    Raises Unsatisfiable if the range lies past the end of the file.
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # bytes=-N: the last N bytes
+        if int(last) == 0 or size == 0:
+            raise Unsatisfiable(header)
+        return max(size - int(last), 0), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise Unsatisfiable(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def _sendfile(full_path, accel_path, content_type):
+    backend = getattr(settings, 'SENDFILE_BACKEND', '')
+    if backend == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Sendfile'] = full_path
+        return response
+    if backend == 'x-accel-redirect' and accel_path:
+        response = HttpResponse(content_type=content_type)
+        response.headers['X-Accel-Redirect'] = quote(settings.SENDFILE_ACCEL_PREFIX + accel_path)
+        return response
+    return None
+
+
+def serve(request, full_path, *, immutable=False, accel_path=None):
+    """Stream ``full_path`` honouring conditional, Range and Accept-Encoding headers."""
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    encoding = None
+    sendfile = getattr(settings, 'SENDFILE_BACKEND', '')
+    compressible = full_path.endswith(COMPRESSIBLE)
+    # A front-end server picks variants itself (gzip_static and friends)
+    if compressible and not sendfile:
+        for coding, suffix in VARIANTS:
+            if _accepts(request, coding) and os.path.isfile(full_path + suffix):
+                full_path, encoding = full_path + suffix, coding
+                break
+
+    stat = os.stat(full_path)
+    size = stat.st_size
+    etag = f'"{stat.st_mtime_ns:x}-{size:x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _sendfile(full_path, accel_path, content_type)
+    if response is None:
+        if_range = request.headers.get('If-Range')
+        ranged = not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified
+        try:
+            span = byte_range(request.headers.get('Range'), size) if ranged else None
+        except Unsatisfiable:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        f = open(full_path, 'rb')
+        if span is None:
+            response = _stream(request, f, size, content_type=content_type)
+        else:
+            start, end = span
+            f.seek(start)
+            response = _stream(request, _Slice(f, end - start + 1), end - start + 1,
+                               status=206, content_type=content_type)
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response.headers['Content-Length'] = end - start + 1
+        response.headers['Accept-Ranges'] = 'bytes'
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    if compressible:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    if immutable:
+        patch_cache_control(response, public=True, max_age=IMMUTABLE_SECONDS, immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=REVALIDATE_AFTER)
+    return response
+
+
+@require_safe
+def static_file(request, path):
+    full_path = _find(settings.STATIC_ROOT, path)
+    accel_path = f'static/{path}'
+    if full_path is None:
+        # Not collected (yet), e.g. a cover uploaded since the last collectstatic
+        full_path = finders.find(path) if not os.path.isabs(path) else None
+        accel_path = None
+    if full_path is None:
+        raise Http404('No such file.')
+    return serve(request, full_path, immutable=is_hashed(path) or is_blob(path), accel_path=accel_path)
+
+
+@require_safe
+def media_file(request, path):
+    full_path = _find(settings.MEDIA_ROOT, path)
+    if full_path is None:
+        raise Http404('No such file.')
+    return serve(request, full_path, immutable=is_blob(path), accel_path=f'media/{path}')
@@ -0,0 +1,165 @@
+from django.contrib.auth.models import Group, User
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import blobs, cart, fragments, ratings, recommendations, roles, search, tasks
+from .menu import invalidate_main_menu
+from .models import Book, Comment, MainMenu, OwnedBook, Rate, ShoppingCart, UserProfile
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, **kwargs):
+    tasks.index_book.delay(instance.pk)
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.remove_book(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reindex_commented_book(sender, instance, **kwargs):
+    # Delayed, so a burst of comments shares one reindex
+    tasks.index_commented_book.delay_in(search.COMMENT_DELAY, instance.book_id)
+
+
+@receiver(post_save, sender=MainMenu)
+@receiver(post_delete, sender=MainMenu)
+def clear_main_menu_cache(sender, **kwargs):
+    invalidate_main_menu()
+    fragments.bump_site()
+
+
+@receiver(post_save, sender=Book)
+def reprice_carts(sender, instance, created, **kwargs):
+    # Cart totals use the current price
+    if not created:
+        cart.invalidate(ShoppingCart.objects.filter(book=instance, checked_out=False)
+                        .values_list('user_id', flat=True))
+
+
+@receiver(post_delete, sender=Book)
+def bump_deleted_book(sender, instance, **kwargs):
+    # The rows after it shift onto other pages
+    fragments.bump_site()
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def bump_reviewed_book(sender, instance, **kwargs):
+    fragments.bump_books([instance.book_id])
+
+
+@receiver(post_delete, sender=Rate)
+def unrate_deleted_rating(sender, instance, origin=None, **kwargs):
+    # A deleted book takes its aggregates with it
+    if origin is not None and getattr(origin, 'model', type(origin)) is Book:
+        return
+    ratings.rating_deleted(instance)
+
+
+@receiver(m2m_changed, sender=Book.favorites.through)
+def bump_favorited_books(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        fragments.bump_books([instance.pk])
+    elif action == 'pre_clear':
+        fragments.bump_books(instance.favorite_books.values_list('pk', flat=True))
+    else:
+        fragments.bump_books(pk_set)
+
+
+@receiver(post_save, sender=User)
+def bump_posters_books(sender, instance, created, update_fields, **kwargs):
+    # Rows show the poster's username; logins only touch last_login
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    fragments.bump_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def clear_member_roles(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        roles.invalidate([instance.pk])
+    elif action == 'pre_clear':
+        roles.invalidate(instance.user_set.values_list('pk', flat=True))
+    else:
+        roles.invalidate(pk_set)
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def clear_group_roles(sender, instance, **kwargs):
+    roles.invalidate(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=UserProfile)
+def sync_profile_groups(sender, instance, **kwargs):
+    roles.sync_groups(instance.user, instance.role)
+    roles.invalidate([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+def clear_user_roles(sender, instance, created, update_fields, **kwargs):
+    # is_superuser counts as a role; logins only touch last_login
+    if not created and not (update_fields and set(update_fields) <= {'last_login'}):
+        roles.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Rate)
+@receiver(post_delete, sender=Rate)
+def note_rating(sender, instance, origin=None, **kwargs):
+    # Cascades from deleting the book or user take the lists down with them
+    if origin is not None and getattr(origin, 'model', type(origin)) is not Rate:
+        return
+    recommendations.note_interactions([(instance.user_id, instance.book_id)])
+
+
+@receiver(post_save, sender=OwnedBook)
+def note_purchase(sender, instance, created, **kwargs):
+    # Later purchases of the same book only change the quantity
+    if created:
+        recommendations.note_interactions([(instance.user_id, instance.book_id)])
+
+
+@receiver(m2m_changed, sender=Book.favorites.through)
+def note_favorites(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if action == 'pre_clear':
+        related = instance.favorite_books if reverse else instance.favorites
+        pk_set = related.values_list('pk', flat=True)
+    if reverse:
+        recommendations.note_interactions((instance.pk, book_id) for book_id in pk_set)
+    else:
+        recommendations.note_interactions((user_id, instance.pk) for user_id in pk_set)
+
+
+@receiver(pre_save, sender=Book)
+def remember_stored_picture(sender, instance, update_fields=None, **kwargs):
+    # None: the picture isn't being saved
+    if instance._state.adding:
+        instance._stored_picture = ''
+    elif update_fields is not None and 'picture' not in update_fields:
+        instance._stored_picture = None
+    else:
+        instance._stored_picture = Book.objects.filter(pk=instance.pk).values_list('picture', flat=True).first()
+
+
+@receiver(post_save, sender=Book)
+def count_picture_references(sender, instance, **kwargs):
+    stored = getattr(instance, '_stored_picture', None)
+    if stored is not None and stored != instance.picture.name:
+        blobs.add_references([instance.picture.name])
+        blobs.drop_references([stored])
+
+
+@receiver(post_delete, sender=Book)
+def drop_picture_reference(sender, instance, **kwargs):
+    blobs.drop_references([instance.picture.name])
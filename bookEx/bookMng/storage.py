@@ -0,0 +1,165 @@
+"""
+Storage backends.
+
+ContentAddressedStorage keeps Book.picture uploads once per content. An
+upload is hashed (SHA-256) while it streams to a temporary file, then
+renamed to ``<upload_to>/<h[:2]>/<h[2:4]>/<h><ext>``. If that blob already
+exists the copy is dropped, so re-uploading a cover costs nothing on disk.
+bookMng.blobs counts the books using each blob and deletes the orphans.
+
+HashedStaticStorage is the staticfiles storage: collectstatic writes each
+file under a content-hashed name (``site.3f2a9c1b7d4e.css``) plus a
+manifest, and ``{% static %}`` links the hashed name. Since a hashed URL's
+content never changes, bookMng.serving sends it with an immutable
+Cache-Control. Text assets also get ``.gz`` (and, with the brotli package,
+``.br``) variants written next to them, so they are never compressed per
+request.
+"""
+import gzip
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+from urllib.parse import unquote, urlsplit
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import brotli
+except ImportError:  # optional; only .gz variants are written without it
+    brotli = None
+
+COMPRESSIBLE = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.html', '.xml', '.ico', '.ttf', '.otf')
+MIN_COMPRESS_SIZE = 200  # as GZipMiddleware: smaller files don't shrink
+BLOB_RE = re.compile(r'(?:^|/)[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[a-z0-9]{1,10})?$')
+
+
+def _compressors():
+    yield '.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+def is_blob(name):
+    """True if ``name`` is a blob path written by ContentAddressedStorage."""
+    return BLOB_RE.search(name) is not None
+
+
+def blob_name(name, digest):
+    """The blob path for content with SHA-256 ``digest`` uploaded as ``name``."""
+    directory, filename = posixpath.split(name)
+    ext = os.path.splitext(filename)[1].lower()
+    if not re.fullmatch(r'\.[a-z0-9]{1,10}', ext):
+        ext = ''
+    return posixpath.join(directory, digest[:2], digest[2:4], digest + ext)
+
+
+def file_digest(path):
+    """SHA-256 hex digest of the file at ``path``, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The final name comes from the content, so there is nothing to make unique
+        return name
+
+    def _save(self, name, content):
+        directory = posixpath.dirname(name)
+        os.makedirs(self.path(directory or '.'), exist_ok=True)
+        # Same directory as the blob, so the final rename is atomic
+        tmp_path = os.path.join(self.path(directory or '.'), f'.{uuid.uuid4().hex}.part')
+        digest = hashlib.sha256()
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+            name = blob_name(name, digest.hexdigest())
+            full_path = self.path(name)
+            if os.path.exists(full_path):
+                # Already stored; touching it keeps collect() off it until a book refers to it
+                os.utime(full_path)
+            else:
+                os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                os.replace(tmp_path, full_path)
+                tmp_path = None
+                if self.file_permissions_mode is not None:
+                    os.chmod(full_path, self.file_permissions_mode)
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+    def save_as(self, name, content):
+        """Write ``content`` at exactly ``name``, replacing it; for files derived from a blob."""
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        tmp_path = f'{full_path}.{uuid.uuid4().hex}.part'
+        try:
+            with open(tmp_path, 'wb') as out:
+                for chunk in content.chunks():
+                    out.write(chunk)
+            os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def blobs(self, directory):
+        """Yield the name of every blob stored under ``directory``."""
+        root = self.path(directory)
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                name = posixpath.join(directory, os.path.relpath(os.path.join(dirpath, filename), root)
+                                      .replace(os.sep, '/'))
+                if is_blob(name):
+                    yield name
+
+
+class HashedStaticStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # Covers uploaded since the last collectstatic aren't in the manifest;
+        # link them unhashed instead of failing or hashing the file per render
+        clean_name = urlsplit(unquote(name)).path.strip()
+        if self.hashed_files.get(self.hash_key(clean_name)) is None:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, *args, **kwargs):
+        yield from super().post_process(*args, **kwargs)
+        if not kwargs.get('dry_run'):
+            for name in set(self.hashed_files.values()):
+                self.precompress(name)
+
+    def precompress(self, name):
+        """Write the compressed variants of ``name``; returns the suffixes written."""
+        if not name.endswith(COMPRESSIBLE):
+            return []
+        path = self.path(name)
+        written = []
+        data = None
+        for suffix, compress in _compressors():
+            # Hashed names never change content, so an existing variant is current
+            if os.path.exists(path + suffix):
+                continue
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+                if len(data) < MIN_COMPRESS_SIZE:
+                    return []
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append(suffix)
+        return written
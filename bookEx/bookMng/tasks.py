@@ -0,0 +1,246 @@
+"""
+Background tasks.
+
+Work that does not have to finish before the response (cover resizing,
+search indexing, rating rebuilds) is declared with ``@task`` and queued with
+``some_task.delay(*args)``, or ``some_task.delay_in(seconds, *args)`` to run
+it no sooner than ``seconds`` from now. Arguments must be JSON-serializable;
+pass ids, not model instances.
+
+settings.TASK_BACKEND picks where queued tasks go:
+
+``database`` (default)
+    A row in bookMng.Task, committed with the caller's transaction and run
+    by ``manage.py run_tasks``. Needs nothing but the app database.
+``redis``
+    A list in Redis at settings.TASK_REDIS_URL (needs the ``redis`` package).
+``immediate``
+    Run inline, as if there were no queue. Meant for tests.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+try:
+    import redis
+except ImportError:  # optional; only the redis backend needs it
+    redis = None
+
+from . import blobs, images, leaderboards, search
+from .models import Book, Task
+from .ratings import rebuild_rating_aggregates
+
+logger = logging.getLogger(__name__)
+
+REDIS_QUEUE = 'bookMng:tasks'
+REDIS_DELAYED = 'bookMng:tasks:delayed'
+REDIS_FAILED = 'bookMng:tasks:failed'
+RETRY_BASE_SECONDS = 10
+
+registry = {}
+
+
+def task(func=None, *, max_attempts=3):
+    """Register ``func`` as a task and give it a ``delay()`` method."""
+    def register(func):
+        name = f'{func.__module__}.{func.__name__}'
+        func.task_name = name
+        func.max_attempts = max_attempts
+        func.delay = lambda *args: enqueue(name, args, max_attempts=max_attempts)
+        func.delay_in = lambda seconds, *args: enqueue(name, args, max_attempts=max_attempts, countdown=seconds)
+        registry[name] = func
+        return func
+    return register(func) if func else register
+
+
+def _backend():
+    return getattr(settings, 'TASK_BACKEND', 'database')
+
+
+def retry_delay(attempts):
+    """Seconds to wait before attempt ``attempts + 1``: 10s, 20s, 40s, ..."""
+    return RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+
+def enqueue(name, args=(), max_attempts=3, countdown=0):
+    args = list(args)
+    backend = _backend()
+    if backend == 'immediate':
+        registry[name](*args)
+        return None
+    if backend == 'redis':
+        payload = json.dumps({'name': name, 'args': args, 'attempts': 0, 'max_attempts': max_attempts})
+        # Only publish once the data the task reads has been committed
+        if countdown:
+            # nx: the same job already waiting keeps its time, so repeats fold into it
+            transaction.on_commit(lambda: _redis().zadd(REDIS_DELAYED, {payload: time.time() + countdown}, nx=True))
+        else:
+            transaction.on_commit(lambda: _redis().lpush(REDIS_QUEUE, payload))
+        return None
+
+    # Skip exact duplicates still waiting to run, e.g. a book saved twice in a row
+    pending = Task.objects.filter(name=name, args=args, status=Task.QUEUED, attempts=0)
+    if pending.exists():
+        return None
+    return Task.objects.create(name=name, args=args, max_attempts=max_attempts,
+                               run_after=timezone.now() + timedelta(seconds=countdown))
+
+
+def _redis():
+    if redis is None:
+        raise RuntimeError('TASK_BACKEND is "redis" but the redis package is not installed.')
+    return redis.Redis.from_url(getattr(settings, 'TASK_REDIS_URL', 'redis://localhost:6379/0'))
+
+
+def _execute(name, args):
+    func = registry.get(name)
+    if func is None:
+        raise LookupError(f'Unknown task {name!r}')
+    func(*args)
+
+
+class DatabaseQueue:
+    """Claims and settles bookMng.Task rows."""
+
+    def __init__(self, lease_seconds=None):
+        self.lease = timedelta(seconds=lease_seconds or getattr(settings, 'TASK_LEASE_SECONDS', 300))
+
+    def claim(self, limit):
+        """
+        Take up to ``limit`` due tasks. A conditional UPDATE marks each one
+        running, so two workers can never claim the same row. Rows left
+        running past the lease (a worker died) are picked up again.
+        """
+        now = timezone.now()
+        due = (Q(status=Task.QUEUED, run_after__lte=now)
+               | Q(status=Task.RUNNING, locked_at__lt=now - self.lease))
+        claimed = []
+        for candidate in Task.objects.filter(due).order_by('run_after', 'id')[:limit * 2]:
+            taken = Task.objects.filter(pk=candidate.pk, status=candidate.status,
+                                        attempts=candidate.attempts).update(
+                status=Task.RUNNING, locked_at=now, attempts=F('attempts') + 1)
+            if taken:
+                candidate.attempts += 1
+                claimed.append(candidate)
+                if len(claimed) == limit:
+                    break
+        return claimed
+
+    def run(self, task_row):
+        try:
+            _execute(task_row.name, task_row.args)
+        except Exception as exc:
+            self._failed(task_row, exc)
+            return False
+        Task.objects.filter(pk=task_row.pk).update(status=Task.DONE, locked_at=None, last_error='')
+        return True
+
+    def _failed(self, task_row, exc):
+        logger.warning('Task %s failed (attempt %s/%s): %s', task_row, task_row.attempts,
+                       task_row.max_attempts, exc)
+        if task_row.attempts >= task_row.max_attempts:
+            Task.objects.filter(pk=task_row.pk).update(status=Task.FAILED, locked_at=None, last_error=repr(exc))
+        else:
+            Task.objects.filter(pk=task_row.pk).update(
+                status=Task.QUEUED, locked_at=None, last_error=repr(exc),
+                run_after=timezone.now() + timedelta(seconds=retry_delay(task_row.attempts)))
+
+    def purge(self, older_than_days=7):
+        """Delete finished tasks older than ``older_than_days``."""
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        deleted, _ = Task.objects.filter(status=Task.DONE, created_at__lt=cutoff).delete()
+        return deleted
+
+
+class RedisQueue:
+    """Same interface as DatabaseQueue over a Redis list plus a sorted set of delayed retries."""
+
+    def __init__(self):
+        self.client = _redis()
+
+    def claim(self, limit):
+        # Move retries that are due back onto the main list
+        now = time.time()
+        for payload in self.client.zrangebyscore(REDIS_DELAYED, 0, now):
+            if self.client.zrem(REDIS_DELAYED, payload):
+                self.client.lpush(REDIS_QUEUE, payload)
+        claimed = []
+        while len(claimed) < limit:
+            payload = self.client.rpop(REDIS_QUEUE)
+            if payload is None:
+                break
+            job = json.loads(payload)
+            job['attempts'] += 1
+            claimed.append(job)
+        return claimed
+
+    def run(self, job):
+        try:
+            _execute(job['name'], job['args'])
+        except Exception as exc:
+            logger.warning('Task %s%s failed (attempt %s/%s): %s', job['name'], tuple(job['args']),
+                           job['attempts'], job['max_attempts'], exc)
+            job['last_error'] = repr(exc)
+            if job['attempts'] >= job['max_attempts']:
+                self.client.lpush(REDIS_FAILED, json.dumps(job))
+            else:
+                self.client.zadd(REDIS_DELAYED, {json.dumps(job): time.time() + retry_delay(job['attempts'])})
+            return False
+        return True
+
+    def purge(self, older_than_days=7):
+        return 0
+
+
+def get_queue():
+    return RedisQueue() if _backend() == 'redis' else DatabaseQueue()
+
+
+@task
+def index_book(book_id):
+    search.index_book(book_id)
+
+
+@task
+def index_commented_book(book_id):
+    search.index_book(book_id)
+
+
+@task(max_attempts=5)
+def generate_covers(book_id):
+    book = Book.objects.filter(pk=book_id).first()
+    if book is not None:
+        images.generate_variants(book)
+
+
+@task
+def rebuild_ratings(book_ids=None):
+    rebuild_rating_aggregates(book_ids=book_ids)
+
+
+@task
+def index_books(book_ids):
+    for book_id in book_ids:
+        search.index_book(book_id)
+
+
+@task(max_attempts=5)
+def generate_covers_for_books(book_ids):
+    for book in Book.objects.filter(pk__in=book_ids).iterator():
+        images.generate_variants(book)
+
+
+@task
+def refresh_leaderboards():
+    leaderboards.refresh()
+
+
+@task
+def collect_blobs():
+    blobs.collect()
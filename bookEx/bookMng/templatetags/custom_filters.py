@@ -1,4 +1,7 @@
 from django import template
+from django.db.models import QuerySet
+
+from bookMng import cart
 
 register = template.Library()
 
@@ -12,6 +15,9 @@ def mul(value, arg):
 
 @register.filter
 def calc_total(cart_items):
+    # Let the database add up a queryset instead of looping over its rows
+    if isinstance(cart_items, QuerySet):
+        return cart.aggregate(cart_items)['total']
     total = sum(item.quantity * item.book.price for item in cart_items)
     return round(total, 2)
 
@@ -19,3 +25,16 @@ def calc_total(cart_items):
 def get_item(dictionary, key):
     return dictionary.get(key)
 
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, page, direction):
+    """Query string for the next/previous keyset page, keeping other filters."""
+    params = context['request'].GET.copy()
+    params.pop(f'{page.prefix}after', None)
+    params.pop(f'{page.prefix}before', None)
+    if direction == 'next':
+        params[f'{page.prefix}after'] = page.next_cursor
+    else:
+        params[f'{page.prefix}before'] = page.previous_cursor
+    return '?' + params.urlencode()
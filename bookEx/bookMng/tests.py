@@ -1,3 +1,1308 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import math
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+import unittest.mock
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.templatetags.static import static
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (benchmark, blobs, cart, catalog_io, checks, fragments, history, images, leaderboards, orders,
+               queryplans, recommendations, roles, search, serving, storage, tasks, views, viewstats)
+from .menu import get_main_menu, invalidate_main_menu
+from .middleware import PRIMARY_PIN_COOKIE, ReplicaRoutingMiddleware
+from .models import (Blob, Book, BookCounter, BookReturn, Comment, InteractionChange, MainMenu, Rate,
+                     RoleVersion, ShoppingCart, SimilarBook, Task, UserProfile)
+from .pagination import KeysetPaginator, encode_cursor, paginate
+from .ratings import set_rating
+from .routers import ReadReplicaRouter, use_replicas
+from .viewstats import percentile, registry
+
+
+def make_book(name, price='10.00', **kwargs):
+    return Book.objects.create(name=name, web='https://example.com', price=Decimal(price),
+                               picture='bookEx/static/uploads/images.jpg', **kwargs)
+
+
+class KeysetPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = [make_book(f'Book {i}', price=str(10 + i % 3)) for i in range(7)]
+
+    def test_walks_forward_and_back_by_id(self):
+        paginator = KeysetPaginator(Book.objects.all(), per_page=3)
+        first = paginator.page()
+        self.assertEqual([b.id for b in first], [b.id for b in self.books[:3]])
+        self.assertTrue(first.has_next)
+        self.assertFalse(first.has_previous)
+
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual([b.id for b in second], [b.id for b in self.books[3:6]])
+        self.assertTrue(second.has_previous)
+
+        back = paginator.page(before=second.previous_cursor)
+        self.assertEqual([b.id for b in back], [b.id for b in first])
+        self.assertFalse(back.has_previous)
+
+    def test_price_ordering_is_total(self):
+        paginator = KeysetPaginator(Book.objects.all(), per_page=2, ordering='price')
+        seen, page = [], paginator.page()
+        while True:
+            seen.extend(page)
+            if not page.has_next:
+                break
+            page = paginator.page(after=page.next_cursor)
+        expected = sorted(self.books, key=lambda b: (b.price, b.id))
+        self.assertEqual([b.id for b in seen], [b.id for b in expected])
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        paginator = KeysetPaginator(Book.objects.all(), per_page=3)
+        for cursor in ('not-base64!', encode_cursor(['abc']), encode_cursor([1, 2])):
+            page = paginator.page(after=cursor)
+            self.assertEqual(page.object_list[0].id, self.books[0].id)
+
+    def test_paginate_reads_prefixed_params(self):
+        request = RequestFactory().get('/', {'posted_per_page': '2'})
+        page = paginate(request, Book.objects.all(), prefix='posted_')
+        self.assertEqual(len(page), 2)
+        self.assertEqual(page.prefix, 'posted_')
+
+
+@override_settings(TASK_BACKEND='immediate')
+class DisplayBooksViewTests(TestCase):
+    def test_displaybooks_is_paginated(self):
+        for i in range(30):
+            make_book(f'Book {i}')
+        response = self.client.get(reverse('displaybooks'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['books']), 25)
+        self.assertContains(response, '?after=')
+
+    def test_listing_views_render_paginated(self):
+        user = User.objects.create_user('reader', password='pw')
+        for i in range(3):
+            book = make_book(f'Book {i}', username=user)
+            book.favorites.add(user)
+        self.client.force_login(user)
+        response = self.client.get(reverse('searchbooks'), {'q': 'Book', 'sort': 'price', 'per_page': 2})
+        self.assertEqual(len(response.context['books']), 2)
+        self.assertContains(response, 'sort=price')
+        response = self.client.get(reverse('mybooks'), {'posted_per_page': 2})
+        self.assertEqual(len(response.context['posted_books']), 2)
+        self.assertEqual(len(response.context['favorite_books']), 3)
+        response = self.client.get(reverse('favorite_list'))
+        self.assertEqual(len(response.context['favorites']), 3)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('rater', password='pw')
+        self.other = User.objects.create_user('other', password='pw')
+        self.book = make_book('Rated')
+        self.client.force_login(self.user)
+
+    def test_rate_and_delete_keep_aggregates_current(self):
+        self.client.post(reverse('rate_book', args=[self.book.id]), {'rating': 4})
+        self.client.post(reverse('rate_book', args=[self.book.id]), {'rating': 2})
+        set_rating(self.other, self.book, 5)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum), (2, 7))
+        self.assertEqual(self.book.average_rating, 3.5)
+
+        rate = Rate.objects.get(user=self.user, book=self.book)
+        self.client.post(reverse('delete_rating', args=[rate.id]))
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_avg), (1, 5.0))
+
+    def test_concurrent_first_rating_becomes_a_change(self):
+        # Another request inserts its row after our lookup found none
+        set_rating(self.user, self.book, 3)
+        real_select_for_update = Rate.objects.select_for_update
+        lookups = [Rate.objects.none]
+        with unittest.mock.patch.object(Rate.objects, 'select_for_update',
+                                        side_effect=lambda: (lookups.pop() if lookups else real_select_for_update)()):
+            rate, created = set_rating(self.user, self.book, 5)
+        self.assertFalse(created)
+        self.assertEqual(rate.rating, 5)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum), (1, 5))
+
+    def test_deleting_a_rater_updates_the_aggregates(self):
+        set_rating(self.user, self.book, 4)
+        set_rating(self.other, self.book, 1)
+        self.other.delete()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum, self.book.rating_avg), (1, 4, 4.0))
+        Rate.objects.all().delete()
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum, self.book.rating_avg), (0, 0, 0.0))
+
+    def test_rebuild_command_repairs_drift(self):
+        set_rating(self.user, self.book, 3)
+        Book.objects.filter(pk=self.book.pk).update(rating_count=9, rating_sum=1, rating_avg=0.1)
+        call_command('rebuild_ratings', stdout=StringIO())
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.rating_count, self.book.rating_sum, self.book.rating_avg), (1, 3, 3.0))
+
+    def test_min_rating_filter_uses_stored_average(self):
+        set_rating(self.user, self.book, 2)
+        make_book('Unrated')
+        response = self.client.get(reverse('searchbooks'), {'min_rating': '1'})
+        self.assertEqual([b.name for b in response.context['books']], ['Rated'])
+
+
+@override_settings(TASK_BACKEND='immediate')
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        self.potter = make_book('Harry Potter and the Goblet of Fire')
+        self.wizard = make_book('Wizards of the Coast')
+        Comment.objects.create(book=self.wizard, user=self.user, content='Better than Harry Potter')
+        make_book('Cooking Basics', price='50.00')
+
+    def search(self, **params):
+        response = self.client.get(reverse('searchbooks'), params)
+        return [b.name for b in response.context['books']]
+
+    def test_ranks_title_hits_above_comment_hits_and_matches_prefixes(self):
+        self.assertEqual(self.search(q='harr pott'), [self.potter.name, self.wizard.name])
+
+    def test_relevance_order_pages_by_cursor(self):
+        first = self.client.get(reverse('searchbooks'), {'q': 'potter', 'per_page': 1}).context['books']
+        self.assertEqual(first.paginator.ordering, 'relevance')
+        second = self.client.get(reverse('searchbooks'),
+                                 {'q': 'potter', 'per_page': 1, 'after': first.next_cursor}).context['books']
+        self.assertEqual([b.name for b in first] + [b.name for b in second],
+                         [self.potter.name, self.wizard.name])
+        self.assertFalse(second.has_next)
+
+    def test_index_follows_saves_and_deletes(self):
+        self.potter.name = 'Renamed'
+        self.potter.save()
+        Comment.objects.filter(book=self.wizard).delete()
+        self.assertEqual(self.search(q='potter'), [])
+        self.assertEqual(self.search(q='renamed'), ['Renamed'])
+
+    def test_keeps_price_filters(self):
+        self.assertEqual(self.search(q='cooking', price_max='20'), [])
+        self.assertEqual(self.search(q='cooking', price_min='20'), ['Cooking Basics'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search(q='goblet'), [self.potter.name])
+
+
+@unittest.skipIf(images.Image is None, 'Pillow is not installed')
+class CoverVariantTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_user('publisher', password='pw')
+        UserProfile.objects.create(user=self.user, role='Publisher')
+        self.client.force_login(self.user)
+
+    def upload(self, name='cover.jpg', size=(600, 900)):
+        buffer = BytesIO()
+        images.Image.new('RGB', size, 'navy').save(buffer, 'JPEG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_postbook_renders_variants_once(self):
+        self.client.post(reverse('postbook'), {'name': 'Covered', 'web': 'https://example.com',
+                                               'price': '9.99', 'quantity': '5', 'picture': self.upload()})
+        book = Book.objects.get(name='Covered')
+        blob = book.pic_path.removesuffix('.jpg')
+        self.assertRegex(book.pic_path, r'^uploads/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.jpg$')
+        # Resizing is left to the task worker; until it runs the original is shown
+        self.assertEqual(book.thumbnail, book.pic_path)
+        call_command('run_tasks', '--burst', '--concurrency', '1', stdout=StringIO())
+        book.refresh_from_db()
+        directory, stem = blob.rsplit('/', 1)
+        self.assertEqual(book.thumbnail, f'{directory}/thumbs/{stem}_90x135.jpg')
+        self.assertTrue(book.cover.startswith(f'{directory}/thumbs/{stem}_300w.'))
+        thumb = book.picture.storage.path(f'bookEx/static/{book.thumbnail}')
+        with images.Image.open(thumb) as image:
+            self.assertEqual(image.size, images.THUMB_SIZE)
+
+    def test_pages_cached_before_the_variants_pick_them_up(self):
+        cache.clear()
+        self.client.post(reverse('postbook'), {'name': 'Covered', 'web': 'https://example.com',
+                                               'price': '9.99', 'quantity': '5', 'picture': self.upload()})
+        url = reverse('searchbooks')
+        first = self.client.get(url)
+        book = Book.objects.get(name='Covered')
+        self.assertContains(first, static(book.pic_path))
+        # The worker is another process with a cache of its own
+        with unittest.mock.patch('bookMng.fragments.cache', LocMemCache('worker', {})):
+            call_command('run_tasks', '--burst', '--concurrency', '1', stdout=StringIO())
+        book.refresh_from_db()
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertContains(changed, static(book.thumbnail))
+
+    def test_new_upload_resets_stale_variants(self):
+        book = make_book('Old', username=self.user)
+        Book.objects.filter(pk=book.pk).update(thumb_path='uploads/thumbs/old.jpg')
+        book.refresh_from_db()
+        book.picture = 'bookEx/static/uploads/other.jpg'
+        book.save()
+        self.assertEqual((book.pic_path, book.thumbnail), ('uploads/other.jpg', 'uploads/other.jpg'))
+
+
+class MainMenuCacheTests(TestCase):
+    def setUp(self):
+        invalidate_main_menu()
+        self.addCleanup(invalidate_main_menu)
+        MainMenu.objects.create(item='Home', link='/')
+
+    def test_menu_is_read_once_and_invalidated_on_save(self):
+        with self.assertNumQueries(1):
+            self.assertEqual([m.item for m in get_main_menu()], ['Home'])
+        with self.assertNumQueries(0):
+            get_main_menu()
+            response = self.client.get(reverse('aboutus'))
+            list(response.context['item_list'])
+        MainMenu.objects.create(item='About', link='/aboutus')
+        self.assertEqual([m.item for m in get_main_menu()], ['Home', 'About'])
+
+
+class BookDetailQueryBudgetTests(TestCase):
+    # session + user (auth middleware), book, rating summary, favorite check, comment page, also liked
+    QUERY_BUDGET = 7
+
+    def setUp(self):
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        self.book = make_book('Popular')
+        self.client.force_login(self.viewer)
+        # The nav bar's cart summary is cached after the first page
+        cache.clear()
+        cart.summary(self.viewer)
+
+    def add_activity(self, n):
+        users = User.objects.bulk_create(
+            User(username=f'fan{self.book.favorites.count()}_{i}') for i in range(n))
+        self.book.favorites.add(*users)
+        Comment.objects.bulk_create(Comment(book=self.book, user=u, content='Great read') for u in users)
+        for i, user in enumerate(users):
+            set_rating(user, self.book, i % 5 + 1)
+
+    def test_query_count_does_not_grow_with_comments_favorites_or_ratings(self):
+        self.add_activity(3)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('book_detail', args=[self.book.id]))
+
+        self.add_activity(60)
+        set_rating(self.viewer, self.book, 4)
+        self.book.favorites.add(self.viewer)
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            response = self.client.get(reverse('book_detail', args=[self.book.id]))
+
+        self.assertTrue(response.context['is_favorite'])
+        self.assertEqual(response.context['my_rating'], 4)
+        self.assertEqual(sum(c for _, c in response.context['rating_breakdown']), 64)
+        self.assertEqual(len(response.context['comments']), views.COMMENTS_PER_PAGE)
+        self.assertTrue(response.context['comments'].has_next)
+        next_page = self.client.get(reverse('book_detail', args=[self.book.id]),
+                                    {'comments_after': response.context['comments'].next_cursor})
+        self.assertEqual(len(next_page.context['comments']), views.COMMENTS_PER_PAGE)
+        self.assertTrue(next_page.context['comments'].has_previous)
+
+
+@override_settings(VIEW_STATS_ENABLED=True)
+class ViewStatsTests(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def test_records_queries_per_url_name(self):
+        make_book('Tracked')
+        for _ in range(3):
+            self.client.get(reverse('displaybooks'))
+        report = registry.report()['displaybooks']
+        self.assertEqual(report['requests'], 3)
+        self.assertGreaterEqual(report['queries']['p50'], 1)
+        self.assertIn('bookMng_book', report['slowest_query']['sql'])
+
+    def test_endpoint_is_staff_only(self):
+        user = User.objects.create_user('staff', password='pw')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('view_stats')).status_code, 302)
+        User.objects.filter(pk=user.pk).update(is_staff=True)
+        response = self.client.get(reverse('view_stats'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('view_stats', response.json())
+
+    def test_command_dumps_published_stats(self):
+        self.client.get(reverse('aboutus'))
+        registry.publish()
+        out, err = StringIO(), StringIO()
+        call_command('viewstats', stdout=out, stderr=err)
+        self.assertEqual(json.loads(out.getvalue())['aboutus']['requests'], 1)
+        self.assertIn('BOOKEX_CACHE_URL', err.getvalue())
+
+    def test_workers_publish_summaries_the_command_merges(self):
+        cache.clear()
+        for pid, walls in ((101, [10.0]), (102, [30.0, 30.0, 30.0])):
+            worker = viewstats.ViewStatsRegistry()
+            with unittest.mock.patch('bookMng.viewstats.os.getpid', return_value=pid):
+                for wall in walls:
+                    worker.record('aboutus', wall, 2, 1.0, wall, f'SELECT {wall}')
+                worker.publish()
+        published = cache.get(viewstats._worker_key(f'{socket.gethostname()}-101'))
+        self.assertEqual(published['aboutus']['requests'], 1)
+
+        report = viewstats.collect_published()['aboutus']
+        self.assertEqual(report['requests'], 4)
+        self.assertEqual(report['wall_ms']['p50'], 25.0)
+        self.assertEqual(report['slowest_query'], {'ms': 30.0, 'sql': 'SELECT 30.0'})
+
+    def test_percentiles_use_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (50, 95, 99)], [50, 95, 99])
+
+
+class BenchmarkHarnessTests(TestCase):
+    def test_seed_and_run_every_scenario(self):
+        bench_user = benchmark.seed(40)
+        self.assertEqual(Book.objects.count(), 40)
+        results = benchmark.run_scenarios(bench_user, iterations=1, warmup=0)
+        self.assertEqual(set(results), {name for name, *_ in benchmark.scenarios(bench_user)})
+        self.assertTrue(all(r['queries'] > 0 for r in results.values()))
+
+    def test_compare_flags_slowdowns_and_extra_queries(self):
+        base = {'1000': {'displaybooks': {'p50_ms': 10, 'p95_ms': 20, 'peak_kb': 100, 'queries': 3}}}
+        same = {'1000': {'displaybooks': {'p50_ms': 11, 'p95_ms': 21, 'peak_kb': 100, 'queries': 3}}}
+        worse = {'1000': {'displaybooks': {'p50_ms': 15, 'p95_ms': 20, 'peak_kb': 100, 'queries': 4}}}
+        self.assertEqual(benchmark.compare(same, base), [])
+        self.assertEqual(len(benchmark.compare(worse, base)), 2)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('buyer', password='pw')
+        self.book = make_book('Scarce', quantity=2)
+        self.other = make_book('Plenty', quantity=10)
+        self.client.force_login(self.user)
+
+    def test_add_to_cart_increments_one_line(self):
+        for _ in range(3):
+            self.client.get(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(list(ShoppingCart.objects.values_list('quantity', flat=True)), [3])
+
+    def test_checkout_takes_stock_and_marks_cart_purchased(self):
+        orders.add_to_cart(self.user, self.book)
+        orders.add_to_cart(self.user, self.other)
+        response = self.client.post(reverse('checkout'))
+        self.assertRedirects(response, reverse('mybooks'))
+        self.book.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual((self.book.quantity, self.other.quantity), (1, 9))
+        self.assertFalse(ShoppingCart.objects.filter(checked_out=False).exists())
+
+    def test_oversell_rolls_back_the_whole_cart(self):
+        orders.add_to_cart(self.user, self.other)
+        ShoppingCart.objects.create(user=self.user, book=self.book, quantity=3)
+        response = self.client.post(reverse('checkout'), follow=True)
+        self.assertContains(response, 'Only 2 copy/copies of Scarce left')
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.quantity, 10)
+        self.assertEqual(ShoppingCart.objects.filter(checked_out=False).count(), 2)
+
+    def test_last_copy_goes_to_one_buyer(self):
+        rival = User.objects.create_user('rival', password='pw')
+        Book.objects.filter(pk=self.book.pk).update(quantity=1)
+        orders.add_to_cart(self.user, self.book)
+        orders.add_to_cart(rival, self.book)
+        orders.checkout(self.user)
+        with self.assertRaises(orders.OutOfStock):
+            orders.checkout(rival)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.quantity, 0)
+
+    def test_checkout_records_order_at_paid_price_and_credits_ledger(self):
+        orders.add_to_cart(self.user, self.book)
+        orders.add_to_cart(self.user, self.book)
+        order = orders.checkout(self.user)
+        Book.objects.filter(pk=self.book.pk).update(price=Decimal('99.00'))
+        line = order.lines.get()
+        self.assertEqual((line.quantity, line.unit_price, order.total), (2, Decimal('10.00'), Decimal('20.00')))
+        self.assertFalse(ShoppingCart.objects.exists())
+
+        response = self.client.get(reverse('mybooks'))
+        self.assertEqual([(b.name, b.owned_quantity) for b in response.context['purchased_books']],
+                         [('Scarce', 2)])
+
+    def test_return_draws_down_ledger_and_restocks(self):
+        orders.add_to_cart(self.user, self.book)
+        orders.checkout(self.user)
+        self.client.post(reverse('return_book', args=[self.book.id]), {'quantity': 2})
+        self.assertEqual(orders.owned_quantity(self.user, self.book), 1)
+        self.client.post(reverse('return_book', args=[self.book.id]), {'quantity': 1})
+        self.book.refresh_from_db()
+        self.assertEqual((orders.owned_quantity(self.user, self.book), self.book.quantity), (0, 2))
+        self.assertEqual(BookReturn.objects.filter(user=self.user).count(), 1)
+        response = self.client.get(reverse('mybooks'))
+        self.assertEqual(len(response.context['purchased_books']), 0)
+
+
+
+class CartServiceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('shopper', password='pw')
+        self.book = make_book('Cheap', price='2.50', quantity=10)
+        self.other = make_book('Dear', price='12.25', quantity=10)
+        self.client.force_login(self.user)
+
+    def test_line_and_cart_totals_come_from_the_database(self):
+        orders.add_to_cart(self.user, self.book)
+        orders.add_to_cart(self.user, self.book)
+        orders.add_to_cart(self.user, self.other)
+        with self.assertNumQueries(1):
+            self.assertEqual([(line.book.name, line.line_total) for line in cart.lines(self.user)],
+                             [('Cheap', Decimal('5.00')), ('Dear', Decimal('12.25'))])
+        self.assertEqual(cart.totals(self.user), {'count': 3, 'total': Decimal('17.25')})
+        response = self.client.get(reverse('checkout'))
+        self.assertEqual(response.context['total_price'], Decimal('17.25'))
+
+    def test_summary_is_cached_and_invalidated_by_every_cart_change(self):
+        self.assertEqual(cart.summary(self.user), cart.EMPTY)
+        with self.assertNumQueries(0):
+            cart.summary(self.user)
+
+        self.client.get(reverse('add_to_cart', args=[self.book.id]))
+        self.assertEqual(cart.summary(self.user), {'count': 1, 'total': Decimal('2.50')})
+        self.client.post(reverse('update_cart_quantity', args=[self.book.id]), {'quantity': 4})
+        self.assertEqual(cart.summary(self.user), {'count': 4, 'total': Decimal('10.00')})
+        self.book.price = Decimal('3.00')
+        self.book.save()
+        self.assertEqual(cart.summary(self.user)['total'], Decimal('12.00'))
+        self.client.post(reverse('cancel_checkout'))
+        self.assertEqual(cart.summary(self.user), cart.EMPTY)
+
+        orders.add_to_cart(self.user, self.other)
+        self.assertEqual(cart.summary(self.user)['count'], 1)
+        self.client.post(reverse('checkout'))
+        self.assertEqual(cart.summary(self.user), cart.EMPTY)
+
+    def test_nav_bar_shows_cart_count(self):
+        orders.add_to_cart(self.user, self.other)
+        response = self.client.get(reverse('aboutus'))
+        self.assertEqual(response.context['cart_summary']['count'], 1)
+        self.assertContains(response, 'title="$12.25"')
+
+
+class QueryPlanTests(TestCase):
+    def test_full_scan_is_reported_unless_bounded_or_allowed(self):
+        plan = ['SCAN bookMng_rate', 'SEARCH bookMng_book USING INTEGER PRIMARY KEY (rowid=?)']
+        self.assertEqual(queryplans.full_scans('SELECT 1', plan), ['bookMng_rate'])
+        self.assertEqual(queryplans.full_scans('SELECT 1 LIMIT 25', plan), [])
+        self.assertEqual(queryplans.full_scans('SELECT 1 LIMIT 25', plan + ['USE TEMP B-TREE FOR ORDER BY']),
+                         ['bookMng_rate'])
+        self.assertEqual(queryplans.full_scans('SELECT 1', ['SCAN bookMng_rate USING COVERING INDEX x']), [])
+        self.assertEqual(queryplans.full_scans('SELECT 1', ['SCAN bookMng_mainmenu']), [])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'plan strings are SQLite-specific')
+    def test_limit_only_bounds_the_outer_loop(self):
+        plan = ['SCAN bookMng_book', 'LIST SUBQUERY 1', '  SCAN bookMng_comment']
+        self.assertEqual(queryplans.full_scans('SELECT 1 LIMIT 5', plan), ['bookMng_comment'])
+        # The inner loop of a join runs in full for every outer row
+        plan = ['SEARCH bookMng_book USING INDEX book_price_idx (price>?)', 'SCAN bookMng_rate']
+        self.assertEqual(queryplans.full_scans('SELECT 1 LIMIT 25', plan), ['bookMng_rate'])
+        plan = queryplans.explain('SELECT * FROM bookMng_book WHERE id IN '
+                                  '(SELECT book_id FROM bookMng_comment WHERE content LIKE %s) LIMIT 5', ['%a%'])
+        self.assertIn('  SCAN bookMng_comment', plan)
+        self.assertEqual(queryplans.full_scans('SELECT 1 LIMIT 5', plan), ['bookMng_comment'])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'plan strings are SQLite-specific')
+    def test_seeded_views_use_indexes(self):
+        bench_user = benchmark.seed(200)
+        problems = queryplans.check_scenarios(benchmark.scenarios(bench_user), bench_user)
+        self.assertEqual(problems, {})
+
+
+class DatabaseProfileTests(TestCase):
+    @unittest.skipUnless(connection.vendor == 'sqlite', 'SQLite pragmas')
+    def test_sqlite_connections_are_tuned(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_router_reads_from_replica_only_when_asked(self):
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Book), 'default')
+        with use_replicas():
+            self.assertEqual(router.db_for_read(Book), 'replica1')
+            self.assertEqual(router.db_for_write(Book), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'bookMng'))
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_listing_views_use_replica_until_the_browser_writes(self):
+        book = make_book('Replicated')
+        router = ReadReplicaRouter()
+
+        def view(request):
+            response = HttpResponse(router.db_for_read(Book))
+            if request.method == 'POST':
+                Book.objects.filter(pk=book.pk).update(quantity=3)
+            return response
+
+        middleware = ReplicaRoutingMiddleware(view)
+        factory = RequestFactory()
+        detail_url = reverse('book_detail', args=[book.id])
+        self.assertEqual(middleware(factory.get(detail_url)).content, b'replica1')
+        self.assertEqual(middleware(factory.get(reverse('mybooks'))).content, b'default')
+
+        response = middleware(factory.post(reverse('rate_book', args=[book.id])))
+        self.assertIn(PRIMARY_PIN_COOKIE, response.cookies)
+        pinned = factory.get(detail_url)
+        pinned.COOKIES[PRIMARY_PIN_COOKIE] = '1'
+        self.assertEqual(middleware(pinned).content, b'default')
+
+
+@override_settings(TASK_BACKEND='immediate')
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.book = make_book('Versioned River')
+        self.user = User.objects.create_user('reader', password='pw')
+
+    def test_rows_come_from_cache_until_the_book_changes(self):
+        url = reverse('searchbooks') + '?q=river'
+        self.assertContains(self.client.get(url), '0 Comments')
+        # A queryset update sends no signal, so the cached row is served as-is
+        Book.objects.filter(pk=self.book.pk).update(name='Versioned River Renamed')
+        self.assertNotContains(self.client.get(url), 'Renamed')
+
+        Comment.objects.create(book=self.book, user=self.user, content='river notes')
+        response = self.client.get(url)
+        self.assertContains(response, 'Renamed')
+        self.assertContains(response, '1 Comment')
+
+    def test_unchanged_page_is_not_modified(self):
+        url = reverse('displaybooks')
+        first = self.client.get(url)
+        self.assertIn('private', first['Cache-Control'])
+        repeat = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(repeat.status_code, 304)
+
+        set_rating(self.user, self.book, 4)
+        changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], first['ETag'])
+
+    def test_cart_change_revalidates_the_page(self):
+        self.client.force_login(self.user)
+        for url in (reverse('displaybooks'), reverse('searchbooks')):
+            first = self.client.get(url)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+            self.client.get(reverse('add_to_cart', args=[self.book.id]))
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+            self.assertEqual(changed.status_code, 200)
+            self.assertEqual(changed.context['cart_summary']['count'], cart.summary(self.user)['count'])
+
+    def test_process_local_cache_is_flagged_for_several_workers(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'bookmng_cache'}}
+        with unittest.mock.patch.dict(os.environ, {'BOOKEX_WORKERS': '5'}):
+            with override_settings(CACHES=locmem):
+                self.assertEqual([w.id for w in checks.check_shared_cache(None)], ['bookMng.W001'])
+            with override_settings(CACHES=shared):
+                self.assertEqual(checks.check_shared_cache(None), [])
+        with unittest.mock.patch.dict(os.environ, {'BOOKEX_WORKERS': '1'}), override_settings(CACHES=locmem):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+    def test_favorites_and_menu_bump_versions(self):
+        before = fragments.book_versions([self.book.pk])[self.book.pk]
+        self.user.favorite_books.add(self.book)
+        after = fragments.book_versions([self.book.pk])[self.book.pk]
+        self.assertGreater(after, before)
+
+        site = fragments.site_version()
+        MainMenu.objects.create(item='Extra', link='/extra')
+        self.assertGreater(fragments.site_version(), site)
+
+
+@override_settings(TASK_BACKEND='immediate')
+class AsyncCatalogViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('async-reader', password='pw')
+        self.book = make_book('Async River')
+        set_rating(self.user, self.book, 4)
+        Comment.objects.create(book=self.book, user=self.user, content='Read it twice')
+        self.user.favorite_books.add(self.book)
+
+    def _request(self, path, **params):
+        request = AsyncRequestFactory().get(path, params)
+        request.user = self.user
+
+        async def auser():
+            return self.user
+        request.auser = auser
+        return request
+
+    async def test_async_listings_match_sync_output(self):
+        for sync_view, async_view, path, params in [
+            (views.displaybooks, views.displaybooks_async, reverse('displaybooks'), {}),
+            (views.searchbooks, views.searchbooks_async, reverse('searchbooks'), {'q': 'river'}),
+            (views.favorite_list, views.favorite_list_async, reverse('favorite_list'), {}),
+        ]:
+            response = await async_view(self._request(path, **params))
+            expected = await sync_to_async(sync_view)(self._request(path, **params))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.content, expected.content, path)
+            self.assertIn(b'Async River', response.content)
+
+    async def test_async_book_detail(self):
+        response = await views.book_detail_async(self._request('/'), self.book.id)
+        self.assertContains(response, 'Read it twice')
+        self.assertContains(response, 'Remove from Favorites')
+        with self.assertRaises(Http404):
+            await views.book_detail_async(self._request('/'), self.book.id + 1)
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+
+        @tasks.task(max_attempts=2)
+        def flaky(value):
+            self.calls.append(value)
+            if value == 'bad':
+                raise ValueError('boom')
+        self.flaky = flaky
+        self.addCleanup(tasks.registry.pop, flaky.task_name)
+
+    def run_worker(self):
+        call_command('run_tasks', '--burst', '--concurrency', '1', stdout=StringIO())
+
+    def test_saves_queue_deduplicated_index_updates(self):
+        book = make_book('Queued River')
+        book.save()
+        self.assertEqual(Task.objects.filter(name=tasks.index_book.task_name, args=[book.pk]).count(), 1)
+        self.assertFalse(search.filter_books(Book.objects.all(), 'queued').exists())
+        self.run_worker()
+        self.assertEqual(list(search.filter_books(Book.objects.all(), 'queued')), [book])
+        self.assertEqual(Task.objects.get(args=[book.pk]).status, Task.DONE)
+
+    def test_comment_bursts_share_one_delayed_reindex(self):
+        user = User.objects.create_user('reader', password='pw')
+        book = make_book('Quiet River')
+        self.run_worker()
+        for text in ('lovely prose', 'dragons everywhere', 'prose again'):
+            Comment.objects.create(book=book, user=user, content=text)
+        job = Task.objects.get(name=tasks.index_commented_book.task_name)
+        self.assertGreater(job.run_after, timezone.now())
+        self.run_worker()
+        self.assertFalse(search.filter_books(Book.objects.all(), 'dragons').exists())
+
+        Task.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.run_worker()
+        self.assertEqual(list(search.filter_books(Book.objects.all(), 'dragons')), [book])
+
+    def test_comment_after_a_reindex_queues_the_next_one(self):
+        user = User.objects.create_user('reader', password='pw')
+        book = make_book('Quiet River')
+        Comment.objects.create(book=book, user=user, content='lovely prose')
+        Task.objects.update(run_after=timezone.now())
+        self.run_worker()
+        # The worker is another process: nothing it keeps in memory may hold the next reindex back
+        cache.clear()
+        Comment.objects.create(book=book, user=user, content='wizards too')
+        job = Task.objects.get(name=tasks.index_commented_book.task_name, status=Task.QUEUED)
+        Task.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.run_worker()
+        self.assertEqual(list(search.filter_books(Book.objects.all(), 'wizards')), [book])
+
+    def test_failures_are_retried_with_backoff_then_marked_failed(self):
+        self.flaky.delay('bad')
+        self.run_worker()
+        job = Task.objects.get(name=self.flaky.task_name)
+        self.assertEqual((job.status, job.attempts), (Task.QUEUED, 1))
+        self.assertIn('boom', job.last_error)
+        self.assertGreater(job.run_after, timezone.now())
+
+        Task.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        self.run_worker()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Task.FAILED, 2))
+        self.assertEqual(self.calls, ['bad', 'bad'])
+
+    def test_a_claimed_task_is_not_claimed_twice(self):
+        self.flaky.delay('ok')
+        queue = tasks.DatabaseQueue()
+        self.assertEqual(len(queue.claim(5)), 1)
+        self.assertEqual(queue.claim(5), [])
+
+
+class RoleResolverTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('author', password='pw')
+        roles.set_role(self.user, 'Writer')
+        self.book = make_book('Drafts', username=self.user)
+        self.client.force_login(self.user)
+
+    def test_role_checks_cost_one_version_lookup_per_request(self):
+        self.assertTrue(roles.has_role(User.objects.get(pk=self.user.pk), 'Writer'))
+        fresh = User.objects.get(pk=self.user.pk)
+        # Only the version is read, not the groups; then the user object holds them
+        with self.assertNumQueries(1):
+            self.assertTrue(roles.has_role(fresh, 'Publisher', 'Writer'))
+        with self.assertNumQueries(0):
+            self.assertTrue(roles.has_role(fresh, 'Writer'))
+
+    def test_session_copy_survives_a_cold_process(self):
+        session = {}
+        roles.get_roles(User.objects.get(pk=self.user.pk), session)
+        roles._local.clear()
+        fresh = User.objects.get(pk=self.user.pk)
+        # Only the version is read, not the groups
+        with self.assertNumQueries(1):
+            self.assertEqual(roles.get_roles(fresh, session), {'Writer'})
+
+    def test_revocation_reaches_processes_with_their_own_cache(self):
+        session = {}
+        roles.get_roles(User.objects.get(pk=self.user.pk), session)
+        roles.set_role(self.user, 'Regular')
+        self.assertNotEqual(session[roles.SESSION_KEY][0], RoleVersion.objects.get(user=self.user).version)
+        # Another worker: its local copy has expired and its cache never saw the change
+        roles._local.clear()
+        cache.clear()
+        self.assertEqual(roles.get_roles(User.objects.get(pk=self.user.pk), session), frozenset())
+
+    def test_revocation_holds_in_a_process_that_cached_the_roles(self):
+        roles.get_roles(User.objects.get(pk=self.user.pk))
+        # Another process revokes: our local copy is never told
+        local = dict(roles._local)
+        roles.set_role(self.user, 'Regular')
+        roles._local.update(local)
+        self.assertEqual(roles.get_roles(User.objects.get(pk=self.user.pk)), frozenset())
+
+    def test_revoked_role_is_denied_on_the_next_request_elsewhere(self):
+        edit_url = reverse('edit_book', args=[self.book.id])
+        self.assertEqual(self.client.get(edit_url).status_code, 200)
+        roles.set_role(self.user, 'Regular')
+        roles._local.clear()
+        self.assertEqual(self.client.get(edit_url).status_code, 302)
+
+    def test_settings_change_syncs_groups_and_takes_effect(self):
+        edit_url = reverse('edit_book', args=[self.book.id])
+        self.assertEqual(self.client.get(edit_url).status_code, 200)
+
+        self.client.post(reverse('user_settings'), {'role': 'Regular'})
+        self.assertFalse(self.user.groups.exists())
+        self.assertEqual(self.client.get(edit_url).status_code, 302)
+        self.assertEqual(self.client.get(reverse('postbook')).status_code, 403)
+
+        self.client.post(reverse('user_settings'), {'role': 'Publisher/Writer'})
+        self.assertEqual(set(self.user.groups.values_list('name', flat=True)), {'Publisher', 'Writer'})
+        self.assertEqual(self.client.get(reverse('postbook')).status_code, 200)
+
+    def test_group_edits_outside_the_app_invalidate(self):
+        roles.get_roles(User.objects.get(pk=self.user.pk))
+        self.user.groups.clear()
+        self.assertEqual(roles.get_roles(User.objects.get(pk=self.user.pk)), frozenset())
+
+
+@override_settings(TASK_BACKEND='immediate')
+class CatalogImportExportTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.covers = tempfile.mkdtemp()
+        for path in (self.media, self.covers):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        images.Image.new('RGB', (60, 90), 'navy').save(f'{self.covers}/river.jpg', 'JPEG')
+        self.user = User.objects.create_user('importer', password='pw')
+
+    def test_import_reports_bad_rows_and_keeps_the_rest(self):
+        with open(f'{self.covers}/books.csv', 'w', newline='') as f:
+            f.write('name,web,price,quantity,picture\n'
+                    'River Song,https://example.com,12.50,3,river.jpg\n'
+                    'No Price,https://example.com,,1,river.jpg\n'
+                    'Lost Cover,https://example.com,5,1,missing.jpg\n'
+                    'Second River,https://example.com,8,2,river.jpg\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_books', f'{self.covers}/books.csv', '--covers', self.covers,
+                     '--user', 'importer', '--batch-size', '1', stdout=out, stderr=err)
+        self.assertIn('Imported 2 book(s), 2 error(s)', out.getvalue())
+        self.assertIn('line 3: price:', err.getvalue())
+        self.assertIn("line 4: picture: cover file 'missing.jpg'", err.getvalue())
+
+        book = Book.objects.get(name='River Song')
+        self.assertEqual((book.username, book.price, book.quantity), (self.user, Decimal('12.50'), 3))
+        self.assertTrue(storage.is_blob(book.picture.name))
+        self.assertEqual(Blob.objects.get(name=book.picture.name).refcount, 2)
+        # Signals don't fire for bulk_create; the queued tasks index the rows instead
+        self.assertEqual(set(search.filter_books(Book.objects.all(), 'river')), set(Book.objects.all()))
+
+    def test_dry_run_stores_no_covers(self):
+        with open(f'{self.covers}/books.csv', 'w', newline='') as f:
+            f.write('name,web,price,quantity,picture\n'
+                    'River Song,https://example.com,12.50,3,river.jpg\n'
+                    'Lost Cover,https://example.com,5,1,missing.jpg\n')
+        with open(f'{self.covers}/books.csv') as fp:
+            report = catalog_io.import_books(fp, covers_dir=self.covers, user=self.user, dry_run=True)
+        self.assertEqual((report.imported, report.failed), (1, 1))
+        self.assertFalse(Book.objects.exists())
+        self.assertEqual(os.listdir(self.media), [])
+
+    def test_failed_batch_drops_the_covers_it_stored(self):
+        Book.objects.create(name='Existing', web='https://example.com', price=Decimal('5.00'),
+                            picture=SimpleUploadedFile('old.jpg', b'kept cover'))
+        with open(f'{self.covers}/old.jpg', 'wb') as f:
+            f.write(b'kept cover')
+        with open(f'{self.covers}/books.csv', 'w', newline='') as f:
+            f.write('name,web,price,quantity,picture\n'
+                    'River Song,https://example.com,12.50,3,river.jpg\n'
+                    'Old Cover,https://example.com,5,1,old.jpg\n')
+        storage_ = Book._meta.get_field('picture').storage
+        with unittest.mock.patch.object(Book.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with open(f'{self.covers}/books.csv') as fp:
+                report = catalog_io.import_books(fp, covers_dir=self.covers, user=self.user)
+        self.assertEqual((report.imported, report.failed), (0, 2))
+        # The new cover is gone; the one an existing book shares stays
+        self.assertEqual(list(storage_.blobs('bookEx/static/uploads')), [Book.objects.get().picture.name])
+
+    def test_jsonl_export_round_trips(self):
+        os.makedirs(f'{self.media}/bookEx/static/uploads')
+        shutil.copy(f'{self.covers}/river.jpg', f'{self.media}/bookEx/static/uploads/images.jpg')
+        make_book('Exported', price='7.25', quantity=4, username=self.user)
+        out = StringIO()
+        call_command('export_books', '--format', 'jsonl', '--chunk-size', '1', stdout=out, stderr=StringIO())
+        row = json.loads(out.getvalue().splitlines()[0])
+        self.assertEqual((row['name'], row['price'], row['posted_by']), ('Exported', '7.25', 'importer'))
+
+        Book.objects.all().delete()
+        report = catalog_io.import_books(StringIO(out.getvalue()), 'jsonl', user=self.user)
+        self.assertEqual((report.imported, report.errors), (1, []))
+        self.assertEqual(Book.objects.get().picture.name, 'bookEx/static/uploads/images.jpg')
+
+
+class HistoryExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        self.book = make_book('Kept, "quoted"', quantity=5)
+        orders.add_to_cart(self.user, self.book)
+        orders.checkout(self.user)
+        orders.return_copies(self.user, self.book, 1)
+        set_rating(self.user, self.book, 4)
+        set_rating(other, self.book, 1)
+        Comment.objects.create(book=self.book, user=self.user, content='line one\nline two')
+        self.client.force_login(self.user)
+
+    def test_csv_streams_every_kind_for_the_user_only(self):
+        response = self.client.get(reverse('export_history'))
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['kind'] for row in rows], ['purchase', 'return', 'rating', 'comment'])
+        self.assertEqual((rows[0]['book_name'], rows[0]['unit_price']), ('Kept, "quoted"', '10.00'))
+        self.assertEqual(rows[2]['rating'], '4')
+        self.assertEqual(rows[3]['comment'], 'line one\nline two')
+
+    async def test_asgi_export_streams_from_an_async_generator(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_history'), {'format': 'jsonl'})
+        self.assertTrue(response.is_async)
+        body = ''.join([part.decode() async for part in response.streaming_content])
+        self.assertEqual([json.loads(line)['kind'] for line in body.splitlines()],
+                         ['purchase', 'return', 'rating', 'comment'])
+
+    def test_jsonl_reads_in_small_chunks(self):
+        lines = ''.join(history.stream_history(self.user, 'jsonl', chunk_size=1)).splitlines()
+        self.assertEqual([json.loads(line)['kind'] for line in lines], ['purchase', 'return', 'rating', 'comment'])
+        self.assertEqual(self.client.get(reverse('export_history') + '?format=xml').status_code, 404)
+
+
+class CommentApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('talker', password='pw')
+        self.book = make_book('Talked About')
+        self.client.force_login(self.user)
+
+    def post_json(self, url, data=None):
+        return self.client.post(url, data or {}, HTTP_ACCEPT='application/json')
+
+    def test_pages_follow_created_at_then_id(self):
+        same_time = timezone.now()
+        Comment.objects.bulk_create(Comment(book=self.book, user=self.user, content=f'c{i}', created_at=same_time)
+                                    for i in range(views.COMMENTS_PER_PAGE + 5))
+        url = reverse('book_comments', args=[self.book.id])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['comments']), views.COMMENTS_PER_PAGE)
+        self.assertTrue(first['comments'][0]['mine'])
+        with self.assertNumQueries(4):  # session, user, book exists, page
+            rest = self.client.get(url, {'after': first['next']}).json()
+        self.assertIsNone(rest['next'])
+        contents = [c['content'] for c in first['comments'] + rest['comments']]
+        self.assertEqual(contents, [f'c{i}' for i in range(views.COMMENTS_PER_PAGE + 5)])
+        self.assertEqual(self.client.get(reverse('book_comments', args=[0])).status_code, 404)
+
+    def test_mutations_answer_with_json(self):
+        response = self.post_json(reverse('add_comment', args=[self.book.id]), {'content': 'First!'})
+        self.assertEqual(response.status_code, 201)
+        comment_id = response.json()['comment']['id']
+
+        response = self.post_json(reverse('edit_comment', args=[comment_id]), {'content': 'Edited'})
+        self.assertEqual(response.json()['comment']['content'], 'Edited')
+        self.assertEqual(self.post_json(reverse('edit_comment', args=[comment_id])).status_code, 400)
+
+        self.client.force_login(User.objects.create_user('stranger', password='pw'))
+        self.assertEqual(self.post_json(reverse('delete_comment', args=[comment_id])).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.post_json(reverse('delete_comment', args=[comment_id])).json(), {'deleted': comment_id})
+        self.assertFalse(Comment.objects.exists())
+
+    def test_plain_form_posts_still_redirect(self):
+        response = self.client.post(reverse('add_comment', args=[self.book.id]), {'content': 'No JS'})
+        self.assertRedirects(response, reverse('book_detail', args=[self.book.id]))
+
+
+class CatalogApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.poster = User.objects.create_user('poster', password='pw')
+        cls.books = [make_book(f'River Book {i}', price=str(10 + i), username=cls.poster) for i in range(30)]
+        search.rebuild_index()
+
+    def test_sparse_fields_and_cursor_pages(self):
+        response = self.client.get(reverse('api_book_list'), {'fields': 'name,price', 'per_page': 20})
+        data = response.json()
+        self.assertEqual(data['results'][0], {'name': 'River Book 0', 'price': '10.00'})
+        rest = self.client.get(reverse('api_book_list'), {'fields': 'id', 'after': data['next']}).json()
+        self.assertEqual([row['id'] for row in rest['results']], [book.id for book in self.books[20:]])
+        self.assertIsNone(rest['next'])
+
+        detail = self.client.get(reverse('api_book_detail', args=[self.books[0].id])).json()
+        self.assertEqual((detail['posted_by'], detail['thumbnail']), ('poster', '/static/uploads/images.jpg'))
+        self.assertEqual(self.client.get(reverse('api_book_list'), {'fields': 'name,password'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_book_detail', args=[0])).status_code, 404)
+
+    def test_search_reuses_the_search_page_filters(self):
+        data = self.client.get(reverse('api_book_search'),
+                               {'q': 'river', 'price_min': '35', 'fields': 'price'}).json()
+        self.assertEqual(sorted(row['price'] for row in data['results']), ['35.00', '36.00', '37.00', '38.00', '39.00'])
+
+    def test_gzip_with_strong_etag_and_304(self):
+        url = reverse('api_book_list')
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        self.assertEqual(json.loads(gzip.decompress(response.content))['results'][0]['name'], 'River Book 0')
+
+        cached = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((cached.status_code, cached.content), (304, b''))
+        # The uncompressed representation has its own validator
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        Book.objects.filter(pk=self.books[0].pk).update(name='Renamed')
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.dune, self.messiah, self.children, self.cookbook = (
+            make_book(name) for name in ('Dune', 'Messiah', 'Children', 'Cookbook'))
+        self.readers = [User.objects.create_user(f'reader{i}', password='pw') for i in range(3)]
+        for reader in self.readers:
+            self.dune.favorites.add(reader)
+            set_rating(reader, self.messiah, 5)
+        set_rating(self.readers[0], self.children, 4)
+        set_rating(self.readers[1], self.cookbook, 2)  # too low to count
+        self.newcomer = User.objects.create_user('newcomer', password='pw')
+
+    def build(self, *args):
+        call_command('build_recommendations', *args, stdout=StringIO())
+
+    def test_full_build_stores_neighbours_and_user_lists(self):
+        self.build('--full')
+        self.assertEqual(recommendations.also_liked(self.dune), [self.messiah, self.children])
+        self.assertEqual(recommendations.also_liked(self.cookbook), [])
+        self.assertEqual(recommendations.recommended_for(self.readers[1]), [self.children])
+        self.assertFalse(InteractionChange.objects.exists())
+
+        self.client.force_login(self.readers[1])
+        with self.assertNumQueries(1):
+            recommendations.also_liked(self.dune)
+        self.assertContains(self.client.get(reverse('book_detail', args=[self.dune.id])), 'Readers also liked')
+        self.assertContains(self.client.get(reverse('mybooks')), 'Recommended for You')
+
+    def test_incremental_build_only_touches_changed_users_and_books(self):
+        self.build('--full')
+        untouched = list(SimilarBook.objects.filter(book=self.messiah).values_list('pk', flat=True))
+        self.dune.favorites.add(self.newcomer)
+        self.assertEqual(InteractionChange.objects.count(), 1)
+
+        books, users = recommendations.build()
+        self.assertEqual((books, users), (1, 1))
+        self.assertEqual(recommendations.recommended_for(self.newcomer), [self.messiah, self.children])
+        self.assertEqual(list(SimilarBook.objects.filter(book=self.messiah).values_list('pk', flat=True)), untouched)
+        self.assertEqual(recommendations.build(), (0, 0))
+
+    def test_python_and_matrix_scores_agree_on_cosine(self):
+        baskets = {1: {10: 3.0, 11: 1.0}, 2: {10: 3.0, 11: 2.0, 12: 2.0}}
+        similar = dict(recommendations._similar_python(baskets, [10], 5)[10])
+        self.assertAlmostEqual(similar[11], (3 * 1 + 3 * 2) / (math.sqrt(18) * math.sqrt(5)))
+        self.assertAlmostEqual(similar[12], (3 * 2) / (math.sqrt(18) * 2))
+
+
+@override_settings(TASK_BACKEND='immediate')
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('shopper', password='pw')
+        self.popular, self.quiet = make_book('Popular', quantity=10), make_book('Quiet', quantity=10)
+        self.client.force_login(self.user)
+
+    def test_activity_feeds_the_index_boards(self):
+        orders.add_to_cart(self.user, self.popular)
+        orders.add_to_cart(self.user, self.popular)
+        self.client.post(reverse('checkout'))
+        self.client.get(reverse('toggle_favorite', args=[self.quiet.id]))
+        self.client.get(reverse('toggle_favorite', args=[self.quiet.id]))
+        self.client.get(reverse('toggle_favorite', args=[self.popular.id]))
+        leaderboards.materialize()
+
+        boards = dict(leaderboards.get_boards())
+        self.assertEqual([(e['name'], e['score']) for e in boards['Bestsellers']], [('Popular', 2)])
+        # Un-favoriting cancels out within the window
+        self.assertEqual([e['name'] for e in boards['Most favorited this week']], ['Popular'])
+        self.assertNotIn('Most rated this week', boards)
+        with self.assertNumQueries(0):
+            leaderboards.get_boards()
+        self.assertContains(self.client.get(reverse('index')), 'Most favorited this week')
+
+    def test_changing_a_rating_counts_once(self):
+        for rating in (4, 2, 5):
+            self.client.post(reverse('rate_book', args=[self.quiet.id]), {'rating': rating})
+        self.assertEqual(BookCounter.objects.get(metric=leaderboards.RATINGS).count, 1)
+
+    def test_old_hours_roll_up_into_days_and_expire(self):
+        now = timezone.now()
+        for hours_ago in (1, 50, 51, 24 * 40):
+            BookCounter.objects.create(book=self.quiet, metric=leaderboards.RATINGS, period=BookCounter.HOUR,
+                                       bucket_start=leaderboards._hour(now - timedelta(hours=hours_ago)), count=1)
+        leaderboards.refresh(now)
+        self.assertEqual(BookCounter.objects.filter(period=BookCounter.HOUR).count(), 1)
+        self.assertTrue(BookCounter.objects.filter(period=BookCounter.DAY).exists())
+        # The 40-day-old bucket is past every window and is gone
+        self.assertEqual(BookCounter.objects.aggregate(total=Sum('count'))['total'], 3)
+        self.assertEqual(dict(leaderboards.get_boards())['Most rated this week'][0]['score'], 3)
+
+
+class FileServingTests(TestCase):
+    def setUp(self):
+        self.source, self.collected, self.media = (tempfile.mkdtemp() for _ in range(3))
+        for path in (self.source, self.collected, self.media):
+            self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        override = override_settings(
+            STATICFILES_DIRS=[self.source], STATIC_ROOT=self.collected, MEDIA_ROOT=self.media,
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'])
+        override.enable()
+        self.addCleanup(override.disable)
+        self.css = b'body { color: #222; }\n' * 40
+        self.video = bytes(range(256)) * 8
+        with open(f'{self.source}/site.css', 'wb') as f:
+            f.write(self.css)
+        with open(f'{self.source}/clip.mp4', 'wb') as f:
+            f.write(self.video)
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, headers=headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_collected_assets_are_hashed_precompressed_and_immutable(self):
+        url = static('site.css')
+        self.assertRegex(url, r'^/static/site\.[0-9a-f]{12}\.css$')
+        response, body = self.get(url, accept_encoding='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(body), self.css)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+        response, _ = self.get(url, if_none_match=response['ETag'], accept_encoding='gzip')
+        self.assertEqual(response.status_code, 304)
+        response, body = self.get(url)
+        self.assertEqual((body, response.has_header('Content-Encoding')), (self.css, False))
+        # Unhashed names can change in place, so they are only cached briefly
+        self.assertNotIn('immutable', self.get('/static/site.css')[0]['Cache-Control'])
+
+    def test_ranges_are_streamed_as_partial_content(self):
+        url = static('clip.mp4')
+        response, body = self.get(url, range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual((response['Content-Range'], body), (f'bytes 10-19/{len(self.video)}', self.video[10:20]))
+        self.assertEqual(self.get(url, range='bytes=-5')[1], self.video[-5:])
+        # A stale If-Range gets the whole, current file
+        response, body = self.get(url, range='bytes=0-0', if_range='"stale"')
+        self.assertEqual((response.status_code, body), (200, self.video))
+        response, _ = self.get(url, range=f'bytes={len(self.video)}-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, f'bytes */{len(self.video)}'))
+
+    async def test_asgi_streams_blocks_as_they_are_read(self):
+        with open(f'{self.media}/film.mp4', 'wb') as f:
+            f.write(self.video * 100)
+        with unittest.mock.patch.object(serving, 'ASYNC_BLOCK_SIZE', 4096):
+            response = await self.async_client.get('/media/film.mp4')
+            self.assertTrue(response.is_async)
+            blocks = [block async for block in response.streaming_content]
+            self.assertEqual((len(blocks), b''.join(blocks)), (50, self.video * 100))
+            response = await self.async_client.get('/media/film.mp4', headers={'range': 'bytes=100-5099'})
+            blocks = [block async for block in response.streaming_content]
+        self.assertEqual((response.status_code, response['Content-Length']), (206, '5000'))
+        self.assertEqual([len(block) for block in blocks], [4096, 904])
+
+    def test_media_is_served_or_handed_to_the_front_end(self):
+        os.makedirs(f'{self.media}/covers')
+        with open(f'{self.media}/covers/a.jpg', 'wb') as f:
+            f.write(b'jpeg')
+        response, body = self.get('/media/covers/a.jpg')
+        self.assertEqual((response['Content-Type'], body, response['Accept-Ranges']), ('image/jpeg', b'jpeg', 'bytes'))
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        with override_settings(SENDFILE_BACKEND='x-accel-redirect'):
+            response = self.client.get('/media/covers/a.jpg')
+        self.assertEqual((response['X-Accel-Redirect'], response.content), ('/protected/media/covers/a.jpg', b''))
+
+
+class PictureBlobTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.static = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.static, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=self.media, STATICFILES_DIRS=[self.static])
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.storage = Book._meta.get_field('picture').storage
+
+    def make(self, name, picture):
+        return Book.objects.create(name=name, web='https://example.com', price=Decimal('5.00'), picture=picture)
+
+    def upload(self, data, name='cover.jpg'):
+        return SimpleUploadedFile(name, data, content_type='image/jpeg')
+
+    def test_identical_uploads_share_one_immutable_blob(self):
+        first = self.make('One', self.upload(b'same cover'))
+        second = self.make('Two', self.upload(b'same cover', 'COPY.JPG'))
+        other = self.make('Three', self.upload(b'other cover'))
+        self.assertEqual(first.picture.name, second.picture.name)
+        self.assertNotEqual(first.picture.name, other.picture.name)
+        self.assertEqual(len(list(self.storage.blobs('bookEx/static/uploads'))), 2)
+        self.assertEqual(Blob.objects.get(name=first.picture.name).refcount, 2)
+
+        response = self.client.get(f'/static/{first.pic_path}')
+        self.assertEqual(b''.join(response.streaming_content), b'same cover')
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_edits_and_deletes_orphan_blobs_for_collection(self):
+        first = self.make('One', self.upload(b'old cover'))
+        second = self.make('Two', self.upload(b'old cover'))
+        old = first.picture.name
+        variant = images._variant_name(old, images.THUMB_SUFFIX, 'jpg')
+        self.storage.save_as(variant, ContentFile(b'thumb'))
+
+        first.picture = self.upload(b'new cover')
+        first.save()
+        self.assertEqual(Blob.objects.get(name=old).refcount, 1)
+        second.delete()
+        self.assertEqual(Blob.objects.get(name=old).refcount, 0)
+        # Within the grace period nothing goes
+        self.assertEqual(blobs.collect(), (0, 0))
+        self.assertEqual(blobs.collect(timedelta(0)), (1, len(b'old cover') + len(b'thumb')))
+        self.assertFalse(self.storage.exists(old) or self.storage.exists(variant))
+        self.assertFalse(Blob.objects.filter(name=old).exists())
+        self.assertTrue(self.storage.exists(first.picture.name))
+
+    def test_collect_sweeps_unsaved_uploads_but_trusts_books_over_counts(self):
+        stray = self.storage.save('bookEx/static/uploads/stray.jpg', ContentFile(b'never saved'))
+        kept = self.make('Kept', self.upload(b'kept cover'))
+        Blob.objects.filter(name=kept.picture.name).update(refcount=0, orphaned_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(blobs.collect(timedelta(0))[0], 1)
+        self.assertFalse(self.storage.exists(stray))
+        self.assertTrue(self.storage.exists(kept.picture.name))
+        self.assertEqual(Blob.objects.get(name=kept.picture.name).refcount, 1)
+
+    def test_adopt_merges_legacy_duplicates(self):
+        os.makedirs(f'{self.media}/bookEx/static/uploads')
+        for name in ('django1.jpg', 'django1_MDEqQj9.jpg'):
+            with open(f'{self.media}/bookEx/static/uploads/{name}', 'wb') as f:
+                f.write(b'legacy cover')
+            self.make(name, f'bookEx/static/uploads/{name}')
+        blobs.recount()
+        out = StringIO()
+        call_command('collect_blobs', '--adopt', '--grace-minutes', '0', stdout=out)
+        self.assertIn('Moved 2 book(s) to content-addressed pictures, deleting 2 duplicate file(s)', out.getvalue())
+        names = set(Book.objects.values_list('picture', flat=True))
+        self.assertEqual(len(names), 1)
+        self.assertTrue(storage.is_blob(names.pop()))
+        self.assertFalse([f for f in os.listdir(f'{self.media}/bookEx/static/uploads') if f.endswith('.jpg')])
+        self.assertFalse(Blob.objects.filter(refcount__lte=0).exists())
+
+    def test_adopt_finds_legacy_pictures_in_the_static_directory(self):
+        # Where the pictures uploaded before MEDIA_ROOT was set actually live
+        uploads = f'{self.static}/uploads'
+        os.makedirs(uploads)
+        files = {'django1.jpg': b'django', 'django1_cAG2eGh.jpg': b'django', 'images.jpg': b'images',
+                 'images_n2Km6Hq.jpg': b'images', 'images_unused.jpg': b'images', 'BookExchange.mp4': b'video'}
+        for name, data in files.items():
+            with open(f'{uploads}/{name}', 'wb') as f:
+                f.write(data)
+        first = self.make('One', 'bookEx/static/uploads/django1_cAG2eGh.jpg')
+        second = self.make('Two', 'bookEx/static/uploads/images_n2Km6Hq.jpg')
+        third = self.make('Three', 'bookEx/static/uploads/images.jpg')
+        blobs.recount()
+
+        with override_settings(TASK_BACKEND='immediate'):
+            self.assertEqual(blobs.adopt(), (3, 5))
+        for book in (first, second, third):
+            book.refresh_from_db()
+            self.assertTrue(storage.is_blob(book.picture.name))
+            self.assertEqual(self.client.get(static(book.pic_path)).status_code, 200)
+        self.assertEqual(second.picture.name, third.picture.name)
+        with self.storage.open(first.picture.name) as f:
+            self.assertEqual(f.read(), b'django')
+        # Only the file with no blob copy is left
+        self.assertEqual(os.listdir(uploads), ['BookExchange.mp4'])
+        self.assertEqual(blobs.adopt(), (0, 0))
@@ -1,15 +1,24 @@
+from django.conf import settings
 from django.urls import path, include
-from . import views
+from . import api, views
+
+if settings.ASYNC_CATALOG_VIEWS:
+   displaybooks, searchbooks = views.displaybooks_async, views.searchbooks_async
+   book_detail, favorite_list = views.book_detail_async, views.favorite_list_async
+else:
+   displaybooks, searchbooks = views.displaybooks, views.searchbooks
+   book_detail, favorite_list = views.book_detail, views.favorite_list
 
 urlpatterns = [
    path('', views.index, name='index'),
    path('postbook', views.postbook, name='postbook'),
-   path('displaybooks', views.displaybooks, name='displaybooks'),
-   path('book_detail/<int:book_id>', views.book_detail, name='book_detail'),
+   path('displaybooks', displaybooks, name='displaybooks'),
+   path('book_detail/<int:book_id>', book_detail, name='book_detail'),
    path('mybooks', views.mybooks, name='mybooks'),
+   path('mybooks/history', views.export_history, name='export_history'),
    path('book_delete/<int:book_id>', views.book_delete, name='book_delete'),
    path('aboutus', views.aboutus, name='aboutus'),
-   path('searchbooks', views.searchbooks, name='searchbooks'),
+   path('searchbooks', searchbooks, name='searchbooks'),
    path('cart/', views.view_cart, name='cart'),
    path('add_to_cart/<int:book_id>', views.add_to_cart, name='add_to_cart'),
    path('update_cart_quantity/<int:book_id>/', views.update_cart_quantity, name='update_cart_quantity'),
@@ -18,11 +27,16 @@ urlpatterns = [
    path('return_book/<int:book_id>/', views.return_book, name='return_book'),
    path('rate/<int:book_id>', views.rate_book, name='rate_book'),
    path('toggle_favorite/<int:book_id>/', views.toggle_favorite, name='toggle_favorite'),
-   path('favorites/', views.favorite_list, name='favorite_list'),
+   path('favorites/', favorite_list, name='favorite_list'),
+   path('book_detail/<int:book_id>/comments', views.book_comments, name='book_comments'),
    path('add_comment/<int:book_id>/', views.add_comment, name='add_comment'),
    path('delete_comment/<int:comment_id>/', views.delete_comment, name='delete_comment'),
    path('profile/', views.user_settings, name='user_settings'),
    path('rating/delete/<int:rate_id>/', views.delete_rating, name='delete_rating'),
    path('books/<int:book_id>/edit/', views.edit_book, name='edit_book'),
    path('comment/edit/<int:comment_id>/', views.edit_comment, name='edit_comment'),
+   path('api/books', api.book_list, name='api_book_list'),
+   path('api/books/search', api.book_search, name='api_book_search'),
+   path('api/books/<int:book_id>', api.book_detail, name='api_book_detail'),
+   path('viewstats/', views.view_stats, name='view_stats'),
 ]
\ No newline at end of file
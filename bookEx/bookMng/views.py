@@ -1,40 +1,46 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.http import HttpResponse
-from .models import MainMenu, Rate
+from .models import Rate
 from .forms import BookForm
 from django.http import HttpResponseRedirect
 from django.http import HttpResponseForbidden
 from .models import Book, Comment
 from django.views.generic.edit import CreateView
 from django.contrib.auth.forms import UserCreationForm
-from django.urls import reverse_lazy
-from .models import ShoppingCart
+from django.urls import reverse, reverse_lazy
+from django.utils.formats import date_format
+from django.utils.timezone import localtime
 from django.contrib.auth.decorators import login_required
-from django.db.models import Avg, Q
-from django.db.models import Sum
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.contrib import messages
-from .models import BookReturn
 from .decorators import group_required
 from .forms import CustomUserCreationForm
 from .models import UserProfile
 from django.contrib.auth import login
-from django.contrib.auth.models import Group
 from django.shortcuts import get_object_or_404, redirect
+from .pagination import apaginate, paginate
+from .ratings import remove_rating, set_rating
+from . import cart, fragments, history, leaderboards, orders, recommendations, roles, search, tasks, viewstats
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+import asyncio
+
+COMMENTS_PER_PAGE = 20
 
 
 def index(request):
-   return render(request, 'bookMng/index.html', { 'item_list': MainMenu.objects.all() })
+   return render(request, 'bookMng/index.html', {'leaderboards': leaderboards.get_boards()})
 
 def postbook(request):
     if not request.user.is_authenticated:
         return render(request, 'bookMng/login_required.html', {
             'message': 'You need to log in to post a book.',
-            'item_list': MainMenu.objects.all(),
         })
 
-    # Assuming you still want to check user role here (Publisher or Writer)
-    profile = getattr(request.user, 'userprofile', None)
-    if not profile or profile.role not in ['Publisher', 'Writer']:
+    if not roles.has_role(request.user, 'Publisher', 'Writer', session=request.session):
         return render(request, 'permission_denied.html', status=403)
 
     submitted = False
@@ -44,6 +50,7 @@ def postbook(request):
             book = form.save(commit=False)
             book.username = request.user
             book.save()
+            tasks.generate_covers.delay(book.pk)
             submitted = True
     else:
         form = BookForm()
@@ -53,78 +60,122 @@ def postbook(request):
     return render(request, 'bookMng/postbook.html', {
         'form': form,
         'submitted': submitted,
-        'item_list': MainMenu.objects.all(),
     })
 
 def displaybooks(request):
-    books = Book.objects.all()
-    for b in books:
-        b.pic_path = b.picture.url.split('/static/')[-1]
-    return render(request, 'bookMng/displaybooks.html', {'item_list': MainMenu.objects.all(), 'books': books})
+    books = paginate(request, Book.objects.select_related('username'))
+    return fragments.render_page(request, 'bookMng/displaybooks.html', {'books': books}, books)
 
 
-def book_detail(request, book_id):
-    book = get_object_or_404(Book, id=book_id)
-    book.pic_path = book.picture.url.split('/static/')[-1]
+async def displaybooks_async(request):
+    books = await apaginate(request, Book.objects.select_related('username'))
+    return await sync_to_async(fragments.render_page)(request, 'bookMng/displaybooks.html', {'books': books}, books)
 
-    ratings = Rate.objects.filter(book=book)
-    avg_rating = ratings.aggregate(Avg('rating'))['rating__avg']
 
-    return render(request, 'bookMng/book_detail.html', {
-        'item_list': MainMenu.objects.all(),
+def _rating_summary(user_id):
+    """Aggregates for the star breakdown and the viewer's own rating in one pass over Rate."""
+    return {
+        **{f'stars_{i}': Count('id', filter=Q(rating=i)) for i in range(1, 6)},
+        'my_rate_id': Max('id', filter=Q(user_id=user_id)),
+        'my_rating': Max('rating', filter=Q(user_id=user_id)),
+    }
+
+
+def _book_comments(book):
+    return Comment.objects.filter(book=book).select_related('user').only(
+        'id', 'book_id', 'content', 'created_at', 'user', 'user__username')
+
+
+def _book_detail_context(book, ratings, is_favorite, comments, also_liked):
+    return {
         'book': book,
-        'ratings': ratings,
-        'avg_rating': avg_rating
-    })
+        'rating_count': book.rating_count,
+        'rating_breakdown': [(i, ratings[f'stars_{i}']) for i in range(5, 0, -1)],
+        'my_rating': ratings['my_rating'],
+        'my_rate_id': ratings['my_rate_id'],
+        'avg_rating': book.rating_avg if book.rating_count else None,
+        'is_favorite': is_favorite,
+        'comments': comments,
+        'also_liked': also_liked,
+    }
+
+
+def book_detail(request, book_id):
+    book = get_object_or_404(Book.objects.select_related('username'), id=book_id)
+
+    user_id = request.user.id if request.user.is_authenticated else None
+    ratings = Rate.objects.filter(book=book).aggregate(**_rating_summary(user_id))
+    is_favorite = user_id is not None and book.favorites.filter(pk=user_id).exists()
+    comments = paginate(request, _book_comments(book),
+                        prefix='comments_', per_page=COMMENTS_PER_PAGE, ordering='created')
+    also_liked = recommendations.also_liked(book)
+
+    return render(request, 'bookMng/book_detail.html',
+                  _book_detail_context(book, ratings, is_favorite, comments, also_liked))
+
+
+async def _false():
+    return False
+
+
+async def book_detail_async(request, book_id):
+    try:
+        book = await Book.objects.select_related('username').aget(id=book_id)
+    except Book.DoesNotExist:
+        raise Http404('No Book matches the given query.')
+
+    user = await request.auser()
+    user_id = user.id if user.is_authenticated else None
+    # The rating summary, favorite flag, comment page and suggestions don't depend on each other
+    ratings, is_favorite, comments, also_liked = await asyncio.gather(
+        Rate.objects.filter(book=book).aaggregate(**_rating_summary(user_id)),
+        book.favorites.filter(pk=user_id).aexists() if user_id is not None else _false(),
+        apaginate(request, _book_comments(book),
+                  prefix='comments_', per_page=COMMENTS_PER_PAGE, ordering='created'),
+        sync_to_async(recommendations.also_liked)(book),
+    )
+
+    return await sync_to_async(render)(request, 'bookMng/book_detail.html',
+                                       _book_detail_context(book, ratings, is_favorite, comments, also_liked))
 
 
 def mybooks(request):
     if not request.user.is_authenticated:
         return render(request, 'bookMng/login_required.html', {
             'message': 'You need to login to view your books.',
-            'item_list': MainMenu.objects.all(),
         })
 
-    posted_books = Book.objects.filter(username=request.user)
-    purchased_items = ShoppingCart.objects.filter(user=request.user, checked_out=True)
-    purchased_books_quantities = purchased_items.values('book').annotate(total_quantity=Sum('quantity'))
-
-    # Calculate returned quantities for user
-    returned_books_quantities = BookReturn.objects.filter(user=request.user).values('book').annotate(total_quantity=Sum('quantity'))
-    returned_quantities = {rq['book']: rq['total_quantity'] for rq in returned_books_quantities}
-
-    # Compute net purchased quantities = purchased - returned
-    purchased_quantities = {}
-    for pq in purchased_books_quantities:
-        book_id = pq['book']
-        net_qty = pq['total_quantity'] - returned_quantities.get(book_id, 0)
-        if net_qty > 0:
-            purchased_quantities[book_id] = net_qty
+    posted_books = paginate(request, Book.objects.filter(username=request.user), prefix='posted_')
 
-    # Filter purchased_books to include only books with positive net quantity
-    purchased_books = Book.objects.filter(id__in=purchased_quantities.keys())
+    # Net purchased quantities come straight from the OwnedBook ledger
+    purchased_books = paginate(request, Book.objects.filter(owners__user=request.user, owners__quantity__gt=0)
+                               .annotate(owned_quantity=F('owners__quantity')), prefix='purchased_')
 
-    favorite_books = request.user.favorite_books.all()
-
-    for book in posted_books:
-        book.pic_path = book.picture.url.split('/static/')[-1]
-    for book in purchased_books:
-        book.pic_path = book.picture.url.split('/static/')[-1]
-    for book in favorite_books:
-        book.pic_path = book.picture.url.split('/static/')[-1]
+    favorite_books = paginate(request, request.user.favorite_books.all(), prefix='favorites_')
 
     return render(request, 'bookMng/mybooks.html', {
-        'item_list': MainMenu.objects.all(),
         'posted_books': posted_books,
         'purchased_books': purchased_books,
-        'purchased_quantities': purchased_quantities,
-        'favorite_books': favorite_books
+        'favorite_books': favorite_books,
+        'recommended_books': recommendations.recommended_for(request.user),
     })
 
+@login_required
+def export_history(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in history.FORMATS:
+        raise Http404('Unknown export format')
+    # Under ASGI a sync generator would be read whole before the first byte is sent
+    stream = history.astream_history if isinstance(request, ASGIRequest) else history.stream_history
+    response = StreamingHttpResponse(stream(request.user, fmt), content_type=history.FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="bookex-history-{request.user.username}.{fmt}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
 def book_delete(request, book_id):
    book = Book.objects.get(id=book_id)
    book.delete()
-   return render(request, 'bookMng/book_delete.html', { 'item_list': MainMenu.objects.all() })
+   return render(request, 'bookMng/book_delete.html')
 
 class Register(CreateView):
     template_name = 'registration/register.html'
@@ -140,14 +191,6 @@ def register(request):
             is_publisher = form.cleaned_data.get('is_publisher')
             is_writer = form.cleaned_data.get('is_writer')
 
-            # Assign groups based on checkboxes
-            if is_publisher:
-                publisher_group, _ = Group.objects.get_or_create(name='Publisher')
-                user.groups.add(publisher_group)
-            if is_writer:
-                writer_group, _ = Group.objects.get_or_create(name='Writer')
-                user.groups.add(writer_group)
-
             # Determine role string for profile
             if is_publisher and is_writer:
                 role = 'Publisher/Writer'
@@ -158,7 +201,8 @@ def register(request):
             else:
                 role = 'Regular'
 
-            UserProfile.objects.create(user=user, role=role)
+            # Profile role and group membership are kept in step
+            roles.set_role(user, role)
 
             return redirect('register-success')
     else:
@@ -173,9 +217,8 @@ def user_settings(request):
     profile, created = UserProfile.objects.get_or_create(user=request.user)
     if request.method == 'POST':
         new_role = request.POST.get('role')
-        if new_role in ['Regular', 'Publisher', 'Writer']:
-            profile.role = new_role
-            profile.save()
+        if new_role in roles.ROLE_GROUPS:
+            roles.set_role(request.user, new_role)
             messages.success(request, 'Profile updated successfully.')
             return redirect('user_settings')
         else:
@@ -184,98 +227,72 @@ def user_settings(request):
 
 
 def aboutus(request):
-   return render(request, 'aboutus.html', { 'item_list': MainMenu.objects.all() })
+   return render(request, 'aboutus.html')
 
 
-def searchbooks(request):
+def _search_books(request):
+    """The filtered search queryset, its page ordering and the form values to echo back."""
     query = request.GET.get('q')
     min_rating = request.GET.get('min_rating')
     price_min = request.GET.get('price_min')
     price_max = request.GET.get('price_max')
 
-    books = Book.objects.all()
-    if query:
-        books = books.filter(name__icontains=query)
-
-    books = books.annotate(avg_rating_value=Avg('rate__rating'))
-
-    # Filter by rating only if min_rating is set and not 'none'
-    if min_rating and min_rating != 'none':
-        try:
-            min_rating_float = float(min_rating)
-            books = books.filter(avg_rating_value__gte=min_rating_float)
-        except ValueError:
-            pass
-
-    if price_min:
-        try:
-            price_min_val = float(price_min)
-            books = books.filter(price__gte=price_min_val)
-        except ValueError:
-            pass
-
-    if price_max:
-        try:
-            price_max_val = float(price_max)
-            books = books.filter(price__lte=price_max_val)
-        except ValueError:
-            pass
-
-    books = books.prefetch_related('comments')
+    books = search.filter_catalog(Book.objects.all(), request.GET)
 
-    # For static pic_path extraction and rating None handling
-    for book in books:
-        if book.picture:
-            book.pic_path = book.picture.url.split('/static/')[-1]
-        else:
-            book.pic_path = 'default.jpg'  # fallback image path if needed
-        if book.avg_rating_value is None:
-            book.avg_rating_value = None
+    comment_count = (Comment.objects.filter(book=OuterRef('pk')).order_by()
+                     .values('book').annotate(n=Count('id')).values('n'))
+    books = books.annotate(comment_count=Coalesce(Subquery(comment_count), 0))
 
     context = {
-        'books': books,
         'query': query or '',
         'min_rating': min_rating or 'none',
         'price_min': price_min or '',
         'price_max': price_max or '',
     }
-    return render(request, 'bookMng/searchbooks.html', context)
+    return books, 'relevance' if query else 'id', context
+
+
+def searchbooks(request):
+    books, ordering, context = _search_books(request)
+    context['books'] = books = paginate(request, books, ordering=ordering)
+    return fragments.render_page(request, 'bookMng/searchbooks.html', context, books)
+
+
+async def searchbooks_async(request):
+    # Building the queryset may probe the database once for full-text support
+    books, ordering, context = await sync_to_async(_search_books)(request)
+    context['books'] = books = await apaginate(request, books, ordering=ordering)
+    return await sync_to_async(fragments.render_page)(request, 'bookMng/searchbooks.html', context, books)
 
 @login_required
 def add_to_cart(request, book_id):
     book = get_object_or_404(Book, id=book_id)
-    cart_item, created = ShoppingCart.objects.get_or_create(user=request.user, book=book, checked_out=False)
-    if not created:
-        cart_item.quantity += 1
-    cart_item.save()
+    orders.add_to_cart(request.user, book)
     return redirect('checkout')
 
 @login_required
 def view_cart(request):
-    cart_items = ShoppingCart.objects.filter(user=request.user, checked_out=False).select_related('book')
-    for item in cart_items:
-        item.book.pic_path = item.book.picture.url.split('/static/')[-1]
-    return render(request, 'bookMng/cart.html', {'item_list': MainMenu.objects.all(), 'cart_items': cart_items})
+    return render(request, 'bookMng/cart.html', {'cart_items': cart.lines(request.user)})
 
 def checkout(request):
     if not request.user.is_authenticated:
         return render(request, 'bookMng/login_required.html', {
             'message': 'You need to log in to access the checkout.',
-            'item_list': MainMenu.objects.all(),
         })
 
     if request.method == 'POST':
-        ShoppingCart.objects.filter(user=request.user, checked_out=False).update(checked_out=True)
+        try:
+            order = orders.checkout(request.user)
+        except orders.CheckoutError as exc:
+            messages.error(request, str(exc))
+            return redirect('checkout')
+        leaderboards.record_order(order)
+        messages.success(request, 'Thank you for your purchase!')
         return redirect('mybooks')
     else:
-        cart_items = ShoppingCart.objects.filter(user=request.user, checked_out=False).select_related('book')
-        total_price = sum(item.quantity * item.book.price for item in cart_items)
-        for item in cart_items:
-            item.book.pic_path = item.book.picture.url.split('/static/')[-1]
         return render(request, 'bookMng/checkout.html', {
-            'item_list': MainMenu.objects.all(),
-            'cart_items': cart_items,
-            'total_price': total_price
+            'cart_items': cart.lines(request.user),
+            'total_price': cart.totals(request.user)['total'],
         })
 
 
@@ -284,11 +301,9 @@ def rate_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     if request.method == 'POST':
         rating = int(request.POST.get('rating'))
-        Rate.objects.update_or_create(
-            user=request.user,
-            book=book,
-            defaults={'rating': rating}
-        )
+        _, created = set_rating(request.user, book, rating)
+        if created:
+            leaderboards.record(leaderboards.RATINGS, {book.id: 1})
         return redirect('book_detail', book_id=book_id)
 
     return render(request, 'bookMng/rate.html', { 'book': book })
@@ -297,77 +312,107 @@ def rate_book(request, book_id):
 def toggle_favorite(request, book_id):
     book = get_object_or_404(Book, id=book_id)
     user = request.user
-    if user in book.favorites.all():
+    if book.favorites.filter(pk=user.pk).exists():
         book.favorites.remove(user)
+        leaderboards.record(leaderboards.FAVORITES, {book.id: -1})
     else:
         book.favorites.add(user)
+        leaderboards.record(leaderboards.FAVORITES, {book.id: 1})
     return redirect('book_detail', book_id=book_id)
 
 @login_required
 def favorite_list(request):
     user = request.user
-    favorites = user.favorite_books.all()
-    for book in favorites:
-        book.pic_path = book.picture.url[14:]
+    favorites = paginate(request, user.favorite_books.all())
     return render(request, 'bookMng/favorites.html', {
-        'item_list': MainMenu.objects.all(),
         'favorites': favorites
     })
 
+@login_required
+async def favorite_list_async(request):
+    user = await request.auser()
+    favorites = await apaginate(request, user.favorite_books.all())
+    return await sync_to_async(render)(request, 'bookMng/favorites.html', {
+        'favorites': favorites
+    })
+
+def _wants_json(request):
+    return request.get_preferred_type(['text/html', 'application/json']) == 'application/json'
+
+
+def _comment_json(comment, user):
+    return {
+        'id': comment.id,
+        'user': comment.user.username,
+        'content': comment.content,
+        'created_at': comment.created_at.isoformat(),
+        'created_display': date_format(localtime(comment.created_at), 'M d, Y H:i'),
+        'mine': comment.user_id == user.id,
+        'edit_url': reverse('edit_comment', args=[comment.id]),
+        'delete_url': reverse('delete_comment', args=[comment.id]),
+    }
+
+
+def book_comments(request, book_id):
+    """One page of a book's comments as JSON, oldest first; follow ``next`` for the rest."""
+    if not Book.objects.filter(pk=book_id).exists():
+        raise Http404('No such book')
+    page = paginate(request, _book_comments(book_id), per_page=COMMENTS_PER_PAGE, ordering='created')
+    return JsonResponse({
+        'comments': [_comment_json(comment, request.user) for comment in page],
+        'next': page.next_cursor,
+    })
+
 @login_required
 def add_comment(request, book_id):
-    book = get_object_or_404(Book, id=book_id)
+    book = get_object_or_404(Book.objects.only('id'), id=book_id)
     if request.method == 'POST':
         content = request.POST.get('content')
         if content:
-            Comment.objects.create(book=book, user=request.user, content=content)
+            comment = Comment.objects.create(book=book, user=request.user, content=content)
+            if _wants_json(request):
+                return JsonResponse({'comment': _comment_json(comment, request.user)}, status=201)
+        elif _wants_json(request):
+            return JsonResponse({'error': 'Comment cannot be empty.'}, status=400)
     return redirect('book_detail', book_id=book_id)
 
 @login_required
 def delete_comment(request, comment_id):
     comment = get_object_or_404(Comment, id=comment_id)
-    if comment.user != request.user:
+    if comment.user_id != request.user.id:
+        if _wants_json(request):
+            return JsonResponse({'error': 'You are not allowed to delete this comment.'}, status=403)
         return HttpResponseForbidden("You are not allowed to delete this comment.")
-    book_id = comment.book.id
+    book_id = comment.book_id
     comment.delete()
+    if _wants_json(request):
+        return JsonResponse({'deleted': comment_id})
     return redirect('book_detail', book_id=book_id)
 
 @login_required
 def update_cart_quantity(request, book_id):
     if request.method == 'POST':
         book = get_object_or_404(Book, id=book_id)
-        cart_item = ShoppingCart.objects.filter(user=request.user, book=book, checked_out=False).first()
-        if cart_item:
-            try:
-                qty = int(request.POST.get('quantity', 1))
-                if qty > 0:
-                    cart_item.quantity = qty
-                    cart_item.save()
-            except ValueError:
-                pass
+        try:
+            qty = int(request.POST.get('quantity', 1))
+            if qty > 0:
+                cart.set_quantity(request.user, book, qty)
+        except ValueError:
+            pass
         return redirect('checkout')
 
 @login_required
 def return_book(request, book_id):
     book = get_object_or_404(Book, id=book_id)
 
-    # Get user's total purchased (exclude already returned)
-    purchased = ShoppingCart.objects.filter(
-        user=request.user, book=book, checked_out=True
-    ).aggregate(total=Sum('quantity'))['total'] or 0
-    returned = BookReturn.objects.filter(
-        user=request.user, book=book
-    ).aggregate(total=Sum('quantity'))['total'] or 0
-    available_to_return = purchased - returned
+    available_to_return = orders.owned_quantity(request.user, book)
 
     if request.method == "POST":
-        qty = int(request.POST.get("quantity", 0))
-        if 0 < qty <= available_to_return:
-            # Update inventory
-            book.quantity += qty     # Assumes Book has a quantity (inventory) field
-            book.save()
-            # Log the return
-            BookReturn.objects.create(user=request.user, book=book, quantity=qty)
+        try:
+            qty = int(request.POST.get("quantity", 0))
+        except ValueError:
+            qty = 0
+        if orders.return_copies(request.user, book, qty):
             messages.success(request, f"Successfully returned {qty} copy/copies of {book.name}.")
         else:
             messages.error(request, f"Invalid quantity: {qty}. You can return up to {available_to_return}.")
@@ -386,7 +431,9 @@ def edit_book(request, book_id):
     if request.method == 'POST':
         form = BookForm(request.POST, request.FILES, instance=book)
         if form.is_valid():
-            form.save()
+            book = form.save()
+            if 'picture' in form.changed_data:
+                tasks.generate_covers.delay(book.pk)
             return redirect('book_detail', book_id=book.id)
     else:
         form = BookForm(instance=book)
@@ -404,20 +451,22 @@ def delete_book(request, book_id):
 def cancel_checkout(request):
     if request.method == 'POST':
         # Remove all shopping cart items for the current user that are not checked out
-        ShoppingCart.objects.filter(user=request.user, checked_out=False).delete()
+        cart.clear(request.user)
     return redirect('cart')  # Ensure 'cart' URL name exists
 
 @login_required
 def delete_rating(request, rate_id):
     rating = get_object_or_404(Rate, id=rate_id)
     if rating.user == request.user:
-        rating.delete()
+        remove_rating(rating)
     return redirect('book_detail', book_id=rating.book.id)
 
 @login_required
 def edit_comment(request, comment_id):
-    comment = get_object_or_404(Comment, id=comment_id)
-    if comment.user != request.user:
+    comment = get_object_or_404(Comment.objects.select_related('user'), id=comment_id)
+    if comment.user_id != request.user.id:
+        if _wants_json(request):
+            return JsonResponse({'error': 'You cannot edit this comment.'}, status=403)
         return HttpResponseForbidden("You cannot edit this comment.")
 
     if request.method == 'POST':
@@ -425,7 +474,14 @@ def edit_comment(request, comment_id):
         if content:
             comment.content = content
             comment.save()
-        return redirect('book_detail', book_id=comment.book.id)
+        elif _wants_json(request):
+            return JsonResponse({'error': 'Comment cannot be empty.'}, status=400)
+        if _wants_json(request):
+            return JsonResponse({'comment': _comment_json(comment, request.user)})
+
+    return redirect('book_detail', book_id=comment.book_id)
+
 
-    # Optionally handle GET if you want a separate edit page
-    return redirect('book_detail', book_id=comment.book.id)
+@staff_member_required
+def view_stats(request):
+    return JsonResponse(viewstats.registry.report())
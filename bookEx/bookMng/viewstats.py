@@ -0,0 +1,149 @@
+"""
+Rolling per-view request statistics collected by ViewStatsMiddleware.
+
+Each resolved URL name keeps the last ``VIEW_STATS_WINDOW`` samples in a
+bounded deque, so memory stays fixed no matter how long the process runs.
+Every VIEW_STATS_PUBLISH_INTERVAL seconds a process also publishes its
+summary (counts and percentiles, not the raw samples) to Django's cache under
+its own key, which expires after VIEW_STATS_CACHE_TIMEOUT so dead workers drop
+out. ``manage.py viewstats`` merges those summaries; percentiles across workers
+are averaged weighted by request count, which is close enough to spot a slow
+view. The command runs in its own process, so it only sees the workers through
+a shared cache (BOOKEX_CACHE_URL, see settings.py).
+"""
+import math
+import os
+import socket
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+
+CACHE_PREFIX = 'bookMng:viewstats'
+WORKERS_KEY = f'{CACHE_PREFIX}:workers'
+WORKERS_LOCK_KEY = f'{CACHE_PREFIX}:workers:lock'
+MAX_SQL_LENGTH = 500
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(samples):
+    """
+    Reduce ``(wall_ms, queries, db_ms, slowest_ms, slowest_sql)`` samples to
+    the report shape shared by the endpoint and the management command.
+    """
+    walls = sorted(s[0] for s in samples)
+    queries = sorted(s[1] for s in samples)
+    db_times = sorted(s[2] for s in samples)
+    slowest = max(samples, key=lambda s: s[3])
+    return {
+        'requests': len(samples),
+        'wall_ms': {f'p{p}': round(percentile(walls, p), 2) for p in (50, 95, 99)},
+        'queries': {f'p{p}': percentile(queries, p) for p in (50, 95, 99)},
+        'db_ms': {f'p{p}': round(percentile(db_times, p), 2) for p in (50, 95, 99)},
+        'slowest_query': {'ms': round(slowest[3], 2), 'sql': slowest[4]},
+    }
+
+
+class ViewStatsRegistry:
+    def __init__(self, window=None, max_views=None):
+        self.window = window or _setting('VIEW_STATS_WINDOW', 1000)
+        self.max_views = max_views or _setting('VIEW_STATS_MAX_VIEWS', 200)
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._published_at = 0.0
+
+    def record(self, view_name, wall_ms, queries, db_ms, slowest_ms, slowest_sql):
+        sample = (wall_ms, queries, db_ms, slowest_ms, (slowest_sql or '')[:MAX_SQL_LENGTH])
+        with self._lock:
+            samples = self._samples.get(view_name)
+            if samples is None:
+                if len(self._samples) >= self.max_views:
+                    view_name = '<other>'
+                samples = self._samples.setdefault(view_name, deque(maxlen=self.window))
+            samples.append(sample)
+        self._maybe_publish()
+
+    def samples(self):
+        with self._lock:
+            return {name: list(samples) for name, samples in self._samples.items()}
+
+    def report(self):
+        return {name: summarize(samples) for name, samples in sorted(self.samples().items()) if samples}
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+    def _maybe_publish(self):
+        interval = _setting('VIEW_STATS_PUBLISH_INTERVAL', 30)
+        now = time.monotonic()
+        if now - self._published_at < interval:
+            return
+        self._published_at = now
+        self.publish()
+
+    def publish(self):
+        """Store this process's summary in the shared cache."""
+        worker = f'{socket.gethostname()}-{os.getpid()}'
+        timeout = _setting('VIEW_STATS_CACHE_TIMEOUT', 5 * 60)
+        cache.set(_worker_key(worker), self.report(), timeout)
+        if worker in (cache.get(WORKERS_KEY) or ()):
+            return
+        # Only a worker's first publish edits the shared list; the lock keeps two
+        # workers starting together from overwriting each other's entry
+        if cache.add(WORKERS_LOCK_KEY, worker, 10):
+            try:
+                # Drop the workers whose summary expired while we are at it
+                workers = cache.get(WORKERS_KEY) or ()
+                live = cache.get_many([_worker_key(w) for w in workers])
+                cache.set(WORKERS_KEY, sorted({w for w in workers if _worker_key(w) in live} | {worker}), None)
+            finally:
+                cache.delete(WORKERS_LOCK_KEY)
+
+
+def _worker_key(worker):
+    return f'{CACHE_PREFIX}:worker:{worker}'
+
+
+def merge(reports):
+    """Combine the per-process summaries of one view into one."""
+    requests = sum(r['requests'] for r in reports)
+
+    def weighted(metric, p, digits):
+        value = sum(r[metric][p] * r['requests'] for r in reports) / requests
+        return round(value, digits)
+
+    return {
+        'requests': requests,
+        'wall_ms': {p: weighted('wall_ms', p, 2) for p in reports[0]['wall_ms']},
+        'queries': {p: weighted('queries', p, 1) for p in reports[0]['queries']},
+        'db_ms': {p: weighted('db_ms', p, 2) for p in reports[0]['db_ms']},
+        'slowest_query': max((r['slowest_query'] for r in reports), key=lambda q: q['ms']),
+    }
+
+
+def collect_published():
+    """Merge the summaries every live process has published into one report."""
+    merged = {}
+    workers = cache.get(WORKERS_KEY) or ()
+    snapshots = cache.get_many([_worker_key(worker) for worker in workers])
+    for snapshot in snapshots.values():
+        for name, report in snapshot.items():
+            merged.setdefault(name, []).append(report)
+    return {name: merge(reports) for name, reports in sorted(merged.items())}
+
+
+registry = ViewStatsRegistry()
@@ -0,0 +1,23 @@
+# WSGI profile: gunicorn -c deploy/gunicorn_wsgi.py bookEx.wsgi:application
+# Every request holds one worker thread from start to finish.
+import multiprocessing
+import os
+
+bind = os.environ.get('BOOKEX_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('BOOKEX_THREADS', 8))
+keepalive = 5
+timeout = 30
+
+# Lets the bookMng.W001 system check see how many processes share the cache
+os.environ['BOOKEX_WORKERS'] = str(workers)
+
+
+def on_starting(server):
+    # Print the system check warnings before forking, e.g. a per-process cache
+    import django
+    from django.core.management import call_command
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bookEx.settings')
+    django.setup()
+    call_command('check')